@@ -1,7 +1,10 @@
 import argparse
+import sys
+from pathlib import Path
 
 from . import __version__
-from .backend import Backend, DeleteOptions, RunOptions
+from .compression import COMPRESSION_CHOICES
+from .daemon import forward, serve, socket_path
 from .engine import ArgparseEngine, Command
 
 
@@ -13,13 +16,43 @@ class kodmanEngine(ArgparseEngine):
             super().__init__()
 
         self.get_env("KODMAN_SERVICE_ACCOUNT", str)
+        self.get_env("KODMAN_DAEMON_SOCKET", str)
+        self.get_env("KODMAN_TIMINGS", str)
+        self.get_env("KODMAN_VOLUME_CACHE", str)
+        self.get_env("KODMAN_INIT_IMAGE", str)
         self._parser.add_argument(
             "-v",
             "--version",
             action="version",
             version=__version__,
         )
-        self._ctx = Backend(self._log)
+        self._parser.add_argument(
+            "--timings",
+            action="store_true",
+            help="Report phase timings as JSON on stderr, or in $KODMAN_TIMINGS",
+        )
+
+    def get_ctx(self):
+        if self._ctx is None:
+            # Imports the kubernetes client, so only done for cluster commands
+            from .backend import Backend
+
+            self._ctx = Backend(self._log)
+        return self._ctx
+
+    def after_command(self, args):
+        # KODMAN_TIMINGS is a file to write the report to, or '-' for stderr
+        target = self._env_vals["KODMAN_TIMINGS"] or ("-" if args.timings else "")
+        if target and self._ctx is not None:
+            self._ctx.timings.write(target, args.cli_command)
+
+    def relaunch(self, argv: list[str]):
+        """Launch again in a process whose environment has been replaced."""
+        self.refresh_env()
+        self._debug = bool(self._env_vals["KODMAN_DEBUG"])
+        if self._ctx is not None:
+            self._ctx.timings.clear()  # Only report on this command
+        self.launch(argv)
 
 
 engine = kodmanEngine()
@@ -46,12 +79,51 @@ class Run(Command):
             action="append",
             help="Bind mount a volume into the container",
         )
+        parser_run.add_argument(
+            "--dry-run",
+            help="Print the files and bytes volumes would upload, then exit",
+            action="store_true",
+        )
+        parser_run.add_argument(
+            "--compression",
+            choices=COMPRESSION_CHOICES,
+            default="none",
+            help="Compress volumes in transit ('auto' picks a codec per volume)",
+        )
+        parser_run.add_argument(
+            "--upload-parallelism",
+            type=int,
+            default=4,
+            help="Maximum number of concurrent volume uploads",
+        )
+        parser_run.add_argument(
+            "--upload-shards",
+            type=int,
+            default=1,
+            help="Split each directory volume into this many parallel uploads",
+        )
+        parser_run.add_argument(
+            "--pool",
+            help="Claim a pre-created pod from 'kodman pool', needs --entrypoint",
+            action="store_true",
+        )
+        parser_run.add_argument(
+            "--volume-cache",
+            type=str,
+            help="PVC caching ':cache' volumes by content, or $KODMAN_VOLUME_CACHE",
+        )
+        parser_run.add_argument(
+            "--init-image",
+            type=str,
+            help="Image receiving uploads, busybox unless set or $KODMAN_INIT_IMAGE",
+        )
         parser_run.add_argument("image")
         parser_run.add_argument("command", nargs="?")
         parser_run.add_argument("args", nargs=argparse.REMAINDER, default=[])
 
     def do(self, args, ctx, env, log):
-        ctx.connect()
+        from .backend import DeleteOptions, RunOptions
+
         log.debug(f"Image: {args.image}")
         pod_name = ""
         k8s_command = []
@@ -65,6 +137,11 @@ class Run(Command):
 
         log.debug(f"Command: {k8s_command}")
         log.debug(f"Args: {k8s_args}")
+        if args.pool and not k8s_command:
+            # The command replaces the image's ENTRYPOINT, which kodman can't read
+            print("--pool needs --entrypoint", file=sys.stderr)
+            self.exit_code = 1
+            return
 
         service_a = env["KODMAN_SERVICE_ACCOUNT"]
         options = RunOptions(
@@ -73,16 +150,304 @@ class Run(Command):
             args=k8s_args,
             volumes=args.volume,
             service_account=service_a if service_a else "",
+            compression=args.compression,
+            upload_parallelism=args.upload_parallelism,
+            upload_shards=args.upload_shards,
+            pool=args.pool,
+            volume_cache=args.volume_cache or env["KODMAN_VOLUME_CACHE"] or "",
+            init_image=args.init_image or env["KODMAN_INIT_IMAGE"] or "",
         )
 
-        pod_name = ctx.run(options)
+        if args.dry_run:
+            sizes = ctx.volume_sizes(options)
+            engine.stop_status()
+            for size in sizes:
+                src, dst = size.volume.src, size.volume.dst
+                print(f"{src} -> {dst}: {size.files} files, {size.bytes} bytes")
+            files, total = sum(s.files for s in sizes), sum(s.bytes for s in sizes)
+            print(f"Total: {files} files, {total} bytes")
+            return
+
+        ctx.connect()
+        pod_name = ctx.run(options, engine.stdout())
         self.exit_code = ctx.return_code
         if args.rm:
-            ctx.delete(DeleteOptions(pod_name))
+            ctx.delete(DeleteOptions(pod_name, wait=False))
+
+
+@engine.add_command
+class RunMany(Command):
+    def add(self, parser):
+        parser_many = parser.add_parser(
+            "run-many", help="Run the containers listed in a YAML or JSONL manifest"
+        )
+        parser_many.add_argument(
+            "--parallelism",
+            "-j",
+            type=int,
+            default=8,
+            help="Maximum number of containers running at once",
+        )
+        parser_many.add_argument(
+            "--rm",
+            help="Remove each container after exit",
+            action="store_true",
+        )
+        parser_many.add_argument(
+            "--log-dir",
+            type=Path,
+            help="Write each job's output to <log-dir>/<name>.log instead",
+        )
+        parser_many.add_argument("manifest", type=Path)
+
+    def do(self, args, ctx, env, log):
+        from dataclasses import replace
+
+        from .backend import AsyncBackend
+        from .batch import format_summary, load_manifest, run_many
+
+        service_a = env["KODMAN_SERVICE_ACCOUNT"]
+        jobs = load_manifest(args.manifest, service_a if service_a else "")
+        if args.rm:
+            jobs = [replace(job, rm=True) for job in jobs]
+
+        backend = AsyncBackend(log, ctx.timings)
+        backend.connect()
+        log.info(f"Running {len(jobs)} jobs")
+        results = run_many(
+            backend, jobs, args.parallelism, engine.stdout(), log, args.log_dir
+        )
+        engine.stop_status()
+        print(format_summary(results))
+        self.exit_code = int(any(result.exit_code for result in results))
+
+
+@engine.add_command
+class Cp(Command):
+    def add(self, parser):
+        parser_cp = parser.add_parser(
+            "cp", help="Copy files out of a running container to the local host"
+        )
+        parser_cp.add_argument(
+            "--container",
+            "-c",
+            default="",
+            help="Container of the pod to copy from (default is the first one)",
+        )
+        parser_cp.add_argument("source", help="POD:PATH")
+        parser_cp.add_argument("dest", type=Path)
+
+    def do(self, args, ctx, env, log):
+        from .backend import CpOptions
+
+        pod, _, path = args.source.partition(":")
+        if not pod or not path:
+            print(f"Source must be POD:PATH, not '{args.source}'", file=sys.stderr)
+            self.exit_code = 1
+            return
+
+        ctx.connect()
+        ctx.cp(CpOptions(pod, path, args.dest, args.container))
+
+
+@engine.add_command
+class Sync(Command):
+    def add(self, parser):
+        parser_sync = parser.add_parser(
+            "sync", help="Copy only the changes of a local directory into a container"
+        )
+        parser_sync.add_argument(
+            "--container",
+            "-c",
+            default="",
+            help="Container of the pod to sync to (default is the first one)",
+        )
+        parser_sync.add_argument(
+            "--exclude",
+            action="append",
+            default=[],
+            help="Leave out paths matching this glob, like a .kodmanignore line",
+        )
+        parser_sync.add_argument(
+            "--compression",
+            choices=COMPRESSION_CHOICES,
+            default="none",
+            help="Compress changes in transit ('auto' picks a codec)",
+        )
+        parser_sync.add_argument("source", type=Path)
+        parser_sync.add_argument("dest", help="POD:PATH")
+
+    def do(self, args, ctx, env, log):
+        from .backend import SyncOptions
+
+        pod, _, path = args.dest.partition(":")
+        if not pod or not path:
+            print(f"Destination must be POD:PATH, not '{args.dest}'", file=sys.stderr)
+            self.exit_code = 1
+            return
+
+        ctx.connect()
+        ctx.sync(
+            SyncOptions(
+                args.source, pod, path, args.container, args.exclude, args.compression
+            )
+        )
+
+
+@engine.add_command
+class Ps(Command):
+    def add(self, parser):
+        parser_ps = parser.add_parser("ps", help="List containers started by kodman")
+        parser_ps.add_argument(
+            "--all",
+            "-a",
+            help="Show all containers (default shows just running)",
+            action="store_true",
+        )
+        parser_ps.add_argument(
+            "--filter",
+            "-f",
+            action="append",
+            default=[],
+            help="Filter by image=<image> or owner=<user>",
+        )
+        parser_ps.add_argument(
+            "--quiet",
+            "-q",
+            help="Only display pod names",
+            action="store_true",
+        )
+        parser_ps.add_argument(
+            "--page-size",
+            type=int,
+            default=500,
+            help="Number of pods fetched per request",
+        )
+
+    def do(self, args, ctx, env, log):
+        from datetime import datetime, timezone
+
+        from .backend import PsOptions
+        from .ps import format_row, header
+
+        filters = {}
+        for item in args.filter:
+            key, _, value = item.partition("=")
+            if key not in ("image", "owner") or not value:
+                print(f"Invalid filter '{item}'", file=sys.stderr)
+                self.exit_code = 1
+                return
+            filters[key] = value
+
+        ctx.connect()
+        options = PsOptions(all=args.all, page_size=args.page_size, **filters)
+        now = datetime.now(timezone.utc)
+        engine.stop_status()
+        if not args.quiet:
+            print(header())
+        for pod in ctx.ps(options):
+            print(pod.metadata.name if args.quiet else format_row(pod, now))
+
+
+@engine.add_command
+class Prune(Command):
+    def add(self, parser):
+        parser_prune = parser.add_parser(
+            "prune", help="Remove all finished containers started by kodman"
+        )
+        parser_prune.add_argument(
+            "--all",
+            "-a",
+            help="Also remove running and pooled containers",
+            action="store_true",
+        )
+
+    def do(self, args, ctx, env, log):
+        from .backend import PruneOptions
+
+        ctx.connect()
+        names = ctx.prune(PruneOptions(all=args.all))
+        engine.stop_status()
+        if names:
+            print("Deleted Containers:")
+            print("\n".join(names))
+        print(f"Total: {len(names)}")
+
+
+@engine.add_command
+class Pool(Command):
+    def add(self, parser):
+        parser_pool = parser.add_parser(
+            "pool", help="Keep pods parked and ready for 'kodman run --pool'"
+        )
+        parser_pool.add_argument(
+            "--size",
+            type=int,
+            default=2,
+            help="Number of idle pods to keep per image",
+        )
+        parser_pool.add_argument(
+            "--ttl",
+            type=int,
+            default=600,
+            help="Seconds after which idle pods are replaced",
+        )
+        parser_pool.add_argument(
+            "--once",
+            help="Reconcile the pool once and exit",
+            action="store_true",
+        )
+        parser_pool.add_argument(
+            "--init-image",
+            type=str,
+            help="Image receiving uploads, busybox unless set or $KODMAN_INIT_IMAGE",
+        )
+        parser_pool.add_argument("images", nargs="+")
+
+    def do(self, args, ctx, env, log):
+        from .backend import PoolOptions
+
+        ctx.connect()
+        service_a = env["KODMAN_SERVICE_ACCOUNT"]
+        options = PoolOptions(
+            images=args.images,
+            size=args.size,
+            ttl=args.ttl,
+            service_account=service_a if service_a else "",
+            once=args.once,
+            init_image=args.init_image or env["KODMAN_INIT_IMAGE"] or "",
+        )
+        try:
+            ctx.pool(options)
+        except KeyboardInterrupt:
+            log.info("Pool maintenance stopped")
+
+
+@engine.add_command
+class Daemon(Command):
+    def add(self, parser):
+        parser.add_parser(
+            "daemon", help="Serve kodman commands from a warm process over a socket"
+        )
+
+    def do(self, args, ctx, env, log):
+        ctx.connect()
+        engine.stop_status()  # No spinner threads may be running when forking
+        try:
+            serve(
+                socket_path(env["KODMAN_DAEMON_SOCKET"]),
+                engine.relaunch,
+                ctx.connect,
+                log,
+            )
+        except KeyboardInterrupt:
+            log.info("Daemon stopped")
 
 
 @engine.add_command
 class Version(Command):
+    needs_context = False
+
     def add(self, parser):
         parser.add_parser("version", help="Display the kodman version information")
 
@@ -91,6 +456,11 @@ class Version(Command):
 
 
 def cli():
+    code = forward(
+        sys.argv[1:], socket_path(engine.get_env("KODMAN_DAEMON_SOCKET", str))
+    )
+    if code is not None:
+        sys.exit(code)
     engine.launch()
 
 
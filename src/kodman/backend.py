@@ -1,16 +1,67 @@
-import io
+import asyncio
+import functools
+import getpass
+import hashlib
 import logging
+import re
+import shlex
 import sys
-import tarfile
+import threading
 import time
-from dataclasses import dataclass, field
-from pathlib import Path
-from typing import Any
+from collections.abc import AsyncIterator, Callable, Generator, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from enum import IntEnum
+from pathlib import Path, PurePosixPath
+from typing import Any, Protocol
 
 from kubernetes import client, config, watch
+from kubernetes.client.models.v1_container_status import V1ContainerStatus
 from kubernetes.client.models.v1_pod import V1Pod
 from kubernetes.client.rest import ApiException
 from kubernetes.stream import stream
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+from .cache import (
+    CACHE_DIR,
+    TreeManifest,
+    add_cached_tree,
+    cache_run_dir,
+    hash_tree,
+    lookup_blobs,
+    publish_script,
+)
+from .compression import CODECS, Codec, sample_tree, select_codec
+from .delta import sync_k8s
+from .ignore import IgnoreRules
+from .projection import (
+    PROJECTION_LIMIT,
+    ProjectedFile,
+    projected_files,
+    projection_object,
+    projection_volume,
+)
+from .shared import (
+    MOUNTINFO,
+    SharedClaim,
+    claim_mounts,
+    find_claim,
+    mount_points,
+    runner_pod_name,
+    share_claim,
+)
+from .timings import Timings
+from .transfer import (
+    TransferStats,
+    cp_from_k8s,
+    cp_k8s,
+    measure_link,
+    plan_shards,
+    probe_gnu_tar,
+    probe_remote_codecs,
+    tree_size,
+)
 
 
 @dataclass(frozen=True)
@@ -20,6 +71,12 @@ class RunOptions:
     args: list[str] = field(default_factory=lambda: [])
     volumes: list[str] = field(default_factory=lambda: [])
     service_account: str = field(default_factory=lambda: "")
+    compression: str = field(default_factory=lambda: "none")
+    upload_parallelism: int = field(default_factory=lambda: 4)
+    upload_shards: int = field(default_factory=lambda: 1)
+    pool: bool = field(default_factory=lambda: False)
+    volume_cache: str = field(default_factory=lambda: "")
+    init_image: str = field(default_factory=lambda: "")
 
     def __hash__(self):
         hash_candidates = (
@@ -44,59 +101,538 @@ class RunOptions:
         return _hash
 
 
+@dataclass(frozen=True)
+class Volume:
+    src: Path
+    dst: Path
+    ignore: IgnoreRules = field(default_factory=lambda: IgnoreRules())
+    rw: bool = field(default_factory=lambda: False)
+    ro: bool = field(default_factory=lambda: False)
+    cache: bool = field(default_factory=lambda: False)
+    shared: SharedClaim | None = field(default_factory=lambda: None)
+    secret: bool = field(default_factory=lambda: False)
+    projection: tuple[ProjectedFile, ...] = field(default_factory=lambda: ())
+
+    @property
+    def copy_back(self) -> bool:
+        """Whether files written by the run have to be downloaded afterwards."""
+        return self.rw and self.shared is None
+
+
+@dataclass(frozen=True)
+class VolumeSize:
+    volume: Volume
+    files: int
+    bytes: int
+
+
 @dataclass(frozen=True)
 class DeleteOptions:
     name: str
+    wait: bool = field(default_factory=lambda: True)
+
+
+@dataclass(frozen=True)
+class CpOptions:
+    pod: str
+    source: str
+    dest: Path
+    container: str = field(default_factory=lambda: "")
+
+
+@dataclass(frozen=True)
+class SyncOptions:
+    source: Path
+    pod: str
+    dest: str
+    container: str = field(default_factory=lambda: "")
+    exclude: list[str] = field(default_factory=lambda: [])
+    compression: str = field(default_factory=lambda: "none")
+
+
+@dataclass(frozen=True)
+class PruneOptions:
+    all: bool = field(default_factory=lambda: False)
+
+
+@dataclass(frozen=True)
+class PsOptions:
+    all: bool = field(default_factory=lambda: False)
+    image: str = field(default_factory=lambda: "")
+    owner: str = field(default_factory=lambda: "")
+    page_size: int = field(default_factory=lambda: 500)
+
+
+@dataclass(frozen=True)
+class PoolOptions:
+    images: list[str]
+    size: int = field(default_factory=lambda: 2)
+    ttl: int = field(default_factory=lambda: 600)
+    service_account: str = field(default_factory=lambda: "")
+    once: bool = field(default_factory=lambda: False)
+    init_image: str = field(default_factory=lambda: "")
+
+
+MANAGED_BY_LABEL = "app.kubernetes.io/managed-by"
+IMAGE_LABEL = "kodman/image"
+OWNER_LABEL = "kodman/owner"
+CREATED_LABEL = "kodman/created"
+IMAGE_ANNOTATION = "kodman/image"
+PRUNE_FIELD_SELECTOR = "status.phase!=Pending,status.phase!=Running"
+UNFINISHED_FIELD_SELECTOR = "status.phase!=Succeeded,status.phase!=Failed"
+POOL_LABEL = "kodman/pool"
+POOL_STATE_LABEL = "kodman/pool-state"
+POOL_DIR = Path("/kodman")
+POOL_VOLUMES = POOL_DIR / "volumes"
+POOL_ENTRYPOINT = POOL_DIR / "entrypoint.sh"
+TRIGGER_PATH = "/tmp/trigger"
+UPLOADS_PATH = "/tmp/uploads"
+API_POOL_SIZE = 100  # Concurrent runs each hold a connection to stream logs
+EXEC_CONTAINER = "kodman-exec"
+INIT_IMAGE = "busybox"  # Receives uploads, files with holes are sparse with GNU tar
+COPY_BACK_CONTAINER = "kodman-copy-back"
+COPY_BACK_DIR = Path("/volumes")
+COPY_BACK_TRIGGER = "/tmp/copy-back"
+COPY_BACK_TIMEOUT = 24 * 3600  # Sidecars of runs kodman lost track of exit then
+STATE_DIR = Path("/kodman-state")
+UPLOADED_STAMP = STATE_DIR / "uploaded"
+
+
+def label_value(text: str) -> str:
+    """Squash text into a valid label value, e.g. 'ubuntu:22.04' -> 'ubuntu_22.04'."""
+    value = re.sub(r"[^A-Za-z0-9_.-]", "_", text)[:63]
+    return re.sub(r"^[^A-Za-z0-9]+|[^A-Za-z0-9]+$", "", value)
+
+
+def current_owner() -> str:
+    try:
+        return getpass.getuser()
+    except (KeyError, OSError):  # No passwd entry, e.g. in a container
+        return "unknown"
+
+
+def pool_key(image: str, service_account: str) -> str:
+    """Label-safe identifier of the pool serving an image/serviceAccount pair."""
+    return hashlib.sha1(f"{image}\0{service_account}".encode()).hexdigest()[:16]
+
+
+def pool_entrypoint(command: list[str]) -> str:
+    """Script run by a pooled pod once claimed.
+
+    Pooled pods are created before the command and volumes are known, so
+    volumes are uploaded under a shared directory and copied into place here.
+    """
+    return (
+        f"if [ -d {POOL_VOLUMES} ]; then cp -a {POOL_VOLUMES}/. /; fi\n"
+        f"exec {shlex.join(command)}\n"
+    )
+
+
+def wait_for_trigger(path: str = TRIGGER_PATH, timeout: int = 0) -> str:
+    """Init container script that blocks on a FIFO until the trigger writes to it.
+
+    A regular file at path, written by a trigger that won the race against
+    mkfifo, also releases it immediately. With a timeout, a background timer
+    sends the trigger after that many seconds.
+    """
+    wait = f"read _ < {path}"
+    if timeout:
+        timer = f"(trap 'kill $s; exit' TERM; sleep {timeout} & s=$!; wait $s;"
+        timer += f"echo timeout > {path}) & timer=$!"
+        wait = f"{timer}; {wait}; kill $timer 2>/dev/null"
+    return (
+        f"mkfifo {path} 2>/dev/null;"
+        f"if [ -p {path} ]; then {wait}; fi;"
+        'echo "Trigger received"'
+    )
+
+
+def send_trigger(path: str = TRIGGER_PATH) -> str:
+    return f"echo go > {path}"
+
+
+def after_uploads(count: int, trigger: str, path: str = UPLOADS_PATH) -> str:
+    """Run trigger once the last of count concurrent upload sessions is done."""
+    return (
+        f"echo >> {path};"
+        f"if [ $(wc -l < {path}) -ge {count} ] && mkdir {path}.done 2>/dev/null;"
+        f"then {trigger}; fi"
+    )
+
+
+def mark_uploaded(path: Path = UPLOADED_STAMP) -> str:
+    """Stamp the end of uploads, for copying back the files changed after it.
+
+    Backdated by a second as busybox find -newer compares whole seconds.
+    """
+    return f"touch -d @$(($(date +%s) - 1)) {path}"
+
+
+class PodState(IntEnum):
+    PENDING = 0
+    INIT_RUNNING = 1
+    TRIGGERED = 2
+    RUNNING = 3
+    TERMINATED = 4
+
+
+def get_pod_state(pod: V1Pod) -> PodState:
+    if not pod.status:
+        raise ValueError("Empty pod status")
+    status = pod.status
+    if status.phase in ("Succeeded", "Failed"):
+        return PodState.TERMINATED
+    for container_status in status.container_statuses or []:
+        if container_status.state and container_status.state.terminated:
+            return PodState.TERMINATED
+    if status.phase == "Running":
+        return PodState.RUNNING
+    for init_status in status.init_container_statuses or []:
+        if init_status.state and init_status.state.terminated:
+            return PodState.TRIGGERED
+        if init_status.state and init_status.state.running:
+            return PodState.INIT_RUNNING
+    return PodState.PENDING
+
+
+def exec_status(pod: V1Pod) -> V1ContainerStatus | None:
+    """Status of the container running the command, rather than a sidecar."""
+    statuses = (pod.status.container_statuses or []) if pod.status else []
+    for container_status in statuses:
+        if container_status.name == EXEC_CONTAINER:
+            return container_status
+    return statuses[0] if statuses else None
+
+
+def get_exit_code(pod: V1Pod) -> int:
+    if not pod.status:
+        raise ValueError("Empty pod status")
+    container_status = exec_status(pod)
+    if container_status and container_status.state:
+        if container_status.state.terminated:
+            return container_status.state.terminated.exit_code
+    return 0 if pod.status.phase == "Succeeded" else 1
+
+
+class PodFailure(Exception):
+    def __init__(self, reason: str, message: str):
+        super().__init__(f"{reason}: {message}")
+        self.reason = reason
+        self.message = message
+
+
+# Reasons that will not resolve without changing the pod spec
+FATAL_REASONS = {
+    "CreateContainerConfigError",
+    "CreateContainerError",
+    "ErrImageNeverPull",
+    "Failed",
+    "InvalidImageName",
+    "RunContainerError",
+}
+KNOWN_REASONS = (
+    "CreateContainerConfigError",
+    "CreateContainerError",
+    "ErrImageNeverPull",
+    "ErrImagePull",
+    "ImagePullBackOff",
+    "InvalidImageName",
+    "RunContainerError",
+)
+PERMANENT_PULL_ERRORS = (
+    "not found",
+    "manifest unknown",
+    "pull access denied",
+    "unauthorized",
+    "does not exist",
+)
+
+
+def classify_event(event: client.CoreV1Event) -> tuple[str, bool]:
+    """Return the failure reason of a Warning event and whether it is fatal."""
+    reason = event.reason or ""
+    message = event.message or ""
+    # The kubelet reports container errors under generic reasons
+    if reason in ("Failed", "BackOff"):
+        for known in KNOWN_REASONS:
+            if known in message:
+                reason = known
+                break
+        else:
+            if "pull" in message.lower():
+                reason = "ErrImagePull" if reason == "Failed" else "ImagePullBackOff"
+
+    if reason in ("ErrImagePull", "ImagePullBackOff"):
+        # Pulls are retried forever, only give up when they cannot succeed
+        return reason, any(e in message.lower() for e in PERMANENT_PULL_ERRORS)
+    return reason, reason in FATAL_REASONS
+
+
+def in_thread(func: Callable[..., Any], *args, **kwargs) -> "asyncio.Future[Any]":
+    """Run a blocking call on a daemon thread and return a future for it.
+
+    Unlike asyncio.to_thread, nothing waits for the thread on shutdown, so an
+    interrupted run does not hang on a log stream that is still open.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(result=None, exception: BaseException | None = None):
+        if future.done():
+            return  # Cancelled while the call was running
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def target():
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            callback = functools.partial(settle, exception=e)
+        else:
+            callback = functools.partial(settle, result)
+        try:
+            loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            pass  # Event loop already closed
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+
+class PodInformer:
+    """Share one pod watch and one event watch between all pods being run.
+
+    Both watches cover the whole namespace, pods by the kodman label and events
+    by kind, unless scoped to a single pod_name, and run on background threads
+    which hand updates to the event loop of the subscribed pod. Each stream
+    resumes from the last seen resourceVersion after a disconnect and falls
+    back to a fresh watch if that version has expired (410 Gone). The watches
+    only run while at least one pod is subscribed.
+    """
+
+    def __init__(
+        self, kube_conn: client.CoreV1Api, namespace: str, log, pod_name: str = ""
+    ):
+        self._client = kube_conn
+        self._namespace = namespace
+        self._log = log
+        self._pod_name = pod_name
+        self._subscribers: dict[str, asyncio.Queue] = {}
+        self._watches: list[watch.Watch] = []
+        self._stopped = threading.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def subscribe(self, pod_name: str) -> asyncio.Queue:
+        if not self._subscribers:
+            self._start()
+        self._subscribers[pod_name] = asyncio.Queue()
+        return self._subscribers[pod_name]
+
+    def unsubscribe(self, pod_name: str):
+        self._subscribers.pop(pod_name, None)
+        if not self._subscribers:
+            self._stopped.set()
+            for w in self._watches:
+                w.stop()
+
+    def _start(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = threading.Event()
+        self._watches = []
+        pods = {"label_selector": f"{MANAGED_BY_LABEL}=kodman"}
+        events = {"field_selector": "involvedObject.kind=Pod"}
+        if self._pod_name:
+            pods = {"field_selector": f"metadata.name={self._pod_name}"}
+            events["field_selector"] += f",involvedObject.name={self._pod_name}"
+        for func, selector in (
+            (self._client.list_namespaced_pod, pods),
+            (self._client.list_namespaced_event, events),
+        ):
+            w = watch.Watch()
+            self._watches.append(w)
+            threading.Thread(
+                target=self._produce,
+                args=(w, func, selector, self._loop, self._stopped),
+                daemon=True,
+            ).start()
+
+    def _stream(
+        self,
+        w: watch.Watch,
+        func: Callable,
+        selector: dict[str, str],
+        stopped: threading.Event,
+    ) -> Generator[dict[str, Any], None, None]:
+        resource_version = None
+        while not stopped.is_set():
+            kwargs = dict(selector)
+            if resource_version:
+                kwargs["resource_version"] = resource_version
+            try:
+                events: Iterator[dict[str, Any]] = w.stream(  # type: ignore
+                    func, namespace=self._namespace, **kwargs
+                )
+                for event in events:
+                    resource_version = event["object"].metadata.resource_version
+                    yield event
+            except ApiException as e:
+                if e.status != 410:
+                    raise e
+                self._log.debug("Watch expired, restarting")
+                resource_version = None
+            except (ProtocolError, ReadTimeoutError) as e:
+                self._log.debug(f"Watch disconnected ({e}), resuming")
 
+    def _produce(
+        self,
+        w: watch.Watch,
+        func: Callable,
+        selector: dict[str, str],
+        loop: asyncio.AbstractEventLoop,
+        stopped: threading.Event,
+    ):
+        try:
+            for event in self._stream(w, func, selector, stopped):
+                obj = event["object"]
+                if isinstance(obj, V1Pod):
+                    name = str(obj.metadata.name)  # type: ignore
+                else:
+                    name = str(obj.involved_object.name)
+                loop.call_soon_threadsafe(self._dispatch, name, event)
+        except RuntimeError:
+            pass  # Event loop closed while the watch was still open
+        except Exception as e:
+            try:
+                loop.call_soon_threadsafe(self._fail, e)
+            except RuntimeError:
+                pass
+
+    def _dispatch(self, pod_name: str, event: dict[str, Any]):
+        if queue := self._subscribers.get(pod_name):
+            queue.put_nowait(event)
+
+    def _fail(self, exception: Exception):
+        for queue in self._subscribers.values():
+            queue.put_nowait(exception)
+
+
+class PodWatcher:
+    """Follow a single pod through its lifecycle.
+
+    Updates come from a PodInformer shared with other pods. The current pod
+    and its events are read once on start, so nothing from before the
+    subscription is missed. Events are only inspected until the pod is
+    running.
+    """
+
+    def __init__(
+        self,
+        informer: PodInformer,
+        kube_conn: client.CoreV1Api,
+        namespace: str,
+        pod_name: str,
+        log: logging.Logger,
+    ):
+        self._informer = informer
+        self._client = kube_conn
+        self._namespace = namespace
+        self._pod_name = pod_name
+        self._log = log
+        self._queue = informer.subscribe(pod_name)
+        self._seen_events: set[str] = set()
+        self.pod: V1Pod | None = None
+        self.state = PodState.PENDING
+
+    async def start(self):
+        pod = await in_thread(
+            self._client.read_namespaced_pod,
+            name=self._pod_name,
+            namespace=self._namespace,
+        )
+        events = await in_thread(
+            self._client.list_namespaced_event,
+            namespace=self._namespace,
+            field_selector=f"involvedObject.name={self._pod_name}",
+        )
+        self._queue.put_nowait({"type": "MODIFIED", "object": pod})
+        for event in events.items:
+            self._queue.put_nowait({"type": "ADDED", "object": event})
+
+    def _handle_event(self, event: client.CoreV1Event):
+        if self.state >= PodState.RUNNING or event.type != "Warning":
+            return
+        if event.metadata.uid in self._seen_events:
+            return  # Repeats of an event only bump its count
+        self._seen_events.add(event.metadata.uid)  # type: ignore
+        reason, fatal = classify_event(event)
+        self._log.debug(f"{reason} ({'fatal' if fatal else 'recoverable'})")
+        if fatal:
+            raise PodFailure(reason, event.message)  # type: ignore
+        print(f"Warning: {event.message}", file=sys.stderr)
+
+    async def until(self, target: PodState) -> AsyncIterator[V1Pod]:
+        """Yield pod updates until the pod reaches the target state.
+
+        Raises PodFailure as soon as a fatal event is reported for the pod.
+        """
+        while self.state < target:
+            item = await self._queue.get()
+            if isinstance(item, Exception):
+                raise item
+            obj = item["object"]
+            if not isinstance(obj, V1Pod):
+                self._handle_event(obj)
+                continue
+            if item["type"] == "DELETED":
+                raise RuntimeError(f"Pod {self._pod_name} was deleted")
+            self.pod = obj
+            state = max(self.state, get_pod_state(self.pod))
+            if state != self.state:
+                self._log.debug(f"Pod state: {self.state.name} -> {state.name}")
+                self.state = state
+            if self.state < target:
+                yield self.pod
+
+    def stop(self):
+        self._informer.unsubscribe(self._pod_name)
 
-def cp_k8s(
+
+class OutputStream(Protocol):
+    def write(self, data: bytes, /) -> int: ...
+
+    def flush(self) -> None: ...
+
+
+def stream_logs(
     kube_conn: client.CoreV1Api,
     namespace: str,
     pod_name: str,
-    container: str,
-    source_path: Path,
-    dest_path: Path,
-    log: logging.Logger,
-):
-    log.info(f"Transferring {source_path} to {dest_path}")
-    buf = io.BytesIO()
-
-    log.debug(f"Compressing {source_path}")
-    with tarfile.open(fileobj=buf, mode="w:tar") as tar:  # To compress set 'w:gz'
-        tar.add(source_path, arcname=dest_path)
-    buf.seek(0)
-    compressed_size = buf.getbuffer().nbytes
-    log.debug(f"Compressed to {compressed_size} bytes")
-
-    exec_command = ["tar", "xvf", "-", "-C", "/"]  # To decompress set 'xzvf'
-    resp = stream(
-        kube_conn.connect_get_namespaced_pod_exec,
-        pod_name,
-        namespace,
-        container=container,
-        command=exec_command,
-        stderr=True,
-        stdin=True,
-        stdout=True,
-        tty=False,
+    out: OutputStream,
+) -> int:
+    """Copy the followed log of a pod to out, returning the number of bytes.
+
+    Bytes are passed through as received, without decoding or line splitting,
+    so blank lines and a final line without a newline are kept. Each chunk is
+    flushed so interactive output is not held back.
+    """
+    resp = kube_conn.read_namespaced_pod_log(
+        name=pod_name,
+        namespace=namespace,
+        container=EXEC_CONTAINER,  # Not a sidecar
+        follow=True,
         _preload_content=False,
     )
-
-    chunk_size = 10 * 1024 * 1024
-    steps = -(compressed_size // -chunk_size)  # Ceiling division
-    log.debug(f"Transferring {steps} chunks")
-    counter = 0
-    while resp.is_open():
-        resp.update(timeout=1)
-        if read := buf.read(chunk_size):
-            resp.write_stdin(read)
-        else:
-            log.debug("Empty buffer")
-            break
-        log.info(f"Transfer {counter * 100 // steps}% completed")
-        counter += 1
-    resp.close()
-    log.info("Transfer done")
+    total = 0
+    try:
+        for chunk in resp.stream(amt=None, decode_content=False):  # type: ignore
+            out.write(chunk)
+            out.flush()
+            total += len(chunk)
+    finally:
+        resp.release_conn()  # type: ignore
+    return total
 
 
 def get_incluster_context():
@@ -106,76 +642,356 @@ def get_incluster_context():
         context["namespace"] = f.read().strip()
     context["cluster"] = "default"
     context["user"] = "default"
+    context["in_cluster"] = True
     return context
 
 
-class Backend:
-    def __init__(self, log):
-        self.return_code = 0
+@dataclass(frozen=True)
+class RunResult:
+    pod_name: str
+    exit_code: int
+
+
+class BaseBackend:
+    """Cluster access shared by the asyncio and blocking backends."""
+
+    def __init__(self, log, timings: Timings | None = None):
         self._log = log
+        self.timings = timings or Timings()
         self._polling_freq = 1
         self._grace_period = 2  # Is this too aggressive?
+        self._informer: PodInformer | None = None
+        self._link_throughput: float | None = None
+        self._connected_at: float | None = None
+        self._config_ttl = 60  # Seconds a loaded kube config is reused for
+
+    def _pod_informer(self, namespace: str, pod_name: str) -> PodInformer:
+        if self._informer is None:
+            self._informer = PodInformer(self._client, namespace, self._log)
+        return self._informer
 
     def connect(self):
+        if (
+            self._connected_at is not None
+            and time.monotonic() - self._connected_at < self._config_ttl
+        ):
+            return  # Already connected, e.g. inherited from a kodman daemon
+
         # Load config for user/serviceaccount
         # https://github.com/kubernetes-client/python/issues/1005
-        try:
-            self._log.info(
-                "Loading kube config for user interaction from outside of cluster"
-            )
-            config.load_kube_config()
-            self._log.info("Loaded kube config successfully")
-            self._context = config.list_kube_config_contexts()[1]["context"]
-        except config.config_exception.ConfigException:
-            self._log.info("Failed to load kube config, trying in-cluster config")
-            config.load_incluster_config()
-            self._log.info("Loaded in-cluster config successfully")
-            self._context = get_incluster_context()
-
-        self._client = client.CoreV1Api()
+        with self.timings.span("connect.load_config") as span:
+            try:
+                self._log.info(
+                    "Loading kube config for user interaction from outside of cluster"
+                )
+                config.load_kube_config()
+                self._log.info("Loaded kube config successfully")
+                self._context = config.list_kube_config_contexts()[1]["context"]
+                span["source"] = "kubeconfig"
+            except config.config_exception.ConfigException:
+                self._log.info("Failed to load kube config, trying in-cluster config")
+                config.load_incluster_config()
+                self._log.info("Loaded in-cluster config successfully")
+                self._context = get_incluster_context()
+                span["source"] = "in-cluster"
+
+        configuration = client.Configuration.get_default_copy()
+        configuration.connection_pool_maxsize = max(
+            configuration.connection_pool_maxsize or 0, API_POOL_SIZE
+        )
+        self._client = client.CoreV1Api(
+            api_client=self.timings.count_calls(client.ApiClient(configuration))
+        )
+        self._connected_at = time.monotonic()
         self._log.debug("The current context is:")
         self._log.debug(f"  Cluster: {self._context['cluster']}")
         self._log.debug(f"  Namespace: {self._context['namespace']}")
         self._log.debug(f"  User: {self._context['user']}")
 
-    def run(self, options: RunOptions) -> str:
-        unique_pod_name = f"kodman-run-{hash(options)}"
+    async def _run(self, options: RunOptions, out: OutputStream | None) -> RunResult:
         init_container_name = "wait-for-signal"
         namespace = self._context["namespace"]
+        volumes = self._parse_volumes(options, create=True)
+        # Pooled pods are already running, their volumes can only be uploaded
+        if volumes and self._context.get("in_cluster") and not options.pool:
+            with self.timings.span("run.share_volumes"):
+                volumes = await in_thread(self._share_volumes, volumes)
+        if not options.pool:
+            volumes = await in_thread(self._project_volumes, volumes)
+        # Without anything to upload, the pod can start without waiting
+        handshake = not all(volume.shared or volume.projection for volume in volumes)
+        trigger = send_trigger()
+        copy_back = any(volume.copy_back for volume in volumes)
+        if copy_back:
+            trigger = f"{mark_uploaded()} && {trigger}"
+        # Hashed while the pod is scheduled
+        hashing = {
+            i: in_thread(hash_tree, volume.src, volume.ignore)
+            for i, volume in enumerate(volumes)
+            if volume.cache
+        }
+
+        mounted = any(volume.shared or volume.projection for volume in volumes)
+        pod_name = ""
+        if options.pool and (copy_back or hashing or mounted):
+            self._log.info("Pooled pods can only have volumes uploaded")
+        elif options.pool:
+            with self.timings.span("run.claim_pool_pod"):
+                pod_name = await in_thread(self._claim_pool_pod, options)
+        if pod_name:
+            self._log.info(f"Claimed pooled pod: {pod_name}")
+            volumes = [
+                replace(v, dst=POOL_VOLUMES / v.dst.relative_to("/")) for v in volumes
+            ]
+            script = shlex.quote(pool_entrypoint(options.command + options.args))
+            trigger = f"printf '%s' {script} > {POOL_ENTRYPOINT} && {trigger}"
+        else:
+            if not handshake:
+                init_container_name = ""
+            with self.timings.span("run.create_pod"):
+                pod_name = await in_thread(
+                    self._create_pod, options, init_container_name, volumes
+                )
+
+        watcher = PodWatcher(
+            self._pod_informer(namespace, pod_name),
+            self._client,
+            namespace,
+            pod_name,
+            self._log,
+        )
+        finished = False
+        try:
+            await watcher.start()
+            exit_code = await self._run_pod(
+                watcher,
+                namespace,
+                pod_name,
+                init_container_name,
+                volumes,
+                options,
+                trigger,
+                out,
+                hashing,
+            )
+            finished = True
+        except PodFailure as e:
+            exit_code = 1
+            self._log.debug(f"{e.reason}: {e.message}")
+            print(e.message, file=sys.stderr)
+        finally:
+            watcher.stop()
+            if copy_back and not finished:
+                # Otherwise the sidecar keeps the pod running until its timeout
+                await in_thread(self._release_copy_back, namespace, pod_name)
+
+        return RunResult(pod_name, exit_code)
+
+    def _parse_volumes(self, options: RunOptions, create: bool = False) -> list[Volume]:
+        """Parse 'src[:dst[:opts]]' volumes, opts being comma separated.
+
+        Volumes are writable copies by default. Options are rw, to copy
+        changed files back after the run, ro, to allow mounting the volume
+        read-only from a claim or a ConfigMap when small, cache, to upload a
+        directory through the volume cache and mount it read-only, secret, ro
+        projecting from a Secret rather than a ConfigMap, and exclude=GLOB.
+        Excludes may be repeated and add to the patterns from a .kodmanignore
+        file at the root of src. Missing rw sources are only created, once
+        all volumes are valid, if create is set.
+        """
+        volumes: list[Volume] = []
+        for options_volume in options.volumes or []:
+            process = options_volume.split(":")
+            flags = ",".join(process[2:]).split(",")
+            src = Path(process[0]).resolve()
+            dst = src  # In case no dst, set same as src
+            try:
+                dst = Path(process[1])
+            except IndexError:
+                pass
+            if not dst.is_absolute():
+                raise ValueError("Destination path must be absolute")
+            exclude = []
+            for option in flags:
+                key, _, value = option.partition("=")
+                if key == "exclude" and value:
+                    exclude.append(value)
+                elif option not in ("", "ro", "rw", "cache", "secret"):
+                    raise ValueError(f"Unknown volume option '{option}'")
+            if "cache" in flags and "rw" in flags:
+                raise ValueError("Cached volumes are read-only")
+            if "rw" in flags and ("ro" in flags or "secret" in flags):
+                raise ValueError("Volumes are either ro or rw")
+            if not (src.exists() or "rw" in flags):
+                raise FileNotFoundError(f"{src} does not exist")
+            if "cache" in flags and not (src.is_dir() and options.volume_cache):
+                raise ValueError(
+                    "Only directories can be cached, with --volume-cache set"
+                )
+            ignore = IgnoreRules.load(src, exclude) if src.is_dir() else IgnoreRules()
+            self._log.info(f"Mount: {src} to {dst}")
+            if ignore:
+                self._log.debug(f"Excluding from {src}: {ignore.patterns}")
+            volumes.append(
+                Volume(
+                    src,
+                    dst,
+                    ignore,
+                    rw="rw" in flags,
+                    ro="ro" in flags or "secret" in flags,
+                    cache="cache" in flags,
+                    secret="secret" in flags,
+                )
+            )
+        for volume in volumes:
+            if create and volume.rw and not volume.src.exists():
+                volume.src.mkdir(parents=True)  # Like docker, for output directories
+        return volumes
+
+    def _share_volumes(self, volumes: list[Volume]) -> list[Volume]:
+        """Mount volumes on claims of the pod kodman runs in instead of copying.
+
+        Sources are matched against the claims mounted in this container,
+        found from the pod spec and the mount table. Only volumes flagged ro or
+        rw are shared, default volumes stay writable copies. Volumes also stay
+        copied when the pod or claims can't be read or a claim can't be shared.
+        """
+        namespace = self._context["namespace"]
+        try:
+            pod = self._client.read_namespaced_pod(runner_pod_name(), namespace)
+            mounts = claim_mounts(pod, mount_points(MOUNTINFO.read_text()))
+        except (ApiException, OSError) as e:
+            self._log.debug(f"Not sharing volumes, runner pod unknown: {e}")
+            return volumes
+        node = pod.spec.node_name or ""  # type: ignore
+        claims: dict[str, Any] = {}
+        shared = []
+        for volume in volumes:
+            mount = find_claim(volume.src, mounts) if volume.ro or volume.rw else None
+            if mount is None:
+                shared.append(volume)
+                continue
+            try:
+                if mount.claim not in claims:
+                    claims[mount.claim] = (
+                        self._client.read_namespaced_persistent_volume_claim(
+                            mount.claim, namespace
+                        )
+                    )
+            except ApiException as e:
+                self._log.debug(f"Copying {volume.src}, claim unreadable: {e}")
+                shared.append(volume)
+                continue
+            claim = share_claim(mount, claims[mount.claim], node, volume.rw)
+            if claim is None:
+                self._log.info(f"Copying {volume.src}, {mount.claim} can't be shared")
+                shared.append(volume)
+                continue
+            self._log.info(f"Mounting {volume.src} from claim {mount.claim}")
+            shared.append(replace(volume, shared=claim, cache=False))
+        return shared
+
+    def _project_volumes(self, volumes: list[Volume]) -> list[Volume]:
+        """Mount small ro volumes from a ConfigMap, or Secret if flagged.
+
+        Volumes are taken in order while the data of each object stays under
+        PROJECTION_LIMIT. The rest, and volumes projections can't represent,
+        are uploaded. Default volumes are always uploaded as writable copies.
+        """
+        budget = {"ConfigMap": PROJECTION_LIMIT, "Secret": PROJECTION_LIMIT}
+        projected = []
+        for i, volume in enumerate(volumes):
+            kind = "Secret" if volume.secret else "ConfigMap"
+            files = None
+            if volume.ro and not (volume.cache or volume.shared):
+                files = projected_files(
+                    i, volume.src, volume.dst.name, budget[kind], volume.ignore
+                )
+            if files is None:
+                projected.append(volume)
+                continue
+            self._log.info(f"Projecting {volume.src} from a {kind}")
+            budget[kind] -= sum(file.encoded_size for file in files)
+            projected.append(replace(volume, projection=tuple(files)))
+        return projected
+
+    def volume_sizes(self, options: RunOptions) -> list[VolumeSize]:
+        """What uploading the volumes of options would send, without a cluster."""
+        sizes = []
+        for volume in self._parse_volumes(options):
+            if volume.src.exists():
+                sizes.append(VolumeSize(volume, *tree_size(volume.src, volume.ignore)))
+            else:
+                sizes.append(VolumeSize(volume, 0, 0))  # An rw source, created empty
+        return sizes
+
+    def _pod_manifest(
+        self,
+        metadata: dict[str, Any],
+        image: str,
+        init_container_name: str,
+        service_account: str,
+        init_image: str = "",
+    ) -> dict[str, Any]:
+        metadata.setdefault("labels", {}).update(
+            {
+                MANAGED_BY_LABEL: "kodman",
+                IMAGE_LABEL: label_value(image),
+                OWNER_LABEL: label_value(current_owner()),
+                CREATED_LABEL: str(int(time.time())),
+            }
+        )
+        metadata.setdefault("annotations", {})[IMAGE_ANNOTATION] = image
         pod_manifest: dict[str, Any] = {
             "apiVersion": "v1",
             "kind": "Pod",
-            "metadata": {
-                "name": unique_pod_name,
-            },
+            "metadata": metadata,
             "spec": {
-                "initContainers": [
-                    {
-                        "name": init_container_name,
-                        "image": "busybox",
-                        "command": [
-                            "sh",
-                            "-c",
-                            "until [ -f /tmp/trigger ];"
-                            'do echo "Waiting for trigger...";'
-                            "sleep 1;"
-                            "done;"
-                            'echo "Trigger file found!"',
-                        ],
-                        "volumeMounts": [],
-                    },
-                ],
                 "containers": [
                     {
-                        "image": options.image,
-                        "name": "kodman-exec",
+                        "image": image,
+                        "name": EXEC_CONTAINER,
                         "volumeMounts": [],
                     }
                 ],
                 "volumes": [],
+                # Runs are not restarted, so finished pods leave Running
+                "restartPolicy": "Never",
             },
         }
 
+        if init_container_name:
+            pod_manifest["spec"]["initContainers"] = [
+                {
+                    "name": init_container_name,
+                    "image": init_image or INIT_IMAGE,
+                    "command": ["sh", "-c", wait_for_trigger()],
+                    "volumeMounts": [],
+                },
+            ]
+
+        if service_account:
+            self._log.debug(f"Using serviceAccountNam: '{service_account}'")
+            pod_manifest["spec"]["serviceAccountName"] = service_account
+
+        return pod_manifest
+
+    def _create_pod(
+        self,
+        options: RunOptions,
+        init_container_name: str,
+        volumes: list[Volume],
+    ) -> str:
+        unique_pod_name = f"kodman-run-{hash(options)}"
+        namespace = self._context["namespace"]
+        pod_manifest = self._pod_manifest(
+            {"name": unique_pod_name},
+            options.image,
+            init_container_name,
+            options.service_account,
+            options.init_image,
+        )
+
         if options.command:
             container = pod_manifest["spec"]["containers"][0]
             container["command"] = options.command
@@ -183,197 +999,630 @@ class Backend:
         if options.args:
             pod_manifest["spec"]["containers"][0]["args"] = options.args
 
-        if options.service_account:
-            self._log.debug(f"Using serviceAccountNam: '{options.service_account}'")
-            pod_manifest["spec"]["serviceAccountName"] = options.service_account
-
-        volumes: list[dict[str, Path]] = []
-        if options.volumes:
-            for i, options_volume in enumerate(options.volumes):
-                process = options_volume.split(":")
-                src = Path(process[0]).resolve()
-                if not src.exists():
-                    raise FileNotFoundError(f"{src} does not exist")
-                dst = src  # In case no dst, set same as src
-                try:
-                    dst = Path(process[1])
-                except IndexError:
-                    pass
-                if not dst.is_absolute():
-                    raise ValueError("Destination path must be absolute")
-                self._log.info(f"Mount: {src} to {dst}")
-                if src.is_dir():
-                    self._log.debug(f"Volume target {src} is a directory")
-                    dst_mount = dst
-                else:
-                    self._log.debug(f"Volume target {src} is a file")
-                    dst_mount = dst.parent
-                    if dst_mount == Path("/"):
-                        raise NotImplementedError(
-                            "Root mounting of files not supported by k8s 'emptyDir'"
-                        )
-
-                volumes.append({"src": src, "dst": dst})  # cache for later
-
-                pod_manifest["spec"]["initContainers"][0]["volumeMounts"].append(
-                    {"name": f"shared-data-{i}", "mountPath": str(dst_mount)}
-                )
+        for i, volume in enumerate(volumes):
+            src, dst = volume.src, volume.dst
+            if volume.shared:
+                self._add_shared(pod_manifest, i, volume, volume.shared)
+                continue
+            if volume.projection:
+                self._add_projection(pod_manifest, i, volume, unique_pod_name)
+                continue
+            if volume.cache:
                 pod_manifest["spec"]["containers"][0]["volumeMounts"].append(
-                    {"name": f"shared-data-{i}", "mountPath": str(dst_mount)}
-                )
-                pod_manifest["spec"]["volumes"].append(
                     {
-                        "name": f"shared-data-{i}",
-                        "emptyDir": {},
+                        "name": "kodman-cache",
+                        "mountPath": str(dst),
+                        "subPath": cache_run_dir(unique_pod_name, i),
+                        "readOnly": True,
                     }
                 )
+                continue
+            if src.is_dir():
+                self._log.debug(f"Volume target {src} is a directory")
+                dst_mount = dst
+            else:
+                self._log.debug(f"Volume target {src} is a file")
+                dst_mount = dst.parent
+                if dst_mount == Path("/"):
+                    raise NotImplementedError(
+                        "Root mounting of files not supported by k8s 'emptyDir'"
+                    )
+
+            pod_manifest["spec"]["initContainers"][0]["volumeMounts"].append(
+                {"name": f"shared-data-{i}", "mountPath": str(dst_mount)}
+            )
+            pod_manifest["spec"]["containers"][0]["volumeMounts"].append(
+                {"name": f"shared-data-{i}", "mountPath": str(dst_mount)}
+            )
+            pod_manifest["spec"]["volumes"].append(
+                {
+                    "name": f"shared-data-{i}",
+                    "emptyDir": {},
+                }
+            )
+
+        if any(volume.copy_back for volume in volumes):
+            self._add_copy_back(pod_manifest, volumes)
+
+        if any(volume.cache for volume in volumes):
+            pod_manifest["spec"]["initContainers"][0]["volumeMounts"].append(
+                {"name": "kodman-cache", "mountPath": str(CACHE_DIR)}
+            )
+            pod_manifest["spec"]["volumes"].append(
+                {
+                    "name": "kodman-cache",
+                    "persistentVolumeClaim": {"claimName": options.volume_cache},
+                }
+            )
 
         self._log.debug(f"Pod manifest = {pod_manifest}")
 
         # Schedule pod and block until ready
         self._log.info(f"Creating pod: {unique_pod_name}")
-        self._client.create_namespaced_pod(body=pod_manifest, namespace=namespace)
-        while True:
-            read_resp = self._client.read_namespaced_pod(
-                name=unique_pod_name, namespace=namespace
-            )
-            # Runtime type checking
-            if isinstance(read_resp, V1Pod):
-                if not read_resp.status:
-                    raise ValueError("Empty pod status")
-                if read_resp.status.init_container_statuses:
-                    init_status = read_resp.status.init_container_statuses[0]
-                    if init_status.state.running:
-                        self._log.info("Init container is running")
-                        break
-            else:
-                raise TypeError("Unexpected response type")
+        pod = self._client.create_namespaced_pod(body=pod_manifest, namespace=namespace)
+        if any(volume.projection for volume in volumes):
+            self._create_projections(pod, volumes)
+        return unique_pod_name
 
-            self._log.info("Awaiting init container...")
-            time.sleep(1 / self._polling_freq)
+    def _add_projection(
+        self, pod_manifest: dict[str, Any], i: int, volume: Volume, pod_name: str
+    ):
+        """Mount a projected volume, a single file through a subPath."""
+        kind = "Secret" if volume.secret else "ConfigMap"
+        name = f"projected-{i}"
+        spec = pod_manifest["spec"]
+        spec["volumes"].append(
+            projection_volume(name, kind, pod_name, list(volume.projection))
+        )
+        mount = {"name": name, "mountPath": str(volume.dst), "readOnly": True}
+        if not volume.src.is_dir():
+            mount["subPath"] = volume.dst.name
+        spec["containers"][0]["volumeMounts"].append(mount)
 
-        # Fill volumes
-        for volume in volumes:
-            cp_k8s(
-                self._client,
-                namespace,
-                unique_pod_name,
-                init_container_name,
-                volume["src"],
-                volume["dst"],
-                log=self._log,
+    def _create_projections(self, pod: V1Pod, volumes: list[Volume]):
+        """Create the objects projected volumes mount, owned by the pod.
+
+        They are created right after the pod, which the kubelet retries
+        mounting until they exist. The pod is removed if creating them fails.
+        """
+        namespace = self._context["namespace"]
+        name = str(pod.metadata.name)  # type: ignore
+        owner = {
+            "apiVersion": "v1",
+            "kind": "Pod",
+            "name": name,
+            "uid": pod.metadata.uid,  # type: ignore
+        }
+        create = {
+            "ConfigMap": self._client.create_namespaced_config_map,
+            "Secret": self._client.create_namespaced_secret,
+        }
+        try:
+            for kind, secret in (("ConfigMap", False), ("Secret", True)):
+                files = [
+                    file
+                    for volume in volumes
+                    if volume.secret == secret
+                    for file in volume.projection
+                ]
+                if files:
+                    body = projection_object(kind, name, files, owner)
+                    create[kind](namespace=namespace, body=body)
+        except ApiException:
+            self._client.delete_namespaced_pod(
+                name=name, namespace=namespace, grace_period_seconds=0
             )
+            raise
 
-        # Start execution
-        self._log.info("Execution start")
-        exec_command = [
+    def _add_shared(
+        self, pod_manifest: dict[str, Any], i: int, volume: Volume, claim: SharedClaim
+    ):
+        """Mount the claim of a shared volume, pinning the pod to its node."""
+        spec = pod_manifest["spec"]
+        mount: dict[str, Any] = {
+            "name": f"shared-claim-{i}",
+            "mountPath": str(volume.dst),
+            "readOnly": not volume.rw,
+        }
+        if claim.sub_path:
+            mount["subPath"] = claim.sub_path
+        spec["containers"][0]["volumeMounts"].append(mount)
+        spec["volumes"].append(
+            {
+                "name": f"shared-claim-{i}",
+                "persistentVolumeClaim": {"claimName": claim.claim},
+            }
+        )
+        if claim.node:
+            term = {
+                "matchFields": [
+                    {
+                        "key": "metadata.name",
+                        "operator": "In",
+                        "values": [claim.node],
+                    }
+                ]
+            }
+            spec["affinity"] = {
+                "nodeAffinity": {
+                    "requiredDuringSchedulingIgnoredDuringExecution": {
+                        "nodeSelectorTerms": [term]
+                    }
+                }
+            }
+
+    def _add_copy_back(self, pod_manifest: dict[str, Any], volumes: list[Volume]):
+        """Add a sidecar that keeps rw volumes readable after the command exits.
+
+        The init container stamps the end of uploads in a volume shared with
+        the sidecar, and the sidecar exits once the trigger at
+        COPY_BACK_TRIGGER is sent. Neither container is restarted, as pods
+        have restartPolicy Never, so the command does not run again while
+        files are read.
+        """
+        spec = pod_manifest["spec"]
+        state_mount = {"name": "kodman-state", "mountPath": str(STATE_DIR)}
+        spec["volumes"].append({"name": "kodman-state", "emptyDir": {}})
+        spec["initContainers"][0]["volumeMounts"].append(state_mount)
+        spec["containers"].append(
+            {
+                "name": COPY_BACK_CONTAINER,
+                "image": "busybox",
+                "command": [
+                    "sh",
+                    "-c",
+                    wait_for_trigger(COPY_BACK_TRIGGER, COPY_BACK_TIMEOUT),
+                ],
+                "volumeMounts": [state_mount]
+                + [
+                    {
+                        "name": f"shared-data-{i}",
+                        "mountPath": str(COPY_BACK_DIR / str(i)),
+                    }
+                    for i, volume in enumerate(volumes)
+                    if volume.copy_back
+                ],
+            }
+        )
+
+    def _claim_pool_pod(self, options: RunOptions) -> str:
+        if not options.command:
+            # Pooled pods run a script instead of the image's ENTRYPOINT
+            self._log.info("Pooled pods need an explicit entrypoint, creating a pod")
+            return ""
+        namespace = self._context["namespace"]
+        key = pool_key(options.image, options.service_account)
+        pods = self._client.list_namespaced_pod(
+            namespace=namespace,
+            label_selector=f"{POOL_LABEL}={key},{POOL_STATE_LABEL}=idle",
+        )
+        # Prefer pods that are already parked on the trigger
+        candidates = sorted(
+            (pod for pod in pods.items if get_pod_state(pod) <= PodState.INIT_RUNNING),
+            key=get_pod_state,
+            reverse=True,
+        )
+        for pod in candidates:
+            body = {
+                "metadata": {
+                    "resourceVersion": pod.metadata.resource_version,  # type: ignore
+                    "labels": {POOL_STATE_LABEL: "claimed"},
+                }
+            }
+            try:
+                self._client.patch_namespaced_pod(
+                    name=pod.metadata.name,  # type: ignore
+                    namespace=namespace,
+                    body=body,
+                )
+            except ApiException as e:
+                if e.status == 409:  # Claimed by someone else first
+                    continue
+                raise e
+            # Not refilled here, kodman pool sees the claim and adds a pod
+            return pod.metadata.name  # type: ignore
+        self._log.info("No pooled pod available, creating a pod")
+        return ""
+
+    def _create_pool_pod(self, image: str, service_account: str, init_image: str):
+        namespace = self._context["namespace"]
+        metadata = {
+            "generateName": "kodman-pool-",
+            "labels": {
+                POOL_LABEL: pool_key(image, service_account),
+                POOL_STATE_LABEL: "idle",
+            },
+        }
+        pod_manifest = self._pod_manifest(
+            metadata, image, "wait-for-signal", service_account, init_image
+        )
+        mount = {"name": "kodman-pool", "mountPath": str(POOL_DIR)}
+        pod_manifest["spec"]["initContainers"][0]["volumeMounts"].append(mount)
+        pod_manifest["spec"]["containers"][0]["volumeMounts"].append(mount)
+        pod_manifest["spec"]["containers"][0]["command"] = [
             "/bin/sh",
-            "-c",
-            "touch /tmp/trigger",
+            str(POOL_ENTRYPOINT),
         ]
-        _ = stream(
-            self._client.connect_get_namespaced_pod_exec,
-            unique_pod_name,
-            namespace,
-            container=init_container_name,
-            command=exec_command,
-            stderr=True,
-            stdin=False,
-            stdout=True,
-            tty=False,
+        pod_manifest["spec"]["volumes"].append({"name": "kodman-pool", "emptyDir": {}})
+        self._client.create_namespaced_pod(
+            body=pod_manifest,  # type: ignore
+            namespace=namespace,
         )
 
-        while True:
-            read_resp = self._client.read_namespaced_pod(
-                name=unique_pod_name, namespace=namespace
+    def _reconcile_pool(self, options: PoolOptions):
+        namespace = self._context["namespace"]
+        now = datetime.now(timezone.utc)
+        for image in options.images:
+            key = pool_key(image, options.service_account)
+            pods = self._client.list_namespaced_pod(
+                namespace=namespace,
+                label_selector=f"{POOL_LABEL}={key},{POOL_STATE_LABEL}=idle",
             )
-            if isinstance(read_resp, V1Pod):  # Runtime type checking
-                if not read_resp.status:
-                    raise ValueError("Empty pod status")
-                elif read_resp.status.phase != "Pending":
-                    self._log.info(f"Pod status: {read_resp.status.phase}")
-                    break
-                self._log.info(f"Pod status: {read_resp.status.phase}")
-                time.sleep(1 / self._polling_freq)
-                events = self._client.list_namespaced_event(
-                    namespace=namespace,
-                    field_selector=f"involvedObject.name={unique_pod_name}",
+            idle = []
+            for pod in pods.items:
+                age = now - pod.metadata.creation_timestamp  # type: ignore
+                if (
+                    age.total_seconds() > options.ttl
+                    or get_pod_state(pod) > PodState.INIT_RUNNING
+                ):
+                    self._delete_pool_pod(pod.metadata.name)  # type: ignore
+                else:
+                    idle.append(pod)
+            idle.sort(key=lambda pod: pod.metadata.creation_timestamp)
+            for pod in idle[options.size :]:  # Surplus after concurrent refills
+                self._delete_pool_pod(pod.metadata.name)
+            for _ in range(options.size - len(idle)):
+                self._log.info(f"Adding pooled pod for {image}")
+                self._create_pool_pod(
+                    image, options.service_account, options.init_image
                 )
-                for event in events.items:
-                    if event.type == "Warning":
-                        self.return_code = 1
-                        reason = event.type
-                        message = event.message
-                        self._log.debug(f"{reason}: {message}")
-                        print(message, file=sys.stderr)
-                        return unique_pod_name
-            else:
-                raise TypeError("Unexpected response type")
 
-        # Attach to pod logging
+    def _delete_pool_pod(self, name: str):
+        self._log.info(f"Removing idle pod {name}")
+        try:
+            self._client.delete_namespaced_pod(
+                name=name,
+                namespace=self._context["namespace"],
+                grace_period_seconds=0,
+            )
+        except ApiException as e:
+            if e.status != 404:
+                raise e
+
+    async def _run_pod(
+        self,
+        watcher: PodWatcher,
+        namespace: str,
+        pod_name: str,
+        init_container_name: str,
+        volumes: list[Volume],
+        options: RunOptions,
+        trigger: str,
+        out: OutputStream | None,
+        hashing: "dict[int, asyncio.Future[TreeManifest]] | None" = None,
+    ) -> int:
+        timings = self.timings
+        if init_container_name:
+            # Covers scheduling and pulling the init container image
+            with timings.span("run.schedule", pod=pod_name):
+                async for _ in watcher.until(PodState.INIT_RUNNING):
+                    self._log.info("Awaiting init container...")
+            self._log.info("Init container is running")
+
+        manifests = {}
+        if hashing:
+            with timings.span("run.hash", pod=pod_name):
+                manifests = {i: await future for i, future in hashing.items()}
+
+        # Fill volumes, with the trigger run by the upload sessions themselves
+        triggered = not init_container_name  # Pods without one start by themselves
+        if init_container_name:
+            with timings.span("run.upload", pod=pod_name, volumes=len(volumes)):
+                triggered = await in_thread(
+                    self._fill_volumes,
+                    namespace,
+                    pod_name,
+                    init_container_name,
+                    volumes,
+                    options,
+                    trigger,
+                    manifests,
+                )
+
+        # Start execution
+        self._log.info("Execution start")
+        started = time.monotonic()
+        if not triggered:
+            with timings.span("run.trigger", pod=pod_name):
+                await in_thread(
+                    stream,
+                    self._exec_api().connect_get_namespaced_pod_exec,
+                    pod_name,
+                    namespace,
+                    container=init_container_name,
+                    command=["/bin/sh", "-c", trigger],
+                    stderr=True,
+                    stdin=False,
+                    stdout=True,
+                    tty=False,
+                )
+
+        # Covers pulling the image and starting the container
+        with timings.span("run.start", pod=pod_name):
+            async for pod in watcher.until(PodState.RUNNING):
+                self._log.info(f"Pod status: {pod.status.phase}")  # type: ignore
+        self._log.info(f"Pod status: {watcher.pod.status.phase}")  # type: ignore
+        self._log.debug(f"Running {time.monotonic() - started:.2f}s after trigger")
+
+        # Attach to pod logging. The client only reads logs blocking, so each
+        # stream holds a thread until the pod's output ends
         self._log.info("Try attach to pod logs")
-        w = watch.Watch()
-        for e in w.stream(
-            self._client.read_namespaced_pod_log,
-            name=unique_pod_name,
-            namespace=namespace,
-            follow=True,
-        ):
-            print(e)
+        if out is None:
+            sys.stdout.flush()  # Keep ordering with anything printed before
+            out = sys.stdout.buffer
+        with timings.span("run.logs", pod=pod_name) as span:
+            size = await in_thread(stream_logs, self._client, namespace, pod_name, out)
+            span["bytes"] = size
+        timings.count("bytes.logs", size)
+        self._log.debug(f"Received {size} bytes of pod output")
         self._log.info("Execution complete")
-        w.stop()
 
         # Check exit codes
-        final_pod = self._client.read_namespaced_pod(
-            name=unique_pod_name,
-            namespace=namespace,
-        )
-        if isinstance(final_pod, V1Pod):  # Runtime type checking
-            if not final_pod.status:
-                raise ValueError("Empty pod status")
-            container_status = final_pod.status.container_statuses[0]
-            while not container_status.state.terminated:
+        failed_to_start = False
+        with timings.span("run.exit", pod=pod_name):
+            async for pod in watcher.until(PodState.TERMINATED):
+                container_status = exec_status(pod)
                 # Exit early if container didnt even start
-                if not container_status.started:
+                if (
+                    container_status
+                    and not container_status.started
+                    and container_status.state.waiting  # type: ignore
+                ):
                     self._log.info("Container failed to start")
-                    self.return_code = 1
-                    reason = container_status.state.waiting.reason
-                    message = container_status.state.waiting.message
+                    reason = container_status.state.waiting.reason  # type: ignore
+                    message = container_status.state.waiting.message  # type: ignore
                     self._log.debug(f"{reason}: {message}")
                     print(message, file=sys.stderr)
-                    return unique_pod_name
-
+                    failed_to_start = True
+                    break
                 self._log.info("Awaiting pod termination...")
-                time.sleep(1 / self._polling_freq)
-                final_pod = self._client.read_namespaced_pod(
-                    name=unique_pod_name,
-                    namespace=namespace,
+
+        if any(volume.copy_back for volume in volumes):
+            with timings.span("run.copy_back", pod=pod_name):
+                await in_thread(
+                    self._copy_back, namespace, pod_name, volumes, not failed_to_start
                 )
-                container_status = final_pod.status.container_statuses[0]  # type: ignore
-            self.return_code = container_status.state.terminated.exit_code
+        return 1 if failed_to_start else get_exit_code(watcher.pod)  # type: ignore
 
-        return unique_pod_name
+    def _exec_api(self) -> client.CoreV1Api:
+        # stream() swaps the request method of its ApiClient while connecting, so
+        # exec sessions get their own client to keep concurrent API calls safe
+        return client.CoreV1Api(api_client=self.timings.count_calls(client.ApiClient()))
 
-    def delete(self, options: DeleteOptions):
-        namespace = self._context["namespace"]
+    def _fill_volumes(
+        self,
+        namespace: str,
+        pod_name: str,
+        container: str,
+        volumes: list[Volume],
+        options: RunOptions,
+        trigger: str = "",
+        manifests: dict[int, TreeManifest] | None = None,
+    ) -> bool:
+        """Upload volumes, running trigger after the last one has been extracted.
+
+        Cached volumes, whose manifests are given by index, only upload the
+        blobs missing from the cache and the tree as hardlinks to them, and
+        nothing if the cache holds the tree. Returns whether the trigger was
+        run, which is not the case without uploads.
+        """
+        uploads = []
+        remote_codecs: set[str] = set()  # Probed on first use
+        # BusyBox tar skips sparse members, so files with holes are only sent
+        # as such to GNU tar, probed for when the first is found
+        gnu_tar = functools.cache(
+            lambda: probe_gnu_tar(self._exec_api(), namespace, pod_name, container)
+        )
+        for i, volume in enumerate(volumes):
+            src, dst = volume.src, volume.dst
+            if volume.shared or volume.projection:
+                continue  # Mounted from its claim or projected
+            if volume.cache:
+                manifest = (manifests or {}).get(i) or hash_tree(src, volume.ignore)
+                run_dir = cache_run_dir(pod_name, i)
+                with self.timings.span("upload.lookup", pod=pod_name) as span:
+                    lookup = lookup_blobs(
+                        self._exec_api(),
+                        namespace,
+                        pod_name,
+                        container,
+                        manifest,
+                        run_dir,
+                        self._log,
+                    )
+                    span.update(hit=lookup.hit, missing=len(lookup.missing))
+                if lookup.hit:
+                    continue
+                missing = lookup.missing
+                incoming = f"incoming/{pod_name}-{i}"
+                archive = functools.partial(
+                    add_cached_tree,
+                    manifest=manifest,
+                    missing=missing,
+                    run_dir=run_dir,
+                    incoming=incoming,
+                )
+                # Hardlink headers compress well, gzip is in the busybox init
+                codec = CODECS["gzip"]
+                if missing:
+                    codec = self._get_codec(
+                        options.compression,
+                        namespace,
+                        pod_name,
+                        container,
+                        volume,
+                        remote_codecs,
+                    )
+                publish = publish_script(manifest.root, incoming, run_dir)
+                uploads.append((volume, codec, None, archive, publish))
+                continue
+            codec = self._get_codec(
+                options.compression,
+                namespace,
+                pod_name,
+                container,
+                volume,
+                remote_codecs,
+            )
+            if options.upload_shards > 1 and src.is_dir():
+                shards = plan_shards(src, dst, options.upload_shards, volume.ignore)
+                self._log.debug(f"Split {src} into {len(shards)} shards")
+            else:
+                shards = [None]
+            uploads += [(volume, codec, members, None, "") for members in shards]
+
+        then = trigger
+        if trigger and len(uploads) > 1:
+            then = after_uploads(len(uploads), trigger)
+
+        def upload(
+            volume: Volume, codec, members, archive, publish: str
+        ) -> TransferStats:
+            return cp_k8s(
+                self._exec_api(),
+                namespace,
+                pod_name,
+                container,
+                volume.src,
+                volume.dst,
+                log=self._log,
+                codec=codec,
+                members=members,
+                then=" && ".join(command for command in (publish, then) if command),
+                timings=self.timings,
+                ignore=volume.ignore,
+                archive=archive,
+                sparse=gnu_tar,
+            )
+
+        workers = max(1, min(options.upload_parallelism, len(uploads)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(upload, *args) for args in uploads]
+            for future in as_completed(futures):
+                stats = future.result()
+                if stats.throughput and stats.wire_bytes > 1024 * 1024:
+                    self._link_throughput = stats.throughput
+        return bool(trigger and uploads)
+
+    def _copy_back(
+        self, namespace: str, pod_name: str, volumes: list[Volume], download: bool
+    ):
+        """Download files changed by the run in rw volumes, then end the sidecar."""
         try:
-            exists_resp = self._client.read_namespaced_pod(
-                name=options.name,
-                namespace=namespace,
+            for i, volume in enumerate(volumes):
+                if not (volume.copy_back and download):
+                    continue
+                source = PurePosixPath(COPY_BACK_DIR, str(i))
+                if not volume.src.is_dir():
+                    source /= volume.dst.name
+                cp_from_k8s(
+                    self._exec_api(),
+                    namespace,
+                    pod_name,
+                    COPY_BACK_CONTAINER,
+                    source,
+                    volume.src,
+                    log=self._log,
+                    newer=str(UPLOADED_STAMP),
+                    timings=self.timings,
+                )
+        finally:
+            self._release_copy_back(namespace, pod_name)
+
+    def _release_copy_back(self, namespace: str, pod_name: str):
+        """End the copy-back sidecar, if it is still running."""
+        try:
+            stream(
+                self._exec_api().connect_get_namespaced_pod_exec,
+                pod_name,
+                namespace,
+                container=COPY_BACK_CONTAINER,
+                command=["sh", "-c", send_trigger(COPY_BACK_TRIGGER)],
+                stderr=True,
+                stdin=False,
+                stdout=True,
+                tty=False,
             )
-            self._client.delete_namespaced_pod(
+        except Exception as e:  # Best effort, it also exits on a timeout
+            self._log.debug(f"Copy-back sidecar not released: {e}")
+
+    def _get_codec(
+        self,
+        compression: str,
+        namespace: str,
+        pod_name: str,
+        container: str,
+        volume: Volume,
+        remote_codecs: set[str],
+    ) -> Codec:
+        if compression == "none":
+            return CODECS["none"]
+        if not remote_codecs:
+            remote_codecs.update(
+                probe_remote_codecs(self._exec_api(), namespace, pod_name, container)
+            )
+            self._log.debug(f"Pod supports compression: {remote_codecs}")
+        candidates = [
+            CODECS[name]
+            for name in remote_codecs
+            if name != "none" and CODECS[name].available()
+        ]
+        if compression != "auto":
+            if CODECS[compression] not in candidates:
+                self._log.info(f"{compression} unavailable, sending uncompressed")
+                return CODECS["none"]
+            return CODECS[compression]
+
+        if self._link_throughput is None:
+            self._link_throughput = measure_link(
+                self._exec_api(), namespace, pod_name, container, self._log
+            )
+        codec = select_codec(
+            sample_tree(volume.src, ignore=volume.ignore),
+            candidates,
+            self._link_throughput,
+            self._log,
+        )
+        self._log.info(f"Selected {codec.name} compression for {volume.src}")
+        return codec
+
+    async def _delete(self, options: DeleteOptions):
+        with self.timings.span("delete", pod=options.name, wait=options.wait):
+            await self._delete_pod(options)
+
+    async def _delete_pod(self, options: DeleteOptions):
+        namespace = self._context["namespace"]
+        try:
+            await in_thread(
+                self._client.delete_namespaced_pod,
                 name=options.name,
                 namespace=namespace,
                 grace_period_seconds=self._grace_period,
+                propagation_policy="Background",
             )
-            while exists_resp:
+            if not options.wait:
+                # The cluster finishes the deletion after the grace period
+                self._log.info(f"Pod {options.name} scheduled for deletion")
+                return
+            while True:
                 self._log.info("Awaiting pod cleanup...")
                 try:
-                    exists_resp = self._client.read_namespaced_pod(
+                    await in_thread(
+                        self._client.read_namespaced_pod,
                         name=options.name,
                         namespace=namespace,
                     )
-                    time.sleep(1 / self._polling_freq)
+                    await asyncio.sleep(1 / self._polling_freq)
                 except ApiException as e:
                     if e.status == 404:
                         self._log.info(f"Pod {options.name} deleted successfully")
@@ -383,3 +1632,191 @@ class Backend:
 
         except ApiException as e:
             self._log.info(f"Error deleting pod: {e}")
+
+
+class AsyncBackend(BaseBackend):
+    """Run pods from asyncio code.
+
+    Waiting on pods does not hold a thread: all runs share one pod watch and
+    one event watch. Volume uploads, exec calls and log streams use the
+    blocking kubernetes client and run on their own threads while active, as
+    it has no asynchronous reads. A running pod therefore holds a thread for
+    its log stream only.
+    """
+
+    async def run(
+        self, options: RunOptions, out: OutputStream | None = None
+    ) -> RunResult:
+        """Run a pod to completion, writing its output to out (default stdout)."""
+        return await self._run(options, out)
+
+    async def delete(self, options: DeleteOptions):
+        await self._delete(options)
+
+
+class Backend(BaseBackend):
+    """Blocking interface over the same implementation as AsyncBackend."""
+
+    def __init__(self, log, timings: Timings | None = None):
+        super().__init__(log, timings)
+        self.return_code = 0
+
+    def _pod_informer(self, namespace: str, pod_name: str) -> PodInformer:
+        # One pod at a time, so only its updates are watched
+        return PodInformer(self._client, namespace, self._log, pod_name)
+
+    def run(self, options: RunOptions, out: OutputStream | None = None) -> str:
+        """Run a pod to completion, writing its output to out (default stdout)."""
+        result = asyncio.run(self._run(options, out))
+        self.return_code = result.exit_code
+        return result.pod_name
+
+    def delete(self, options: DeleteOptions):
+        asyncio.run(self._delete(options))
+
+    def ps(self, options: PsOptions) -> Iterator[V1Pod]:
+        """Yield kodman pods, fetching them from the server a page at a time."""
+        label_selector = f"{MANAGED_BY_LABEL}=kodman"
+        if options.image:
+            label_selector += f",{IMAGE_LABEL}={label_value(options.image)}"
+        if options.owner:
+            label_selector += f",{OWNER_LABEL}={label_value(options.owner)}"
+        field_selector = None if options.all else UNFINISHED_FIELD_SELECTOR
+        token = None
+        while True:
+            page = self._client.list_namespaced_pod(
+                namespace=self._context["namespace"],
+                label_selector=label_selector,
+                field_selector=field_selector,
+                limit=options.page_size,
+                _continue=token,
+            )
+            yield from page.items
+            # Named var_continue by newer clients
+            token = getattr(page.metadata, "var_continue", None) or getattr(
+                page.metadata, "_continue", None
+            )
+            if not token:
+                return
+
+    def cp(self, options: CpOptions) -> TransferStats:
+        """Copy a path out of a running container, like 'docker cp'.
+
+        An existing directory at options.dest receives a copy named after the
+        source, otherwise the copy is made as options.dest.
+        """
+        namespace = self._context["namespace"]
+        source = PurePosixPath("/", options.source)
+        if not source.name:
+            raise ValueError("Copying the root directory is not supported")
+        container = options.container
+        if not container:
+            pod = self._client.read_namespaced_pod(options.pod, namespace)
+            container = pod.spec.containers[0].name  # type: ignore
+        dest = options.dest.resolve()
+        if dest.is_dir():
+            dest /= source.name
+        return cp_from_k8s(
+            self._exec_api(),
+            namespace,
+            options.pod,
+            container,
+            source,
+            dest,
+            log=self._log,
+            timings=self.timings,
+        )
+
+    def sync(self, options: SyncOptions) -> TransferStats:
+        """Make a path in a running container a copy of a local directory.
+
+        Only changed files are sent and files gone locally are removed, apart
+        from those excluded by options.exclude or a .kodmanignore file.
+        """
+        namespace = self._context["namespace"]
+        if not options.source.is_dir():
+            raise ValueError(f"{options.source} is not a directory")
+        dest = PurePosixPath("/", options.dest)
+        if not dest.name:
+            raise ValueError("Syncing to the root directory is not supported")
+        container = options.container
+        if not container:
+            pod = self._client.read_namespaced_pod(options.pod, namespace)
+            container = pod.spec.containers[0].name  # type: ignore
+        volume = Volume(
+            options.source,
+            Path(dest),
+            IgnoreRules.load(options.source, options.exclude),
+        )
+        codec = self._get_codec(
+            options.compression, namespace, options.pod, container, volume, set()
+        )
+        # Probed for when the first file with holes is found
+        gnu_tar = functools.cache(
+            lambda: probe_gnu_tar(self._exec_api(), namespace, options.pod, container)
+        )
+        return sync_k8s(
+            self._exec_api(),
+            namespace,
+            options.pod,
+            container,
+            options.source,
+            dest,
+            log=self._log,
+            codec=codec,
+            timings=self.timings,
+            ignore=volume.ignore,
+            sparse=gnu_tar,
+        )
+
+    def prune(self, options: PruneOptions) -> list[str]:
+        """Delete leftover kodman pods in one request, returning their names.
+
+        By default only finished run pods are removed. With options.all,
+        running and idle pooled pods go too.
+        """
+        namespace = self._context["namespace"]
+        label_selector = f"{MANAGED_BY_LABEL}=kodman"
+        field_selector = None
+        if not options.all:
+            label_selector += f",{POOL_STATE_LABEL}!=idle"
+            field_selector = PRUNE_FIELD_SELECTOR
+        pods = self._client.list_namespaced_pod(
+            namespace=namespace,
+            label_selector=label_selector,
+            field_selector=field_selector,
+        )
+        names = [str(pod.metadata.name) for pod in pods.items]  # type: ignore
+        if names:
+            self._log.info(f"Deleting {len(names)} pods")
+            self._client.delete_collection_namespaced_pod(
+                namespace=namespace,
+                label_selector=label_selector,
+                field_selector=field_selector,
+                grace_period_seconds=self._grace_period,
+                propagation_policy="Background",
+            )
+        return names
+
+    def pool(self, options: PoolOptions):
+        """Keep options.size parked pods per image until interrupted."""
+        namespace = self._context["namespace"]
+        keys = {pool_key(image, options.service_account) for image in options.images}
+        self._reconcile_pool(options)
+        while not options.once:
+            # Refill as soon as a pod is claimed or removed, and collect idle
+            # pods at least once per TTL
+            w = watch.Watch()
+            events: Iterator[dict[str, Any]] = w.stream(  # type: ignore
+                self._client.list_namespaced_pod,
+                namespace=namespace,
+                label_selector=POOL_LABEL,
+                timeout_seconds=max(1, min(options.ttl, 60)),
+            )
+            for event in events:
+                labels = event["object"].metadata.labels or {}
+                if labels.get(POOL_LABEL) in keys and (
+                    event["type"] == "DELETED" or labels.get(POOL_STATE_LABEL) != "idle"
+                ):
+                    self._reconcile_pool(options)
+            self._reconcile_pool(options)
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import shlex
+import sys
+import threading
+import time
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Any
+
+import yaml
+
+from .backend import AsyncBackend, DeleteOptions, OutputStream, RunOptions
+
+JOB_FIELDS = ("name", "rm")
+LIST_FIELDS = ("command", "args", "volumes")
+
+
+@dataclass(frozen=True)
+class Job:
+    name: str
+    options: RunOptions
+    rm: bool = False
+
+
+@dataclass(frozen=True)
+class JobResult:
+    name: str
+    pod_name: str
+    exit_code: int
+    seconds: float
+
+
+def parse_job(entry: Any, index: int, service_account: str = "") -> Job:
+    """Build a job from a manifest entry using RunOptions field names."""
+    if not isinstance(entry, dict):
+        raise ValueError(f"Job {index}: expected a mapping, got {entry!r}")
+    name = str(entry.get("name") or f"job-{index}")
+    if "/" in name or "\\" in name or name in (".", ".."):
+        # Names are used as log file names
+        raise ValueError(f"Job {index}: invalid name {name!r}")
+    allowed = {f.name for f in fields(RunOptions)} | set(JOB_FIELDS)
+    if unknown := sorted(set(entry) - allowed):
+        raise ValueError(f"Job {name}: unknown field(s) {', '.join(unknown)}")
+    if "image" not in entry:
+        raise ValueError(f"Job {name}: missing image")
+
+    kwargs = {k: v for k, v in entry.items() if k not in JOB_FIELDS}
+    for key in LIST_FIELDS:
+        if isinstance(kwargs.get(key), str):
+            kwargs[key] = shlex.split(kwargs[key])
+    kwargs.setdefault("service_account", service_account)
+    return Job(name, RunOptions(**kwargs), bool(entry.get("rm", False)))
+
+
+def load_manifest(path: Path, service_account: str = "") -> list[Job]:
+    """Read jobs from a YAML list, or one JSON object per line for .jsonl files."""
+    text = path.read_text()
+    if path.suffix in (".jsonl", ".ndjson"):
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        entries = yaml.safe_load(text) or []
+    if not isinstance(entries, list):
+        raise ValueError(f"{path} must contain a list of jobs")
+
+    jobs = [parse_job(e, i, service_account) for i, e in enumerate(entries)]
+    names = [job.name for job in jobs]
+    if duplicates := sorted({n for n in names if names.count(n) > 1}):
+        raise ValueError(f"Duplicate job names: {', '.join(duplicates)}")
+    return jobs
+
+
+class PrefixWriter:
+    """Prefix every line written with a job name before passing it on.
+
+    Only whole lines are passed on, so output of concurrent jobs sharing one
+    stream is interleaved line by line. A trailing partial line is written
+    with a newline on close.
+    """
+
+    def __init__(self, out: OutputStream, prefix: str, lock: threading.Lock):
+        self._out = out
+        self._prefix = prefix.encode()
+        self._lock = lock
+        self._buffer = bytearray()
+
+    def write(self, data: bytes, /) -> int:
+        self._buffer += data
+        end = self._buffer.rfind(b"\n") + 1
+        if end:
+            lines = bytes(self._buffer[:end]).splitlines(keepends=True)
+            del self._buffer[:end]
+            with self._lock:
+                self._out.write(b"".join(self._prefix + line for line in lines))
+        return len(data)
+
+    def flush(self):
+        with self._lock:
+            self._out.flush()
+
+    def close(self):
+        if self._buffer:
+            self.write(b"\n")
+        self.flush()
+
+
+def run_many(
+    backend: AsyncBackend,
+    jobs: list[Job],
+    parallelism: int,
+    out: OutputStream,
+    log: logging.Logger,
+    log_dir: Path | None = None,
+) -> list[JobResult]:
+    """Run jobs with at most parallelism at a time on one event loop.
+
+    Output is prefixed with the job name, or written to <log_dir>/<name>.log.
+    Results are returned in the order of the jobs.
+    """
+    return asyncio.run(_run_many(backend, jobs, parallelism, out, log, log_dir))
+
+
+async def _run_many(
+    backend: AsyncBackend,
+    jobs: list[Job],
+    parallelism: int,
+    out: OutputStream,
+    log: logging.Logger,
+    log_dir: Path | None,
+) -> list[JobResult]:
+    lock = threading.Lock()  # Logs are streamed from worker threads
+    slots = asyncio.Semaphore(max(parallelism, 1))
+    width = max((len(job.name) for job in jobs), default=0)
+    done = 0
+    if log_dir:
+        log_dir.mkdir(parents=True, exist_ok=True)
+
+    async def run_job(job: Job) -> JobResult:
+        nonlocal done
+        async with slots:
+            start = time.monotonic()
+            pod_name = ""
+            exit_code = 1
+            if log_dir:
+                job_out = open(log_dir / f"{job.name}.log", "wb")
+            else:
+                job_out = PrefixWriter(out, f"{job.name:<{width}} | ", lock)
+            try:
+                result = await backend.run(job.options, job_out)
+                pod_name, exit_code = result.pod_name, result.exit_code
+                if job.rm:
+                    await backend.delete(DeleteOptions(pod_name, wait=False))
+            except Exception as e:
+                print(f"{job.name}: {e}", file=sys.stderr)
+            finally:
+                job_out.close()
+            done += 1
+            log.info(f"{done}/{len(jobs)} jobs done")
+            return JobResult(job.name, pod_name, exit_code, time.monotonic() - start)
+
+    return list(await asyncio.gather(*(run_job(job) for job in jobs)))
+
+
+def format_summary(results: list[JobResult]) -> str:
+    rows = [("JOB", "EXIT", "TIME", "POD")] + [
+        (r.name, str(r.exit_code), f"{r.seconds:.1f}s", r.pod_name) for r in results
+    ]
+    widths = [max(len(row[i]) for row in rows) for i in range(3)]
+    lines = [
+        "  ".join(row[i].ljust(widths[i]) for i in range(3)) + "  " + row[3]
+        for row in rows
+    ]
+    failed = sum(r.exit_code != 0 for r in results)
+    lines.append(f"{len(results) - failed} succeeded, {failed} failed")
+    return "\n".join(line.rstrip() for line in lines)
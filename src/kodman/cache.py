@@ -0,0 +1,258 @@
+import hashlib
+import logging
+import os
+import stat
+import tarfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+
+from kubernetes import client
+from kubernetes.stream import stream
+
+from .ignore import IgnoreRules, walk
+from .transfer import ExecReader
+
+CACHE_DIR = PurePosixPath("/kodman-cache")
+HASH_WORKERS = 8
+HASH_BLOCK = 1024 * 1024
+KEYS_PER_WRITE = 4096
+RUN_TTL_MINUTES = 24 * 60  # Hardlink trees of older runs are removed
+
+
+@dataclass(frozen=True)
+class TreeEntry:
+    path: str  # Relative to the tree root, which is '.'
+    kind: str  # 'd', 'f' or 'l'
+    mode: int
+    mtime: int
+    target: str  # Blob key of files, target of symlinks
+    source: Path
+
+
+@dataclass(frozen=True)
+class CacheLookup:
+    hit: bool  # The tree is already linked in place
+    missing: set[str]
+
+
+@dataclass(frozen=True)
+class TreeManifest:
+    root: str
+    entries: list[TreeEntry]
+
+    @property
+    def keys(self) -> set[str]:
+        return {entry.target for entry in self.entries if entry.kind == "f"}
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_tree(source_path: Path, ignore: IgnoreRules | None = None) -> TreeManifest:
+    """Hash the files of a tree and combine them into a Merkle root.
+
+    Blob keys are the content hash and permission bits, since files of a
+    tree are hardlinks to the blobs. Files are hashed on a thread pool as
+    hashlib releases the GIL on large buffers. Special files are left out.
+    """
+    paths = list(walk(source_path, ignore or IgnoreRules()))
+    files = [path for path, is_dir in paths if not is_dir and path.is_file()]
+    files = [path for path in files if not path.is_symlink()]
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        digests = dict(zip(files, executor.map(hash_file, files), strict=True))
+
+    entries = []
+    for path, is_dir in paths:
+        st = path.lstat()
+        mode = stat.S_IMODE(st.st_mode)
+        relative = path.relative_to(source_path).as_posix()
+        if is_dir:
+            kind, target = "d", ""
+        elif stat.S_ISLNK(st.st_mode):
+            kind, target = "l", os.readlink(path)
+        elif path in digests:
+            kind, target = "f", f"{digests[path]}-{mode:o}"
+        else:
+            continue
+        entries.append(TreeEntry(relative, kind, mode, int(st.st_mtime), target, path))
+    entries.sort(key=lambda e: (e.path != ".", e.path))
+
+    # Directories are hashed from their children, deepest first
+    children: dict[str, list[str]] = defaultdict(list)
+    root = ""
+    for entry in sorted(entries, key=lambda e: -e.path.count("/") - (e.path != ".")):
+        digest = entry.target
+        if entry.kind == "d":
+            listing = "\n".join(sorted(children.pop(entry.path, [])))
+            digest = hashlib.sha256(listing.encode()).hexdigest()
+        if entry.path == ".":
+            root = digest
+            continue
+        parent, _, name = entry.path.rpartition("/")
+        children[parent or "."].append(f"{entry.kind} {entry.mode:o} {name} {digest}")
+    return TreeManifest(root, entries)
+
+
+def cache_run_dir(pod_name: str, index: int) -> str:
+    """Directory of the cache holding a volume of a run as hardlinks to blobs."""
+    return f"runs/{pod_name}/{index}"
+
+
+def blob_path(key: str) -> str:
+    return f"blobs/{key[:2]}/{key}"
+
+
+def lookup_script(root: str, run_dir: str) -> str:
+    """Link a tree stored in the cache to run_dir, else report missing keys.
+
+    Prints 'hit' once the tree is linked, or 'miss', then reads keys from
+    stdin up to a line 'END' and prints those without a blob. Keys are all
+    read before any is answered, so neither side blocks on a full pipe
+    while the other writes. Always ends with 'END'. Leftovers of old runs
+    are removed first.
+    """
+    parent = PurePosixPath(run_dir).parent
+    keys = "/tmp/kodman-keys-$$"
+    return (
+        f"mkdir -p {CACHE_DIR} && cd {CACHE_DIR} && "
+        "mkdir -p blobs trees runs incoming && "
+        f"find runs incoming -mindepth 1 -maxdepth 1 -mmin +{RUN_TTL_MINUTES} "
+        "-exec rm -rf {} +; "
+        f"if [ -d trees/{root} ] && mkdir -p {parent} && "
+        f"cp -al trees/{root} {run_dir}; then echo hit; "
+        f"else rm -rf {run_dir}; echo miss; "
+        'while read -r key && [ "$key" != END ]; do echo "$key"; done '
+        f"> {keys}; "
+        'while read -r key; do [ -e "blobs/${key%${key#??}}/$key" ] || '
+        f'echo "$key"; done < {keys}; rm -f {keys}; fi; echo END'
+    )
+
+
+def lookup_blobs(
+    kube_conn: client.CoreV1Api,
+    namespace: str,
+    pod_name: str,
+    container: str,
+    manifest: TreeManifest,
+    run_dir: str,
+    log: logging.Logger,
+) -> CacheLookup:
+    """Exchange the manifest with the cache, which links stored trees in place.
+
+    Nothing has to be uploaded on a hit, otherwise the keys the cache lacks.
+    """
+    resp = stream(
+        kube_conn.connect_get_namespaced_pod_exec,
+        pod_name,
+        namespace,
+        container=container,
+        command=["sh", "-c", lookup_script(manifest.root, run_dir)],
+        stderr=False,
+        stdin=True,
+        stdout=True,
+        tty=False,
+        binary=True,
+        _preload_content=False,
+    )
+    reader = ExecReader(resp, pod_name)
+    missing: set[str] = set()
+    try:
+        hit = reader.readline() == b"hit\n"
+        if not hit:
+            keys = sorted(manifest.keys) + ["END"]
+            for i in range(0, len(keys), KEYS_PER_WRITE):
+                batch = keys[i : i + KEYS_PER_WRITE]
+                resp.write_stdin("".join(f"{key}\n" for key in batch).encode())
+        while (line := reader.readline().strip()) not in (b"END", b""):
+            missing.add(line.decode())
+        reader.finish()
+    finally:
+        resp.close()
+    if hit:
+        log.info("Volume cache holds the whole tree")
+    else:
+        held = len(manifest.keys) - len(missing)
+        log.info(f"Volume cache holds {held} of {len(manifest.keys)} blobs")
+    return CacheLookup(hit, missing)
+
+
+def add_cached_tree(
+    tar: tarfile.TarFile,
+    manifest: TreeManifest,
+    missing: set[str],
+    run_dir: str,
+    incoming: str,
+):
+    """Archive missing blobs under incoming and the tree as hardlinks at run_dir.
+
+    Paths are relative to the root of the pod filesystem. Only headers are
+    sent for files whose blob is cached. Missing blobs are sent once even if
+    several files share them, and are moved into the cache by
+    publish_script once extracted.
+    """
+    cache = CACHE_DIR.relative_to("/")
+    now = int(time.time())  # Run directories older than RUN_TTL_MINUTES go
+
+    def add_dir(name: str, mode: int = 0o755, mtime: int = now):
+        info = tarfile.TarInfo(name)
+        info.type, info.mode, info.mtime = tarfile.DIRTYPE, mode, mtime
+        tar.addfile(info)
+
+    for parent in reversed(PurePosixPath(run_dir).parents[:-1]):
+        add_dir(f"{cache}/{parent}")
+    add_dir(f"{cache}/{incoming}")
+    sent: set[str] = set()
+    prefixes: set[str] = set()
+    for entry in manifest.entries:
+        name = f"{cache}/{run_dir}" + ("" if entry.path == "." else f"/{entry.path}")
+        if entry.kind == "d":
+            add_dir(name, entry.mode, entry.mtime)
+            continue
+        info = tarfile.TarInfo(name)
+        info.mode, info.mtime = entry.mode, entry.mtime
+        if entry.kind == "l":
+            info.type, info.linkname = tarfile.SYMTYPE, entry.target
+            tar.addfile(info)
+            continue
+        key = entry.target
+        blob = f"{cache}/{blob_path(key)}"
+        if key in missing:
+            blob = f"{cache}/{incoming}/{key[:2]}/{key}"
+            if key not in sent:
+                if key[:2] not in prefixes:
+                    add_dir(f"{cache}/{incoming}/{key[:2]}")
+                    prefixes.add(key[:2])
+                with open(entry.source, "rb") as f:
+                    blob_info = tar.gettarinfo(arcname=blob, fileobj=f)
+                    blob_info.mode = entry.mode
+                    tar.addfile(blob_info, f)
+                sent.add(key)
+        info.type, info.linkname = tarfile.LNKTYPE, blob
+        tar.addfile(info)
+
+
+def publish_script(root: str, incoming: str, run_dir: str) -> str:
+    """Move uploaded blobs into the cache and store the tree at run_dir.
+
+    The tree is stored as hardlinks, which later runs link in place with a
+    single copy. The first run to publish a tree stores it, under a lock
+    directory so that concurrent runs don't nest their copies in it.
+    """
+    tree = f"trees/{root}"
+    return (
+        f"cd {CACHE_DIR / incoming} && for d in *; do "
+        'if [ -d "$d" ]; then mkdir -p "../../blobs/$d" && '
+        'mv -f "$d"/* "../../blobs/$d/" || exit 1; fi; done && '
+        f"cd {CACHE_DIR} && rm -rf {incoming} && "
+        f"if [ ! -d {tree} ] && mkdir {tree}.lock 2>/dev/null; then "
+        f"rm -f {tree} && cp -al {run_dir} {tree}.tmp && mv {tree}.tmp {tree}; "
+        f"rm -rf {tree}.tmp {tree}.lock; fi"
+    )
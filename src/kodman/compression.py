@@ -0,0 +1,153 @@
+import gzip
+import importlib.util
+import io
+import logging
+import lzma
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Protocol
+
+from .ignore import IgnoreRules, walk
+
+SAMPLE_SIZE = 1024 * 1024
+SAMPLE_FILE_SIZE = 64 * 1024
+
+
+class Writer(Protocol):
+    def write(self, data: bytes, /) -> int: ...
+
+    def close(self) -> None: ...
+
+
+class CountingWriter:
+    """Pass-through writer that counts the bytes written to it."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.count = 0
+
+    def write(self, data: bytes) -> int:
+        self.count += len(data)
+        return self._fileobj.write(data)
+
+    def close(self):
+        self._fileobj.close()
+
+
+class _Uncompressed:
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def write(self, data: bytes) -> int:
+        return self._fileobj.write(data)
+
+    def close(self):
+        pass  # Never close the underlying pipe
+
+
+def _gzip_writer(fileobj) -> Writer:
+    return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=6, mtime=0)
+
+
+def _xz_writer(fileobj) -> Writer:
+    return lzma.LZMAFile(fileobj, mode="wb", preset=1)
+
+
+def _zstd_writer(fileobj) -> Writer:
+    import zstandard
+
+    return zstandard.ZstdCompressor(level=3).stream_writer(fileobj, closefd=False)
+
+
+@dataclass(frozen=True)
+class Codec:
+    name: str
+    remote_tool: str
+    writer: Callable[[Any], Writer]
+    local_module: str = ""
+
+    def available(self) -> bool:
+        if not self.local_module:
+            return True
+        return importlib.util.find_spec(self.local_module) is not None
+
+    def remote_command(self, then: str = "", before: str = "") -> list[str]:
+        """Command extracting the archive, followed by then if it succeeds.
+
+        A before command runs first, reading what precedes the archive on stdin.
+        """
+        if not self.remote_tool and not then and not before:
+            return ["tar", "xf", "-", "-C", "/"]
+        extract = "tar xf - -C /"
+        if self.remote_tool:
+            extract = f"{self.remote_tool} -dc | {extract}"
+        commands = (before, extract, then)
+        return ["sh", "-c", " && ".join(command for command in commands if command)]
+
+
+CODECS = {
+    "none": Codec("none", "", _Uncompressed),
+    "gzip": Codec("gzip", "gzip", _gzip_writer),
+    "xz": Codec("xz", "xz", _xz_writer),
+    "zstd": Codec("zstd", "zstd", _zstd_writer, local_module="zstandard"),
+}
+COMPRESSION_CHOICES = [*CODECS, "auto"]
+
+
+def sample_tree(
+    source_path: Path, size: int = SAMPLE_SIZE, ignore: IgnoreRules | None = None
+) -> bytes:
+    """Read the leading bytes of files under source_path, up to size in total."""
+    if source_path.is_file():
+        paths = iter([source_path])
+    else:
+        paths = (
+            path
+            for path, is_dir in walk(source_path, ignore or IgnoreRules())
+            if not is_dir
+        )
+    sample = bytearray()
+    for path in paths:
+        if len(sample) >= size:
+            break
+        try:
+            with open(path, "rb") as f:
+                sample += f.read(min(SAMPLE_FILE_SIZE, size - len(sample)))
+        except OSError:
+            continue  # Unreadable files are reported by tar itself
+    return bytes(sample)
+
+
+def select_codec(
+    sample: bytes,
+    candidates: list[Codec],
+    link_throughput: float,
+    log: logging.Logger,
+) -> Codec:
+    """Pick the codec that minimises the transfer time per raw byte.
+
+    Compression runs concurrently with sending, so a codec costs whichever is
+    slower of compressing a byte and sending its compressed share over the link.
+    """
+    best = CODECS["none"]
+    if not sample:
+        return best
+    best_cost = 1 / link_throughput
+    for codec in candidates:
+        buf = io.BytesIO()
+        start = time.perf_counter()
+        writer = codec.writer(buf)
+        writer.write(sample)
+        writer.close()
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        ratio = len(buf.getvalue()) / len(sample)
+        cost = max(elapsed / len(sample), ratio / link_throughput)
+        log.debug(
+            f"Codec {codec.name}: ratio {ratio:.2f}, "
+            f"{len(sample) / elapsed / 1e6:.1f} MB/s"
+        )
+        if cost < best_cost * 0.9:  # Prefer simpler codecs unless clearly faster
+            best, best_cost = codec, cost
+    return best
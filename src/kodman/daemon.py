@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections.abc import Callable
+from pathlib import Path
+
+LOCAL_COMMANDS = ("daemon", "version")
+REFRESH_INTERVAL = 30  # Keeps the config inherited by workers within its TTL
+
+
+def socket_path(path: str | None = None) -> Path:
+    """Where the daemon listens, in a directory only this user can write to.
+
+    Without XDG_RUNTIME_DIR, that is a private directory in the shared temp
+    directory, created by the daemon.
+    """
+    if path:
+        return Path(path)
+    if runtime_dir := os.getenv("XDG_RUNTIME_DIR"):
+        return Path(runtime_dir) / f"kodman-{os.getuid()}.sock"
+    return Path(tempfile.gettempdir()) / f"kodman-{os.getuid()}" / "kodman.sock"
+
+
+def peer_uid(sock: socket.socket) -> int | None:
+    """User id of the process at the other end of a Unix socket, if known."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    size = struct.calcsize("3i")
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, size)
+    return struct.unpack("3i", credentials)[1]  # pid, uid, gid
+
+
+def trusted(sock: socket.socket, path: Path) -> bool:
+    """Whether the daemon at path runs as this user.
+
+    Where the peer can't be asked, the socket and its directory have to be
+    owned by this user and the directory closed to others.
+    """
+    uid = peer_uid(sock)
+    if uid is not None:
+        return uid == os.getuid()
+    try:
+        directory, listener = path.parent.stat(), path.stat()
+    except OSError:
+        return False
+    return (
+        directory.st_uid == listener.st_uid == os.getuid()
+        and not stat.S_IMODE(directory.st_mode) & 0o077
+    )
+
+
+def forward(argv: list[str], path: Path) -> int | None:
+    """Run a command through the daemon listening on path.
+
+    The daemon works directly on this process' stdin, stdout and stderr, which
+    are passed over the socket, so output is identical to an in-process run.
+    Returns the exit code, or None if no daemon is reachable.
+    """
+    if not argv or argv[0] in LOCAL_COMMANDS or argv[0].startswith("-"):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    if not trusted(sock, path):
+        sock.close()
+        print(f"Ignoring {path}, not a kodman daemon of this user", file=sys.stderr)
+        return None
+
+    with sock:
+        request = {"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}
+        socket.send_fds(sock, [b"K"], [0, 1, 2])
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        try:
+            reply = sock.makefile("rb").readline()
+        except KeyboardInterrupt:
+            return 130  # Closing the socket interrupts the daemon worker
+    try:
+        return int(reply)
+    except ValueError:
+        print("kodman daemon closed the connection", file=sys.stderr)
+        return 1
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # Runs in a forked worker, so process-wide state can be rewired freely
+        if peer_uid(self.request) not in (None, os.getuid()):
+            return  # Connected before the socket was made private
+        _, fds, _, _ = socket.recv_fds(self.request, 1, 3)
+        request = json.loads(self.rfile.readline())
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        sys.stdout.reconfigure(line_buffering=True)  # type: ignore
+        sys.stderr.reconfigure(line_buffering=True)  # type: ignore
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+
+        self._done = False
+        threading.Thread(target=self._watch_client, daemon=True).start()
+        try:
+            self.server.execute(request["argv"])  # type: ignore
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except KeyboardInterrupt:
+            code = 130
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self._done = True
+        self.wfile.write(f"{code}\n".encode())
+
+    def _watch_client(self):
+        # The client only closes early when interrupted, pass that on
+        if not self.request.recv(1) and not self._done:
+            os.kill(os.getpid(), signal.SIGINT)
+
+
+class DaemonServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    def __init__(
+        self,
+        path: Path,
+        execute: Callable[[list[str]], None],
+        refresh: Callable[[], None],
+        log: logging.Logger,
+    ):
+        self.execute = execute
+        self._refresh = refresh
+        self._refreshed = time.monotonic()
+        self._log = log
+        super().__init__(str(path), _Handler)
+
+    def service_actions(self):
+        super().service_actions()
+        if time.monotonic() - self._refreshed > REFRESH_INTERVAL:
+            self._log.debug("Refreshing kube config")
+            self._refresh()
+            self._refreshed = time.monotonic()
+
+
+def serve(
+    path: Path,
+    execute: Callable[[list[str]], None],
+    refresh: Callable[[], None],
+    log: logging.Logger,
+):
+    if not path.parent.exists():
+        path.parent.mkdir(mode=0o700, parents=True)
+    if path.exists():
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(path))
+            raise RuntimeError(f"A kodman daemon is already listening on {path}")
+        except ConnectionRefusedError:
+            path.unlink()  # Left behind by a daemon that did not exit cleanly
+        finally:
+            probe.close()
+
+    with DaemonServer(path, execute, refresh, log) as server:
+        path.chmod(0o600)
+        log.info(f"Listening on {path}")
+        try:
+            server.serve_forever()
+        finally:
+            path.unlink(missing_ok=True)
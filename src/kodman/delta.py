@@ -0,0 +1,214 @@
+import logging
+import shlex
+import stat
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field, replace
+from pathlib import Path, PurePosixPath
+
+from kubernetes import client
+from kubernetes.stream import stream
+
+from .cache import hash_file
+from .compression import CODECS, Codec
+from .ignore import IgnoreRules, walk
+from .timings import Timings
+from .transfer import ExecReader, TransferStats, cp_k8s
+
+
+@dataclass(frozen=True)
+class RemoteEntry:
+    kind: str  # 'd', 'f' or 'l'
+    size: int
+    mtime: int
+    mode: int
+    digest: str = field(default_factory=lambda: "")
+
+
+@dataclass(frozen=True)
+class DeltaPlan:
+    members: list[tuple[Path, str]]  # Added or changed, as for cp_k8s
+    deletions: list[str]  # Absolute remote paths
+    unchanged: int
+
+
+def manifest_command(dest_path: PurePosixPath) -> list[str]:
+    """Remote command listing the tree at dest_path, which may not exist.
+
+    Prints 'KIND SIZE MTIME MODE PATH' for every entry, then the sha256sum
+    of every file. Paths start with './'.
+    """
+    dest = shlex.quote(str(dest_path))
+    return [
+        "sh",
+        "-c",
+        f"cd {dest} 2>/dev/null || exit 0; "
+        "find . -type d -exec stat -c 'd 0 %Y %a %n' {} + && "
+        "find . -type l -exec stat -c 'l 0 %Y %a %n' {} + && "
+        "find . -type f -exec stat -c 'f %s %Y %a %n' {} + && "
+        "find . -type f -exec sha256sum {} +",
+    ]
+
+
+def parse_manifest(data: bytes) -> dict[str, RemoteEntry]:
+    """Entries of manifest_command output by path relative to the tree root.
+
+    Names with newlines, which sha256sum escapes, can't be listed and are
+    left out, so they are always sent.
+    """
+    entries: dict[str, RemoteEntry] = {}
+    digests: dict[str, str] = {}
+    for line in data.decode(errors="surrogateescape").splitlines():
+        if line[:2] in ("d ", "l ", "f "):
+            kind, size, mtime, mode, path = line.split(" ", 4)
+            entry = RemoteEntry(kind, int(size), int(mtime), int(mode, 8))
+            entries[_relative(path)] = entry
+        elif len(line) > 66 and line[64:66] == "  ":
+            digests[_relative(line[66:])] = line[:64]
+    for path, digest in digests.items():
+        if (entry := entries.get(path)) and entry.kind == "f":
+            entries[path] = replace(entry, digest=digest)
+    return entries
+
+
+def _relative(path: str) -> str:
+    return path[2:] if path.startswith("./") else path
+
+
+def fetch_manifest(
+    kube_conn: client.CoreV1Api,
+    namespace: str,
+    pod_name: str,
+    container: str,
+    dest_path: PurePosixPath,
+    log: logging.Logger,
+) -> dict[str, RemoteEntry]:
+    """List the tree at dest_path in the pod with a single exec."""
+    resp = stream(
+        kube_conn.connect_get_namespaced_pod_exec,
+        pod_name,
+        namespace,
+        container=container,
+        command=manifest_command(dest_path),
+        stderr=False,
+        stdin=False,
+        stdout=True,
+        tty=False,
+        binary=True,
+        _preload_content=False,
+    )
+    reader = ExecReader(resp, pod_name)
+    try:
+        data = reader.read()
+        reader.finish()
+    finally:
+        resp.close()
+    entries = parse_manifest(data)
+    log.debug(f"{dest_path} in {pod_name} has {len(entries)} entries")
+    return entries
+
+
+def plan_delta(
+    source_path: Path,
+    dest_path: PurePosixPath,
+    remote: dict[str, RemoteEntry],
+    ignore: IgnoreRules | None = None,
+) -> DeltaPlan:
+    """Compare a local tree with the manifest of its remote copy.
+
+    Files are unchanged with the same mode and size, and either the same
+    modification time or the same hash, so local files are only hashed when
+    their time differs. Symlinks are always sent. Remote paths missing
+    locally, or of another type, are deleted unless excluded by ignore.
+    """
+    ignore = ignore or IgnoreRules()
+    members: list[tuple[Path, str]] = []
+    deletions: list[str] = []
+    local: set[str] = set()
+    unchanged = 0
+    for path, is_dir in walk(source_path, ignore):
+        relative = path.relative_to(source_path).as_posix()
+        local.add(relative)
+        st = path.lstat()
+        kind = "d" if is_dir else "l" if stat.S_ISLNK(st.st_mode) else "f"
+        entry = remote.get(relative)
+        if entry and entry.kind != kind:
+            deletions.append(relative)
+            entry = None
+        if entry and _unchanged(path, st, entry):
+            unchanged += 1
+            continue
+        members.append((path, str(dest_path / relative)))
+
+    for relative in sorted(remote.keys() - local):
+        if not ignore.excluded(relative):
+            deletions.append(relative)
+    # Removing a directory removes everything below it
+    pruned: list[str] = []
+    for relative in sorted(deletions):
+        if not pruned or not relative.startswith(pruned[-1] + "/"):
+            pruned.append(relative)
+    return DeltaPlan(members, [str(dest_path / p) for p in pruned], unchanged)
+
+
+def _unchanged(path: Path, st, entry: RemoteEntry) -> bool:
+    if entry.kind == "l" or entry.mode != stat.S_IMODE(st.st_mode):
+        return False
+    if entry.kind == "d":
+        return True
+    if not stat.S_ISREG(st.st_mode) or entry.size != st.st_size:
+        return False
+    return entry.mtime == int(st.st_mtime) or entry.digest == hash_file(path)
+
+
+def sync_k8s(
+    kube_conn: client.CoreV1Api,
+    namespace: str,
+    pod_name: str,
+    container: str,
+    source_path: Path,
+    dest_path: PurePosixPath,
+    log: logging.Logger,
+    codec: Codec = CODECS["none"],
+    timings: Timings | None = None,
+    ignore: IgnoreRules | None = None,
+    sparse: Callable[[], bool] | None = None,
+) -> TransferStats:
+    """Make dest_path in the pod a copy of the directory source_path.
+
+    Only added and changed files are sent, in one stream which also removes
+    paths gone locally, so transfers scale with the change. Files with holes
+    are sent as sparse members if sparse, as for cp_k8s.
+    """
+    timings = timings or Timings()
+    start = time.monotonic()
+    with timings.span("sync.manifest", pod=pod_name) as span:
+        remote = fetch_manifest(
+            kube_conn, namespace, pod_name, container, dest_path, log
+        )
+        plan = plan_delta(source_path, dest_path, remote, ignore)
+        span.update(
+            sent=len(plan.members),
+            deleted=len(plan.deletions),
+            unchanged=plan.unchanged,
+        )
+    log.info(
+        f"Syncing {len(plan.members)} changed and {len(plan.deletions)} deleted "
+        f"paths, {plan.unchanged} unchanged"
+    )
+    if not plan.members and not plan.deletions:
+        return TransferStats(0, 0, time.monotonic() - start)
+    return cp_k8s(
+        kube_conn,
+        namespace,
+        pod_name,
+        container,
+        source_path,
+        Path(dest_path),
+        log,
+        codec=codec,
+        members=plan.members,
+        timings=timings,
+        deletions=plan.deletions,
+        sparse=sparse,
+    )
@@ -2,15 +2,14 @@ import argparse
 import logging
 import sys
 from abc import ABC, abstractmethod
-from typing import overload
-
-from rich.console import Console
+from typing import Any, overload
 
 from .utilities import get_env as _get_env
 
 
 class Command(ABC):
     exit_code = 0
+    needs_context = True  # Commands that never touch the cluster skip the backend
 
     @abstractmethod
     def do(self, args, ctx, env, log):
@@ -30,14 +29,50 @@ class ConsoleOutputHandler(logging.Handler):
         self._status.update(record.msg)
 
 
+class StdoutWriter:
+    """Raw stdout writer that stops the status spinner when output starts.
+
+    The spinner redraws its line in place, so it would overwrite output that
+    bypasses the console.
+    """
+
+    def __init__(self, on_start):
+        self._on_start = on_start
+
+    def write(self, data: bytes, /) -> int:
+        if self._on_start:
+            self._on_start()
+            self._on_start = None
+            sys.stdout.flush()
+        return sys.stdout.buffer.write(data)
+
+    def flush(self):
+        sys.stdout.buffer.flush()
+
+
 class ArgparseEngine:
     _env_types = {}
     _env_vals = {}
 
     def __init__(self, debug=False):
-        # Configure logging
+        # Logging is configured on launch, so help and errors stay lightweight
         self._log = logging.getLogger("ArgparseEngine")
-        self._console = Console()
+        self._debug = debug
+        self._status = None
+
+        # Configure application
+        self._parser = argparse.ArgumentParser(
+            formatter_class=argparse.RawTextHelpFormatter,
+        )
+        self._subparsers = self._parser.add_subparsers(dest="cli_command")
+        self._ctx: Any = None
+        self._args = []
+        self._commands = []
+        self._configured = False
+
+    def _configure_logging(self, debug):
+        for handler in list(self._log.handlers):
+            self._log.removeHandler(handler)
         self._status = None
         if debug:
             formatter = logging.Formatter("%(levelname)s:\t%(message)s")
@@ -46,19 +81,27 @@ class ArgparseEngine:
             self._log.addHandler(handler)
             self._log.setLevel("DEBUG")
         else:
+            from rich.console import Console
+
+            self._console = Console()
             self._status = self._console.status("Initializing application...")
             handler = ConsoleOutputHandler(self._status)
             self._log.addHandler(handler)
             self._log.setLevel("INFO")
 
-        # Configure application
-        self._parser = argparse.ArgumentParser(
-            formatter_class=argparse.RawTextHelpFormatter,
-        )
-        self._subparsers = self._parser.add_subparsers(dest="cli_command")
-        self._ctx = None
-        self._args = []
-        self._commands = []
+    def stop_status(self):
+        """Stop the status spinner, e.g. before forking worker processes."""
+        if self._status:
+            self._status.stop()
+
+    def stdout(self) -> StdoutWriter:
+        return StdoutWriter(self.stop_status)
+
+    def get_ctx(self):
+        return self._ctx
+
+    def after_command(self, args):
+        """Hook run once a command that needs the context has finished."""
 
     def add_command(self, command: type[Command]):
         self._commands.append(command())
@@ -81,6 +124,11 @@ class ArgparseEngine:
 
         return val
 
+    def refresh_env(self):
+        """Re-read all registered environment variables."""
+        for variable, expected_type in self._env_types.items():
+            self.get_env(variable, expected_type)
+
     def _process_env(self):
         message = "environment variables:\n"
         for env, _type in self._env_types.items():
@@ -92,22 +140,32 @@ class ArgparseEngine:
             message += message_prefix + message_body + message_suffix
         self._parser.epilog = message
 
-    def launch(self):
-        for command in self._commands:
-            command.add(self._subparsers)
+    def launch(self, argv: list[str] | None = None):
+        if not self._configured:
+            for command in self._commands:
+                command.add(self._subparsers)
+            self._configured = True
 
         self._process_env()
 
-        args = self._parser.parse_args()
-
-        if self._status:
-            self._status.start()
+        args = self._parser.parse_args(argv)
 
         for command in self._commands:
-            if args.cli_command == command.__class__.__name__.lower():
-                command.do(args, self._ctx, self._env_vals, self._log)
+            name = command.__class__.__name__.lower()
+            if args.cli_command and args.cli_command.replace("-", "") == name:
+                if not command.needs_context:
+                    command.do(args, None, self._env_vals, self._log)
+                    sys.exit(command.exit_code)
 
+                self._configure_logging(self._debug)
                 if self._status:
-                    self._status.stop()
+                    self._status.start()
+
+                try:
+                    command.do(args, self.get_ctx(), self._env_vals, self._log)
+                finally:
+                    if self._status:
+                        self._status.stop()
+                    self.after_command(args)
 
                 sys.exit(command.exit_code)
@@ -0,0 +1,129 @@
+import os
+import re
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+IGNORE_FILE = ".kodmanignore"
+
+
+def translate(pattern: str) -> re.Pattern[str]:
+    """Compile a glob where * and ? stop at '/' while ** spans directories."""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and (end := pattern.find("]", i + 2)) != -1:
+            chars = pattern[i + 1 : end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            parts.append(f"[{chars.replace(chr(92), chr(92) * 2)}]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile("".join(parts))
+
+
+class IgnoreRules:
+    """Exclude patterns with .dockerignore semantics.
+
+    Patterns match paths relative to the volume root, and a pattern matching
+    a directory excludes everything below it. Patterns starting with '!'
+    re-include paths and the last matching pattern wins.
+    """
+
+    def __init__(self, patterns: Iterable[str] = ()):
+        self.patterns: list[str] = []
+        self._rules: list[tuple[bool, re.Pattern[str], list[re.Pattern[str]]]] = []
+        for line in patterns:
+            pattern = line.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            self.patterns.append(pattern)
+            negate = pattern.startswith("!")
+            pattern = os.path.normpath(pattern.lstrip("!").strip()).lstrip("/")
+            if pattern in ("", "."):
+                continue
+            parts = [translate(part) for part in pattern.split("/")]
+            self._rules.append((negate, translate(pattern), parts))
+
+    @classmethod
+    def load(cls, root: Path, patterns: Iterable[str] = ()) -> "IgnoreRules":
+        """Rules from the .kodmanignore file at root followed by patterns."""
+        lines: list[str] = []
+        if (root / IGNORE_FILE).is_file():
+            lines = (root / IGNORE_FILE).read_text().splitlines()
+        return cls([*lines, *patterns])
+
+    def __bool__(self) -> bool:
+        return bool(self._rules)
+
+    def excluded(self, path: str) -> bool:
+        """Whether a '/' separated path relative to the root is excluded."""
+        names = path.split("/")
+        prefixes = ["/".join(names[: i + 1]) for i in range(len(names))]
+        excluded = False
+        for negate, regex, _ in self._rules:
+            if any(regex.fullmatch(prefix) for prefix in prefixes):
+                excluded = not negate
+        return excluded
+
+    def prune(self, path: str) -> bool:
+        """Whether a directory can be skipped without looking inside it.
+
+        Excluded directories still have to be walked when a '!' pattern may
+        re-include something below them.
+        """
+        if not self.excluded(path):
+            return False
+        names = path.split("/")
+        for negate, _, parts in self._rules:
+            if negate and _may_match_below(parts, names):
+                return False
+        return True
+
+
+def _may_match_below(parts: list[re.Pattern[str]], names: list[str]) -> bool:
+    for i, name in enumerate(names):
+        if i >= len(parts):
+            return False
+        if parts[i].pattern.startswith(".*"):  # '**' spans any number of levels
+            return True
+        if not parts[i].fullmatch(name):
+            return False
+    return len(parts) > len(names)
+
+
+def walk(root: Path, rules: IgnoreRules) -> Iterator[tuple[Path, bool]]:
+    """Yield (path, is_dir) for root and every path below it not excluded.
+
+    Pruned directories are never listed. Symlinks to directories are yielded
+    as files since they are archived as links.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        current = Path(dirpath)
+        relative = current.relative_to(root).as_posix()
+        prefix = "" if relative == "." else relative + "/"
+        if not prefix or not rules.excluded(relative):
+            yield current, True
+        dirnames[:] = [name for name in dirnames if not rules.prune(prefix + name)]
+        for name in filenames:
+            if not rules.excluded(prefix + name):
+                yield current / name, False
+        for name in dirnames:
+            if (current / name).is_symlink():
+                yield current / name, False
@@ -0,0 +1,95 @@
+import base64
+import stat
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from .ignore import IgnoreRules, walk
+
+# Encoded data allowed in one ConfigMap or Secret, leaving room in the 1 MiB
+# object limit for metadata and the keys
+PROJECTION_LIMIT = 1000 * 1000
+
+
+@dataclass(frozen=True)
+class ProjectedFile:
+    key: str
+    path: str  # Relative to the mount point
+    mode: int
+    source: Path
+
+    @property
+    def encoded_size(self) -> int:
+        return len(self.key) + 4 * -(-self.source.stat().st_size // 3)
+
+
+def projected_files(
+    index: int,
+    src: Path,
+    dst_name: str,
+    limit: int,
+    ignore: IgnoreRules | None = None,
+) -> list[ProjectedFile] | None:
+    """Files of a volume as ConfigMap or Secret keys, or None if it can't be.
+
+    Projections can only hold regular files, so volumes with symlinks,
+    special files or empty directories are left to be copied, as are those
+    encoding to more than limit bytes. Walking stops as soon as either is
+    found. A single file is projected under its name at the destination.
+    """
+    if src.is_file() and not src.is_symlink():
+        mode = stat.S_IMODE(src.stat().st_mode)
+        file = ProjectedFile(f"{index}-0", dst_name, mode, src)
+        return [file] if file.encoded_size <= limit else None
+    if not src.is_dir():
+        return None
+    size = 0
+    files: list[ProjectedFile] = []
+    parents: set[Path] = set()
+    dirs: list[Path] = []
+    for path, is_dir in walk(src, ignore or IgnoreRules()):
+        if is_dir:
+            dirs.append(path)
+            continue
+        st = path.lstat()
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        relative = path.relative_to(src).as_posix()
+        key = f"{index}-{len(files)}"
+        file = ProjectedFile(key, relative, stat.S_IMODE(st.st_mode), path)
+        size += file.encoded_size
+        if size > limit:
+            return None
+        files.append(file)
+        parents.update(path.parents)
+    if any(path not in parents for path in dirs[1:]) or not files:
+        return None  # Empty directories would be lost
+    return files
+
+
+def projection_object(
+    kind: str, name: str, files: list[ProjectedFile], owner: dict[str, Any]
+) -> dict[str, Any]:
+    """ConfigMap or Secret holding files, deleted along with its owner."""
+    data = {
+        file.key: base64.b64encode(file.source.read_bytes()).decode() for file in files
+    }
+    return {
+        "apiVersion": "v1",
+        "kind": kind,
+        "metadata": {"name": name, "ownerReferences": [owner]},
+        "binaryData" if kind == "ConfigMap" else "data": data,
+    }
+
+
+def projection_volume(
+    volume_name: str, kind: str, object_name: str, files: list[ProjectedFile]
+) -> dict[str, Any]:
+    """Pod volume mounting files from a ConfigMap or Secret."""
+    items = [{"key": f.key, "path": f.path, "mode": f.mode} for f in files]
+    if kind == "ConfigMap":
+        return {
+            "name": volume_name,
+            "configMap": {"name": object_name, "items": items},
+        }
+    return {"name": volume_name, "secret": {"secretName": object_name, "items": items}}
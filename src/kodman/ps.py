@@ -0,0 +1,86 @@
+import shlex
+from datetime import datetime
+
+from kubernetes.client.models.v1_pod import V1Pod
+
+from .backend import IMAGE_ANNOTATION, OWNER_LABEL, POOL_STATE_LABEL, exec_status
+
+# Fixed widths keep memory flat: rows are printed as pages arrive
+COLUMNS = (
+    ("POD", 32),
+    ("IMAGE", 24),
+    ("COMMAND", 24),
+    ("CREATED", 16),
+    ("STATUS", 24),
+    ("OWNER", 16),
+)
+
+UNITS = (("day", 86400), ("hour", 3600), ("minute", 60), ("second", 1))
+
+
+def humanize(seconds: float) -> str:
+    """Docker style duration, e.g. '5 minutes' or 'About a minute'."""
+    seconds = max(int(seconds), 0)
+    if seconds < 1:
+        return "Less than a second"
+    if 60 <= seconds < 120:
+        return "About a minute"
+    if 3600 <= seconds < 7200:
+        return "About an hour"
+    for unit, size in UNITS:
+        if seconds >= size:
+            count = seconds // size
+            return f"{count} {unit}{'s' if count != 1 else ''}"
+    return ""
+
+
+def truncate(text: str, width: int) -> str:
+    return text if len(text) <= width else text[: width - 1] + "…"
+
+
+def pod_status(pod: V1Pod, now: datetime) -> str:
+    labels = pod.metadata.labels or {}  # type: ignore
+    if labels.get(POOL_STATE_LABEL) == "idle":
+        return "Pooled"
+    container_status = exec_status(pod)
+    state = container_status.state if container_status else None
+    if state and state.terminated:
+        finished = state.terminated.finished_at or now
+        ago = humanize((now - finished).total_seconds())
+        return f"Exited ({state.terminated.exit_code}) {ago} ago"
+    if state and state.running and state.running.started_at:
+        return f"Up {humanize((now - state.running.started_at).total_seconds())}"
+    if state and state.waiting and state.waiting.reason:
+        return state.waiting.reason
+    return pod.status.phase or "Unknown"  # type: ignore
+
+
+def format_cells(values: list[str]) -> str:
+    cells = [
+        truncate(value, width).ljust(width)
+        for value, (_, width) in zip(values, COLUMNS, strict=True)
+    ]
+    return "  ".join(cells).rstrip()
+
+
+def header() -> str:
+    return format_cells([name for name, _ in COLUMNS])
+
+
+def format_row(pod: V1Pod, now: datetime) -> str:
+    metadata = pod.metadata
+    container = pod.spec.containers[0]  # type: ignore
+    command = shlex.join((container.command or []) + (container.args or []))
+    annotations = metadata.annotations or {}  # type: ignore
+    labels = metadata.labels or {}  # type: ignore
+    created = metadata.creation_timestamp  # type: ignore
+    return format_cells(
+        [
+            metadata.name or "",  # type: ignore
+            annotations.get(IMAGE_ANNOTATION, container.image or ""),
+            f'"{command}"' if command else "",
+            f"{humanize((now - created).total_seconds())} ago" if created else "",
+            pod_status(pod, now),
+            labels.get(OWNER_LABEL, ""),
+        ]
+    )
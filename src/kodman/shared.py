@@ -0,0 +1,102 @@
+import os
+import re
+import socket
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+
+from kubernetes.client.models.v1_persistent_volume_claim import (
+    V1PersistentVolumeClaim,
+)
+from kubernetes.client.models.v1_pod import V1Pod
+
+MOUNTINFO = Path("/proc/self/mountinfo")
+
+
+@dataclass(frozen=True)
+class SharedClaim:
+    """A claim holding a volume source, mounted by the run pod directly."""
+
+    claim: str
+    sub_path: str  # Of the source within the claim, '' for its root
+    node: str = field(default_factory=lambda: "")  # Required for ReadWriteOnce
+
+
+@dataclass(frozen=True)
+class ClaimMount:
+    claim: str
+    mount_path: PurePosixPath
+    sub_path: str
+    read_only: bool
+
+
+def runner_pod_name() -> str:
+    """Name of the pod kodman runs in, which is its hostname by default."""
+    return os.environ.get("HOSTNAME") or socket.gethostname()
+
+
+def mount_points(mountinfo: str) -> set[str]:
+    """Mount points listed in /proc/self/mountinfo, with octal escapes decoded."""
+    points = set()
+    for line in mountinfo.splitlines():
+        fields = line.split(" ")
+        if len(fields) > 4:
+            points.add(re.sub(r"\\([0-7]{3})", lambda m: chr(int(m[1], 8)), fields[4]))
+    return points
+
+
+def claim_mounts(pod: V1Pod, mounted: set[str]) -> list[ClaimMount]:
+    """Claims mounted in this container of pod, longest mount path first.
+
+    The spec lists the mounts of every container, so only those found in
+    the mount table of this process count.
+    """
+    claims = {
+        volume.name: volume.persistent_volume_claim
+        for volume in pod.spec.volumes or []  # type: ignore
+        if volume.persistent_volume_claim
+    }
+    mounts = []
+    for container in pod.spec.containers:  # type: ignore
+        for mount in container.volume_mounts or []:
+            if mount.name in claims and mount.mount_path in mounted:
+                source = claims[mount.name]
+                mounts.append(
+                    ClaimMount(
+                        source.claim_name,
+                        PurePosixPath(mount.mount_path),
+                        mount.sub_path or "",
+                        bool(mount.read_only or source.read_only),
+                    )
+                )
+    return sorted(mounts, key=lambda m: len(m.mount_path.parts), reverse=True)
+
+
+def find_claim(src: Path, mounts: list[ClaimMount]) -> ClaimMount | None:
+    """The claim mount src is on, with sub_path extended down to src."""
+    for mount in mounts:
+        if src.is_relative_to(mount.mount_path):
+            relative = src.relative_to(mount.mount_path).as_posix()
+            sub_path = "/".join(p for p in (mount.sub_path, relative) if p != ".")
+            return ClaimMount(
+                mount.claim, mount.mount_path, sub_path.strip("/"), mount.read_only
+            )
+    return None
+
+
+def share_claim(
+    mount: ClaimMount, claim: V1PersistentVolumeClaim, node: str, rw: bool
+) -> SharedClaim | None:
+    """How a run pod can mount the claim, or None if it has to be copied.
+
+    ReadWriteOnce claims can only be shared on the node of this pod, which
+    the run pod is then pinned to. ReadWriteOncePod claims can't be shared.
+    """
+    modes = set((claim.status and claim.status.access_modes) or [])
+    modes |= set(claim.spec.access_modes or [])  # type: ignore
+    if rw and (mount.read_only or modes == {"ReadOnlyMany"}):
+        return None
+    if modes & {"ReadWriteMany", "ReadOnlyMany"}:
+        return SharedClaim(mount.claim, mount.sub_path)
+    if "ReadWriteOnce" in modes and node:
+        return SharedClaim(mount.claim, mount.sub_path, node)
+    return None
@@ -0,0 +1,393 @@
+import errno
+import os
+import stat
+import tarfile
+import threading
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+
+from .compression import Writer
+
+try:
+    import grp
+    import pwd
+except ImportError:
+    grp = pwd = None
+
+BLOCK = tarfile.BLOCKSIZE
+RECORD = tarfile.RECORDSIZE
+SMALL_FILE = 256 * 1024  # Read whole on the pool, larger files are streamed
+BATCH = 256  # Members statted and read per pool task
+READ_WORKERS = 8
+READ_AHEAD = 4 * READ_WORKERS  # Batches in flight
+READ_AHEAD_BYTES = 8 * 1024 * 1024  # File content held ahead of the writer
+WRITE_SIZE = 1024 * 1024
+STREAM_SIZE = 1024 * 1024
+SPARSE_ENTRIES = 4  # Regions in a GNU sparse header
+SPARSE_EXTENDED_ENTRIES = 21  # Regions in each extension block
+USTAR_TYPES = {
+    stat.S_IFREG: tarfile.REGTYPE,
+    stat.S_IFDIR: tarfile.DIRTYPE,
+    stat.S_IFLNK: tarfile.SYMTYPE,
+    stat.S_IFIFO: tarfile.FIFOTYPE,
+    stat.S_IFCHR: tarfile.CHRTYPE,
+    stat.S_IFBLK: tarfile.BLKTYPE,
+}
+
+
+@dataclass
+class Member:
+    path: Path
+    arcname: str
+    st: os.stat_result
+    data: bytes | None = None  # Content of small regular files
+
+
+@cache
+def _uname(uid: int) -> str:
+    try:
+        return pwd.getpwuid(uid).pw_name if pwd else ""
+    except KeyError:
+        return ""
+
+
+@cache
+def _gname(gid: int) -> str:
+    try:
+        return grp.getgrgid(gid).gr_name if grp else ""
+    except KeyError:
+        return ""
+
+
+def _encode(name: str) -> bytes:
+    return name.encode("utf-8", "surrogateescape")
+
+
+def _split_name(name: bytes) -> tuple[bytes, bytes] | None:
+    """Split a name into ustar prefix and name fields, if it fits them."""
+    if len(name) <= 100:
+        return b"", name
+    for i in range(len(name) - 1, 0, -1):
+        if name[i : i + 1] == b"/" and i <= 155 and len(name) - i - 1 <= 100:
+            return name[:i], name[i + 1 :]
+    return None
+
+
+def ustar_header(
+    name: str,
+    st: os.stat_result,
+    kind: bytes,
+    size: int = 0,
+    linkname: str = "",
+) -> bytes:
+    """The header block of a member, or a pax header when ustar is too small."""
+    encoded, link = _encode(name), _encode(linkname)
+    fields = _split_name(encoded)
+    uname, gname = _uname(st.st_uid), _gname(st.st_gid)
+    mtime = int(st.st_mtime)
+    if (
+        fields is None
+        or len(link) > 100
+        or size >= 8**11
+        or not 0 <= mtime < 8**11
+        or max(st.st_uid, st.st_gid) >= 8**7
+        or len(_encode(uname)) > 32
+        or len(_encode(gname)) > 32
+    ):
+        info = tarfile.TarInfo(name)
+        info.type, info.size, info.linkname = kind, size, linkname
+        info.mode, info.mtime = stat.S_IMODE(st.st_mode), mtime
+        info.uid, info.gid, info.uname, info.gname = st.st_uid, st.st_gid, uname, gname
+        if kind in (tarfile.CHRTYPE, tarfile.BLKTYPE):
+            info.devmajor, info.devminor = os.major(st.st_rdev), os.minor(st.st_rdev)
+        return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+    prefix, short = fields
+    major = minor = 0
+    if kind in (tarfile.CHRTYPE, tarfile.BLKTYPE):
+        major, minor = os.major(st.st_rdev), os.minor(st.st_rdev)
+    header = b"".join(
+        (
+            short.ljust(100, b"\0"),
+            b"%07o\0" % stat.S_IMODE(st.st_mode),
+            b"%07o\0" % st.st_uid,
+            b"%07o\0" % st.st_gid,
+            b"%011o\0" % size,
+            b"%011o\0" % mtime,
+            b" " * 8,  # Checksum, counted as spaces
+            kind,
+            link.ljust(100, b"\0"),
+            tarfile.POSIX_MAGIC,
+            _encode(uname).ljust(32, b"\0"),
+            _encode(gname).ljust(32, b"\0"),
+            b"%07o\0" % major,
+            b"%07o\0" % minor,
+            prefix.ljust(155, b"\0"),
+            bytes(12),
+        )
+    )
+    checksum = b"%06o\0 " % sum(header)
+    return header[:148] + checksum + header[156:]
+
+
+def _gnu_number(value: int, digits: int) -> bytes:
+    """A GNU header number field, in base 256 when octal is too small."""
+    if 0 <= value < 8 ** (digits - 1):
+        return b"%0*o\0" % (digits - 1, value)
+    if value < 0:
+        return (value + 256**digits).to_bytes(digits, "big")
+    return b"\x80" + value.to_bytes(digits - 1, "big")
+
+
+def _gnu_header(
+    name: bytes, st: os.stat_result, kind: bytes, size: int, tail: bytes = b""
+) -> bytes:
+    """A GNU format header block, with tail holding its fields after devminor."""
+    header = b"".join(
+        (
+            name.ljust(100, b"\0"),
+            _gnu_number(stat.S_IMODE(st.st_mode), 8),
+            _gnu_number(st.st_uid, 8),
+            _gnu_number(st.st_gid, 8),
+            _gnu_number(size, 12),
+            _gnu_number(int(st.st_mtime), 12),
+            b" " * 8,  # Checksum, counted as spaces
+            kind,
+            bytes(100),
+            tarfile.GNU_MAGIC,
+            _encode(_uname(st.st_uid))[:32].ljust(32, b"\0"),
+            _encode(_gname(st.st_gid))[:32].ljust(32, b"\0"),
+            bytes(16),
+            tail.ljust(167, b"\0"),
+        )
+    )
+    checksum = b"%06o\0 " % sum(header)
+    return header[:148] + checksum + header[156:]
+
+
+def sparse_header(
+    name: str, st: os.stat_result, regions: list[tuple[int, int]]
+) -> bytes:
+    """The headers of a GNU sparse member holding only the regions of a file.
+
+    Regions past the four fitting the header follow in extension blocks, and
+    a name too long for the header in a GNU long name member before it.
+    """
+    encoded = _encode(name)
+    headers = b""
+    if len(encoded) > 100:
+        long = encoded + b"\0"
+        headers += _gnu_header(
+            b"././@LongLink", st, tarfile.GNUTYPE_LONGNAME, len(long)
+        )
+        headers += long + bytes(-len(long) % BLOCK)
+    entries = [
+        _gnu_number(offset, 12) + _gnu_number(length, 12) for offset, length in regions
+    ]
+    first, rest = entries[:SPARSE_ENTRIES], entries[SPARSE_ENTRIES:]
+    tail = b"".join(
+        (
+            bytes(41),  # atime, ctime, offset, longnames, unused
+            b"".join(first).ljust(24 * SPARSE_ENTRIES, b"\0"),
+            b"\1" if rest else b"\0",
+            _gnu_number(st.st_size, 12),
+        )
+    )
+    size = sum(length for _, length in regions)
+    headers += _gnu_header(encoded[:100], st, tarfile.GNUTYPE_SPARSE, size, tail)
+    for i in range(0, len(rest), SPARSE_EXTENDED_ENTRIES):
+        block = rest[i : i + SPARSE_EXTENDED_ENTRIES]
+        more = i + SPARSE_EXTENDED_ENTRIES < len(rest)
+        headers += b"".join(block).ljust(504, b"\0") + (b"\1" if more else b"\0")
+        headers += bytes(7)
+    return headers
+
+
+def data_regions(path: Path, size: int) -> list[tuple[int, int]] | None:
+    """Offsets and lengths of the data in a file, or None if it has no holes.
+
+    Holes are found with SEEK_DATA and SEEK_HOLE. A file ending in a hole
+    gets a last empty region at its end, so that extraction restores its size.
+    """
+    if not hasattr(os, "SEEK_DATA"):
+        return None
+    regions: list[tuple[int, int]] = []
+    with open(path, "rb") as f:
+        offset = 0
+        while offset < size:
+            try:
+                start = os.lseek(f.fileno(), offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    break  # Only a hole is left
+                if e.errno == errno.EINVAL:
+                    return None  # Not supported by the filesystem
+                raise
+            offset = min(os.lseek(f.fileno(), start, os.SEEK_HOLE), size)
+            regions.append((start, offset - start))
+    if regions == [(0, size)]:
+        return None
+    if not regions or sum(regions[-1]) < size:
+        regions.append((size, 0))
+    return regions
+
+
+class _Budget:
+    """Bytes that may be held in memory, taken by readers and given back."""
+
+    def __init__(self, size: int):
+        self._free = size
+        self._lock = threading.Lock()
+
+    def take(self, size: int) -> bool:
+        with self._lock:
+            if size > self._free:
+                return False
+            self._free -= size
+            return True
+
+    def give(self, size: int):
+        with self._lock:
+            self._free += size
+
+
+def _load(batch: list[tuple[Path, str]], budget: _Budget) -> list[Member]:
+    members = []
+    for path, arcname in batch:
+        st = os.lstat(path)
+        member = Member(path, arcname.replace(os.sep, "/").lstrip("/"), st)
+        if (
+            stat.S_ISREG(st.st_mode)
+            and st.st_size <= SMALL_FILE
+            and budget.take(st.st_size)
+        ):
+            with open(path, "rb") as f:
+                member.data = f.read(st.st_size)
+            budget.give(st.st_size - len(member.data))  # Shrank since the stat
+        members.append(member)
+    return members
+
+
+def _written(batch: list[Member], budget: _Budget) -> Iterator[Member]:
+    for member in batch:
+        yield member
+        if member.data is not None:
+            budget.give(len(member.data))
+            member.data = None  # Written, so not held until the batch is
+
+
+def _prefetch(
+    members: Iterable[tuple[Path, str]], executor: ThreadPoolExecutor
+) -> Iterator[Member]:
+    """Stat and read members in batches, keeping READ_AHEAD batches in flight.
+
+    Small files are only read ahead while their content fits READ_AHEAD_BYTES,
+    given back as each member is written. Past that the writer streams them
+    itself, so a writer slower than the readers does not fill memory.
+    """
+    budget = _Budget(READ_AHEAD_BYTES)
+    pending: deque[Future[list[Member]]] = deque()
+    batch: list[tuple[Path, str]] = []
+    for item in members:
+        batch.append(item)
+        if len(batch) == BATCH:
+            pending.append(executor.submit(_load, batch, budget))
+            batch = []
+            if len(pending) >= READ_AHEAD:
+                yield from _written(pending.popleft().result(), budget)
+    if batch:
+        pending.append(executor.submit(_load, batch, budget))
+    while pending:
+        yield from _written(pending.popleft().result(), budget)
+
+
+def write_tar(
+    fileobj: Writer,
+    members: Iterable[tuple[Path, str]],
+    workers: int = READ_WORKERS,
+    sparse: Callable[[], bool] | None = None,
+) -> int:
+    """Write a tar of (path, arcname) members to fileobj, returning the count.
+
+    Like tarfile.add without recursion: files linked more than once are
+    archived as hardlinks to their first member and sockets are skipped.
+    Large files with holes are archived as GNU sparse members if sparse,
+    called when such a file is found, tells that the reader restores them.
+    tarfile costs a stat, an open, several reads and a pax encoded header
+    per file, so trees of many small files pack slower than they send.
+    Here small files are statted and read in batches on a thread pool ahead
+    of the writer, ustar headers are packed directly and output is written
+    in large blocks.
+    """
+    buffer = bytearray()
+    links: dict[tuple[int, int], str] = {}
+    count = written = 0
+
+    def flush():
+        nonlocal written
+        fileobj.write(bytes(buffer))
+        written += len(buffer)
+        buffer.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for member in _prefetch(members, executor):
+            st, name = member.st, member.arcname
+            kind = USTAR_TYPES.get(stat.S_IFMT(st.st_mode))
+            if kind is None:
+                continue
+            count += 1
+            if kind == tarfile.REGTYPE and st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                if key in links:
+                    buffer += ustar_header(name, st, tarfile.LNKTYPE, 0, links[key])
+                    continue
+                links[key] = name
+            if kind == tarfile.SYMTYPE:
+                buffer += ustar_header(name, st, kind, 0, os.readlink(member.path))
+            elif kind == tarfile.DIRTYPE:
+                buffer += ustar_header(name.rstrip("/") + "/", st, kind)
+            elif kind != tarfile.REGTYPE:
+                buffer += ustar_header(name, st, kind)
+            elif member.data is not None:
+                buffer += ustar_header(name, st, kind, len(member.data))
+                buffer += member.data
+                buffer += bytes(-len(member.data) % BLOCK)
+            else:
+                regions = None
+                if sparse and st.st_blocks * 512 < st.st_size:
+                    regions = data_regions(member.path, st.st_size)
+                if regions is None or not sparse or not sparse():
+                    regions = [(0, st.st_size)]
+                    buffer += ustar_header(name, st, kind, st.st_size)
+                else:
+                    buffer += sparse_header(name, st, regions)
+                flush()
+                size = _stream_file(member.path, regions, fileobj)
+                written += size
+                buffer += bytes(-size % BLOCK)
+            if len(buffer) >= WRITE_SIZE:
+                flush()
+
+    buffer += bytes(2 * BLOCK)
+    buffer += bytes(-(written + len(buffer)) % RECORD)
+    flush()
+    return count
+
+
+def _stream_file(path: Path, regions: list[tuple[int, int]], fileobj: Writer) -> int:
+    """Copy the regions of a file to fileobj, returning the bytes copied."""
+    with open(path, "rb") as f:
+        for offset, length in regions:
+            f.seek(offset)
+            remaining = length
+            while remaining:
+                block = f.read(min(STREAM_SIZE, remaining))
+                if not block:
+                    raise OSError(f"{path} shrank while being archived")
+                fileobj.write(block)
+                remaining -= len(block)
+    return sum(length for _, length in regions)
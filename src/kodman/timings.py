@@ -0,0 +1,93 @@
+import functools
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+
+class Timings:
+    """Spans, counters and API calls recorded during one kodman command.
+
+    Recording is cheap and always on; the report is only written when asked
+    for with --timings or KODMAN_TIMINGS. Spans may be recorded from any
+    thread, e.g. by concurrent volume uploads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._origin = time.monotonic()
+        self._started = datetime.now(timezone.utc)
+        self.spans: list[dict[str, Any]] = []
+        self.counters: Counter[str] = Counter()
+        self.api_calls: Counter[str] = Counter()
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[dict[str, Any]]:
+        """Time the enclosed block. Attributes may be added to the yielded dict."""
+        start = time.monotonic()
+        record = {"name": name, **attributes}
+        try:
+            yield record
+        finally:
+            record["start"] = round(start - self._origin, 6)
+            record["seconds"] = round(time.monotonic() - start, 6)
+            with self._lock:
+                self.spans.append(record)
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def count_calls(self, api_client):
+        """Count requests made through api_client by method and path template.
+
+        Requests are counted where they are serialized, so exec and watch
+        requests are included.
+        """
+        param_serialize = api_client.param_serialize
+
+        @functools.wraps(param_serialize)
+        def counted(method, resource_path, *args, **kwargs):
+            with self._lock:
+                self.api_calls[f"{method} {resource_path}"] += 1
+            return param_serialize(method, resource_path, *args, **kwargs)
+
+        api_client.param_serialize = counted
+        return api_client
+
+    def report(self, command: str = "") -> dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start"])
+            counters = dict(self.counters)
+            api_calls = dict(self.api_calls)
+        phases: dict[str, float] = {}
+        for span in spans:
+            phases[span["name"]] = round(
+                phases.get(span["name"], 0) + span["seconds"], 6
+            )
+        return {
+            "command": command,
+            "started": self._started.isoformat(),
+            "seconds": round(time.monotonic() - self._origin, 6),
+            "phases": phases,
+            "counters": counters,
+            "api_calls": api_calls,
+            "spans": spans,
+        }
+
+    def write(self, target: str, command: str = ""):
+        """Write the report as JSON to a file, or to stderr if target is '-'."""
+        text = json.dumps(self.report(command), indent=2)
+        if target == "-":
+            print(text, file=sys.stderr)
+        else:
+            Path(target).write_text(text + "\n")
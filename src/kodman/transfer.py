@@ -0,0 +1,673 @@
+import heapq
+import logging
+import os
+import queue
+import shlex
+import stat
+import sys
+import tarfile
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+
+import yaml
+from kubernetes import client
+from kubernetes.stream import stream
+from kubernetes.stream.ws_client import (
+    ERROR_CHANNEL,
+    STDIN_CHANNEL,
+    V5_CHANNEL_PROTOCOL,
+)
+
+from .compression import CODECS, Codec, CountingWriter, Writer
+from .ignore import IgnoreRules, walk
+from .tarpack import write_tar
+from .timings import Timings
+
+CHUNK_SIZE = 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+PIPE_DEPTH = 8  # Peak buffered bytes are MAX_CHUNK_SIZE * PIPE_DEPTH
+FRAME_SECONDS = 0.05
+PROBE_SIZE = 512 * 1024
+FINISH_TIMEOUT = 300
+READ_TIMEOUT = 1
+CHANGED_LIST = "/tmp/kodman-changed"
+# Removes the paths listed on stdin up to an empty line, the archive follows.
+# The shell reads a pipe a byte at a time, so none of the archive is consumed.
+DELETE_SCRIPT = (
+    'while IFS= read -r path && [ -n "$path" ]; do rm -rf -- "$path" || exit 1; done'
+)
+
+
+class ChunkPipe:
+    """Bounded pipe between an archive producer thread and a network sender.
+
+    The producer writes arbitrarily sized blocks which are regrouped into
+    fixed-size chunks. Writes block once ``depth`` chunks are queued, so
+    memory use does not depend on the size of the archive.
+    """
+
+    _done = object()
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, depth: int = PIPE_DEPTH):
+        self.chunk_size = chunk_size  # May be changed while writing
+        self._queue: queue.Queue = queue.Queue(maxsize=depth)
+        self._buffer = bytearray()
+        self._aborted = threading.Event()
+
+    def _put(self, item):
+        while not self._aborted.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise BrokenPipeError("Transfer aborted by receiver")
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        while len(self._buffer) >= (size := self.chunk_size):
+            self._put(bytes(self._buffer[:size]))
+            del self._buffer[:size]
+        return len(data)
+
+    def close(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        self._put(self._done)
+
+    def fail(self, exception: BaseException):
+        try:
+            self._put(exception)
+        except BrokenPipeError:
+            pass  # Receiver has already given up
+
+    def abort(self):
+        self._aborted.set()
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            item = self._queue.get()
+            if item is self._done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+
+class ChunkSizer:
+    """Size chunks so that sending one takes about FRAME_SECONDS.
+
+    Sends block once the socket buffer is full, so their duration follows the
+    link throughput. Small chunks then keep frame overhead low on slow links
+    and large ones avoid per-frame costs on fast links.
+    """
+
+    def __init__(
+        self,
+        size: int = CHUNK_SIZE,
+        minimum: int = MIN_CHUNK_SIZE,
+        maximum: int = MAX_CHUNK_SIZE,
+    ):
+        self.size = size
+        self._minimum = minimum
+        self._maximum = maximum
+        self.throughput = 0.0
+
+    def record(self, size: int, seconds: float) -> int:
+        sample = size / max(seconds, 1e-6)
+        if self.throughput:
+            sample = 0.7 * self.throughput + 0.3 * sample
+        self.throughput = sample
+        self.size = min(max(int(sample * FRAME_SECONDS), self._minimum), self._maximum)
+        return self.size
+
+
+class ExecMonitor:
+    """Read an exec session on a background thread while stdin is written.
+
+    Reading stops once the remote command exits, so a failed extraction is
+    noticed while the upload is still running rather than after it.
+    """
+
+    def __init__(self, resp, pod_name: str):
+        self._resp = resp
+        self._pod_name = pod_name
+        self._stopped = threading.Event()
+        self.exited = threading.Event()
+        self.error: Exception | None = None
+        self._thread = threading.Thread(target=self._read, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        # Not joined: the reader wakes up within its poll interval, or at once
+        # when the session is closed
+        self._stopped.set()
+
+    def _read(self):
+        try:
+            status = ""
+            while not status and self._resp.is_open():
+                if self._stopped.is_set():
+                    return
+                status = self._resp.peek_channel(ERROR_CHANNEL, timeout=0.1)
+            self.error = self._failure(status)
+        except Exception as e:
+            self.error = e
+        self.exited.set()
+
+    def _failure(self, status: str) -> Exception | None:
+        if not status:
+            return ConnectionError(f"Exec stream to {self._pod_name} closed early")
+        if (yaml.safe_load(status) or {}).get("status") == "Success":
+            return None
+        stderr = self._resp.read_stderr(timeout=0).strip()
+        return RuntimeError(f"Upload to {self._pod_name} failed: {stderr}")
+
+    def check(self) -> bool:
+        """Raise if the remote command failed, return whether it has exited."""
+        if self.error:
+            raise self.error
+        return self.exited.is_set()
+
+
+def probe_remote_codecs(
+    kube_conn: client.CoreV1Api,
+    namespace: str,
+    pod_name: str,
+    container: str,
+) -> set[str]:
+    tools = " ".join(
+        codec.remote_tool for codec in CODECS.values() if codec.remote_tool
+    )
+    resp = stream(
+        kube_conn.connect_get_namespaced_pod_exec,
+        pod_name,
+        namespace,
+        container=container,
+        command=[
+            "sh",
+            "-c",
+            f"for t in {tools}; do command -v $t >/dev/null && echo $t; done",
+        ],
+        stderr=True,
+        stdin=False,
+        stdout=True,
+        tty=False,
+    )
+    found = set(str(resp).split())
+    return {"none"} | {name for name, c in CODECS.items() if c.remote_tool in found}
+
+
+def probe_gnu_tar(
+    kube_conn: client.CoreV1Api,
+    namespace: str,
+    pod_name: str,
+    container: str,
+) -> bool:
+    """Whether tar in the container is GNU tar, which restores sparse members."""
+    resp = stream(
+        kube_conn.connect_get_namespaced_pod_exec,
+        pod_name,
+        namespace,
+        container=container,
+        command=["sh", "-c", "tar --version 2>/dev/null | head -n 1"],
+        stderr=True,
+        stdin=False,
+        stdout=True,
+        tty=False,
+    )
+    return "GNU tar" in str(resp)
+
+
+def measure_link(
+    kube_conn: client.CoreV1Api,
+    namespace: str,
+    pod_name: str,
+    container: str,
+    log: logging.Logger,
+    size: int = PROBE_SIZE,
+) -> float:
+    """Estimate upload throughput in bytes per second by sending random data."""
+    resp = stream(
+        kube_conn.connect_get_namespaced_pod_exec,
+        pod_name,
+        namespace,
+        container=container,
+        command=["sh", "-c", f"head -c {size} > /dev/null; echo done"],
+        stderr=True,
+        stdin=True,
+        stdout=True,
+        tty=False,
+        _preload_content=False,
+    )
+    payload = os.urandom(size)
+    start = time.monotonic()
+    try:
+        for offset in range(0, size, CHUNK_SIZE):
+            resp.write_stdin(payload[offset : offset + CHUNK_SIZE])
+        resp.readline_stdout(timeout=60)
+    finally:
+        resp.close()
+    throughput = size / max(time.monotonic() - start, 1e-6)
+    log.debug(f"Measured link throughput: {throughput / 1e6:.2f} MB/s")
+    return throughput
+
+
+@dataclass(frozen=True)
+class TransferStats:
+    raw_bytes: int
+    wire_bytes: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """Achieved wire throughput in bytes per second."""
+        return self.wire_bytes / self.seconds if self.seconds else 0.0
+
+
+def plan_shards(
+    source_path: Path, dest_path: Path, count: int, ignore: IgnoreRules | None = None
+) -> list[list[tuple[Path, str]]]:
+    """Split a directory tree into at most count groups of similar total size.
+
+    Files are assigned largest first to the lightest shard. Directory entries
+    all go into the first shard so empty directories and permissions survive.
+    Hardlinks to the same file share a shard, so its content is sent once.
+    """
+    dirs: list[tuple[Path, str]] = []
+    links: dict[Path | tuple[int, int], list[tuple[Path, str]]] = {}
+    sizes: dict[Path | tuple[int, int], int] = {}
+    for path, is_dir in walk(source_path, ignore or IgnoreRules()):
+        arcname = str(dest_path / path.relative_to(source_path))
+        if is_dir:
+            dirs.append((path, arcname))
+            continue
+        st = path.lstat()
+        key = (st.st_dev, st.st_ino) if st.st_nlink > 1 else path
+        links.setdefault(key, []).append((path, arcname))
+        sizes[key] = st.st_size
+
+    shards: list[list[tuple[Path, str]]] = [[] for _ in range(max(count, 1))]
+    shards[0].extend(dirs)
+    loads = [(0, i) for i in range(len(shards))]
+    for key in sorted(links, key=lambda k: sizes[k], reverse=True):
+        load, i = heapq.heappop(loads)
+        shards[i].extend(links[key])
+        heapq.heappush(loads, (load + sizes[key], i))
+    return [shard for shard in shards if shard]
+
+
+def tree_size(source_path: Path, ignore: IgnoreRules | None = None) -> tuple[int, int]:
+    """Number of files and bytes an upload of source_path would archive."""
+    if not source_path.is_dir():
+        return 1, source_path.lstat().st_size
+    files = size = 0
+    for path, is_dir in walk(source_path, ignore or IgnoreRules()):
+        if not is_dir:
+            files += 1
+            size += path.lstat().st_size
+    return files, size
+
+
+def produce_tar(
+    source_path: Path,
+    dest_path: Path,
+    fileobj: Writer,
+    pipe: ChunkPipe,
+    members: Iterable[tuple[Path, str]] | None = None,
+    ignore: IgnoreRules | None = None,
+    preamble: bytes = b"",
+    sparse: Callable[[], bool] | None = None,
+):
+    if members is None and source_path.is_dir() and not source_path.is_symlink():
+        members = (
+            (path, str(dest_path / path.relative_to(source_path)))
+            for path, _ in walk(source_path, ignore or IgnoreRules())
+        )
+    elif members is None:
+        members = [(source_path, str(dest_path))]
+    produce_stream(
+        lambda: write_tar(fileobj, members, sparse=sparse), fileobj, pipe, preamble
+    )
+
+
+def produce_archive(
+    add: Callable[[tarfile.TarFile], None],
+    fileobj: Writer,
+    pipe: ChunkPipe,
+    preamble: bytes = b"",
+):
+    """Stream the tar built by add into pipe, passing errors on to its reader."""
+
+    def write():
+        with tarfile.open(fileobj=fileobj, mode="w|") as tar:  # type: ignore
+            add(tar)
+
+    produce_stream(write, fileobj, pipe, preamble)
+
+
+def produce_stream(
+    write: Callable[[], object],
+    fileobj: Writer,
+    pipe: ChunkPipe,
+    preamble: bytes = b"",
+):
+    """Run write into fileobj, then close pipe or pass the error on to it.
+
+    A preamble is written to pipe uncompressed ahead of the archive.
+    """
+    try:
+        pipe.write(preamble)
+        write()
+        fileobj.close()  # Flush any compressed trailer
+        pipe.close()
+    except BrokenPipeError:
+        pass
+    except Exception as e:
+        pipe.fail(e)
+
+
+def finish_exec(resp, monitor: ExecMonitor, pod_name: str):
+    """Signal end of input and wait for the remote command to exit.
+
+    Only possible with the v5 protocol, which can close stdin alone. Older
+    servers end the session on close, after which the command still runs to
+    completion but its exit code is lost.
+    """
+    if resp.subprotocol != V5_CHANNEL_PROTOCOL:
+        return
+    resp.close_channel(STDIN_CHANNEL)
+    if not monitor.exited.wait(FINISH_TIMEOUT):
+        raise TimeoutError(f"Exec in {pod_name} did not finish after upload")
+    monitor.check()
+
+
+def cp_k8s(
+    kube_conn: client.CoreV1Api,
+    namespace: str,
+    pod_name: str,
+    container: str,
+    source_path: Path,
+    dest_path: Path,
+    log: logging.Logger,
+    codec: Codec = CODECS["none"],
+    members: list[tuple[Path, str]] | None = None,
+    then: str = "",
+    timings: Timings | None = None,
+    ignore: IgnoreRules | None = None,
+    archive: Callable[[tarfile.TarFile], None] | None = None,
+    deletions: list[str] | None = None,
+    sparse: Callable[[], bool] | None = None,
+) -> TransferStats:
+    """Upload source_path to dest_path, or only the given members of it.
+
+    Paths excluded by ignore are left out when no members are given. An
+    archive function replaces all of this, adding members itself. Absolute
+    paths in deletions are removed before extraction, in the same stream. A
+    then command is run in the same exec session once extraction succeeds.
+    Files with holes are sent as sparse members if sparse, called when the
+    first is found, returns True.
+    """
+    timings = timings or Timings()
+    log.info(f"Transferring {source_path} to {dest_path}")
+    pipe = ChunkPipe()
+    raw = CountingWriter(codec.writer(pipe))
+    preamble = b""
+    if deletions is not None:
+        preamble = "".join(f"{path}\n" for path in [*deletions, ""]).encode()
+    if archive:
+        producer = threading.Thread(
+            target=produce_archive, args=(archive, raw, pipe, preamble), daemon=True
+        )
+    else:
+        producer = threading.Thread(
+            target=produce_tar,
+            args=(source_path, dest_path, raw, pipe, members, ignore, preamble, sparse),
+            daemon=True,
+        )
+
+    before = DELETE_SCRIPT if deletions is not None else ""
+    exec_command = codec.remote_command(then, before)
+    with timings.span("upload.connect", pod=pod_name):
+        resp = stream(
+            kube_conn.connect_get_namespaced_pod_exec,
+            pod_name,
+            namespace,
+            container=container,
+            command=exec_command,
+            stderr=True,
+            stdin=True,
+            stdout=True,
+            tty=False,
+            _preload_content=False,
+        )
+
+    log.debug(f"Streaming {source_path} ({codec.name})")
+    monitor = ExecMonitor(resp, pod_name)
+    sizer = ChunkSizer(pipe.chunk_size)
+    producer.start()
+    monitor.start()
+    start = time.monotonic()
+    sent = 0
+    try:
+        with timings.span("upload.send", pod=pod_name, source=str(source_path)) as span:
+            for chunk in pipe:
+                if monitor.check():
+                    break  # Remote is done, what is left is archive padding
+                sending = time.monotonic()
+                resp.write_stdin(chunk)
+                pipe.chunk_size = sizer.record(len(chunk), time.monotonic() - sending)
+                sent += len(chunk)
+                log.info(
+                    f"Transferred {sent // (1024 * 1024)} MiB "
+                    f"at {sizer.throughput / 1e6:.1f} MB/s"
+                )
+            span.update(raw_bytes=raw.count, wire_bytes=sent)
+        if then:
+            with timings.span("upload.finish", pod=pod_name):
+                finish_exec(resp, monitor, pod_name)
+        monitor.check()
+    finally:
+        monitor.stop()
+        pipe.abort()
+        producer.join()
+        resp.close()
+
+    stats = TransferStats(raw.count, sent, time.monotonic() - start)
+    timings.count("bytes.raw", stats.raw_bytes)
+    timings.count("bytes.wire", stats.wire_bytes)
+    log.debug(
+        f"Sent {stats.wire_bytes} bytes on the wire for {stats.raw_bytes} raw bytes "
+        f"in {stats.seconds:.2f}s, last chunk size {sizer.size}"
+    )
+    log.info(f"Transfer done at {stats.throughput / 1e6:.1f} MB/s")
+    return stats
+
+
+class ExecReader:
+    """File-like reader of the stdout of an exec session.
+
+    The session must be opened with binary=True and without stderr, since
+    the client also buffers stdout in its read_all() capture, which is
+    drained on every read to keep memory bounded.
+    """
+
+    def __init__(self, resp, pod_name: str):
+        self._resp = resp
+        self._pod_name = pod_name
+        self._buffer = bytearray()
+        self.status = b""
+        self.count = 0
+
+    def _closed(self) -> bool:
+        return bool(self.status) or not self._resp.is_open()
+
+    def _fill(self):
+        self._resp.update(timeout=READ_TIMEOUT)
+        self.status = self._resp.read_channel(ERROR_CHANNEL)
+        data = self._resp.read_all()
+        self._buffer += data
+        self.count += len(data)
+
+    def at_eof(self) -> bool:
+        while not self._buffer and not self._closed():
+            self._fill()
+        return not self._buffer
+
+    def readline(self) -> bytes:
+        while b"\n" not in self._buffer and not self._closed():
+            self._fill()
+        end = self._buffer.find(b"\n") + 1 or len(self._buffer)
+        line = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return line
+
+    def read(self, size: int = -1) -> bytes:
+        while (size < 0 or len(self._buffer) < size) and not self._closed():
+            self._fill()
+        if size < 0 or size > len(self._buffer):
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def finish(self):
+        """Drain the session and raise if the remote command failed."""
+        while self.read(CHUNK_SIZE):
+            pass
+        if not self.status:
+            raise ConnectionError(f"Exec stream to {self._pod_name} closed early")
+        status = yaml.safe_load(self.status) or {}
+        if status.get("status") != "Success":
+            message = status.get("message", "")
+            raise RuntimeError(f"Copy from {self._pod_name} failed: {message}")
+
+
+def archive_command(source_path: PurePosixPath, newer: str = "") -> list[str]:
+    """Remote command writing a tar of source_path to stdout.
+
+    Members are named from source_path.name down. With newer, only files
+    modified after the file of that name are archived, leaving out
+    directories so that unchanged files in them are not included.
+    """
+    parent, name = str(source_path.parent), source_path.name
+    if not newer:
+        return ["tar", "cf", "-", "-C", parent, name]
+    changed = shlex.quote(CHANGED_LIST)
+    return [
+        "sh",
+        "-c",
+        f"cd {shlex.quote(parent)} && "
+        f"find {shlex.quote(name)} ! -type d -newer {shlex.quote(newer)} > {changed}"
+        f" && if [ -s {changed} ]; then tar cf - -T {changed}; fi",
+    ]
+
+
+def unchanged(path: Path, member: tarfile.TarInfo) -> bool:
+    """Whether path already holds the file member with the same size and mtime."""
+    try:
+        st = path.lstat()
+    except FileNotFoundError:
+        return False
+    return (
+        stat.S_ISREG(st.st_mode)
+        and st.st_size == member.size
+        and int(st.st_mtime) == int(member.mtime)
+    )
+
+
+def extract_tar(fileobj, source_name: str, target: Path) -> tuple[int, int]:
+    """Extract a streamed tar made by archive_command as target.
+
+    Members are read one at a time, so memory use does not depend on the
+    size of the archive. Files identical in size and mtime to those already
+    at target are skipped, as are members the data filter refuses, such as
+    absolute symlinks, with a warning. Returns the number of files and bytes
+    written.
+    """
+    files = written = 0
+    filters = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    refused = getattr(tarfile, "FilterError", ())  # Without the filter, none
+
+    def rename(name: str) -> str:
+        parts = PurePosixPath(name).parts
+        if not parts or parts[0] != source_name or ".." in parts:
+            raise ValueError(f"Unexpected path in archive: {name}")
+        return str(PurePosixPath(target.name, *parts[1:]))
+
+    with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+        for member in tar:
+            member.name = rename(member.name)
+            if member.islnk():
+                member.linkname = rename(member.linkname)
+            if member.isfile() and unchanged(target.parent / member.name, member):
+                continue
+            try:
+                tar.extract(member, target.parent, **filters)  # type: ignore
+            except refused as e:
+                print(f"Warning: Not copying {member.name}: {e}", file=sys.stderr)
+                continue
+            if member.isfile():
+                files += 1
+                written += member.size
+    return files, written
+
+
+def cp_from_k8s(
+    kube_conn: client.CoreV1Api,
+    namespace: str,
+    pod_name: str,
+    container: str,
+    source_path: PurePosixPath,
+    dest_path: Path,
+    log: logging.Logger,
+    newer: str = "",
+    timings: Timings | None = None,
+) -> TransferStats:
+    """Download source_path from a running container to dest_path.
+
+    The tar is extracted while it arrives. With newer, only files modified
+    after that remote file are sent.
+    """
+    timings = timings or Timings()
+    log.info(f"Transferring {pod_name}:{source_path} to {dest_path}")
+    with timings.span("download.connect", pod=pod_name):
+        resp = stream(
+            kube_conn.connect_get_namespaced_pod_exec,
+            pod_name,
+            namespace,
+            container=container,
+            command=archive_command(source_path, newer),
+            stderr=False,
+            stdin=False,
+            stdout=True,
+            tty=False,
+            binary=True,
+            _preload_content=False,
+        )
+    reader = ExecReader(resp, pod_name)
+    start = time.monotonic()
+    try:
+        with timings.span("download.receive", pod=pod_name) as span:
+            files = written = 0
+            if not reader.at_eof():  # Nothing is sent when nothing changed
+                files, written = extract_tar(reader, source_path.name, dest_path)
+            reader.finish()
+            span.update(files=files, raw_bytes=written, wire_bytes=reader.count)
+    finally:
+        resp.close()
+
+    stats = TransferStats(written, reader.count, time.monotonic() - start)
+    timings.count("bytes.download", stats.wire_bytes)
+    log.info(
+        f"Received {files} changed files, {stats.raw_bytes} bytes, "
+        f"at {stats.throughput / 1e6:.1f} MB/s"
+    )
+    return stats
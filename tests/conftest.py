@@ -1,8 +1,13 @@
+import gc
+import json
 import os
 from pathlib import Path
 from typing import Any
 
 import pytest
+from kubernetes.config import kube_config
+
+from fake_cluster import FakeCluster
 
 # Prevent pytest from catching exceptions when debugging in vscode so that break on
 # exception works correctly (see: https://github.com/pytest-dev/pytest/issues/7409)
@@ -22,6 +27,37 @@ if os.getenv("PYTEST_RAISE", "0") == "1":
         raise excinfo.value
 
 
+# Timing assertions are flaky on shared machines, so benchmarks are opt in
+KODMAN_BENCHMARKING = os.getenv("KODMAN_BENCHMARKING") == "true"
+BENCHMARK_REPORT = os.getenv("KODMAN_BENCHMARK_REPORT", "")
+BENCHMARK_RESULTS: dict[str, dict[str, float]] = {}
+
+
+def pytest_collection_modifyitems(items: list[pytest.Item]):
+    if KODMAN_BENCHMARKING:
+        return
+    skip = pytest.mark.skip(reason="export KODMAN_BENCHMARKING=true")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+def pytest_sessionfinish():
+    if BENCHMARK_REPORT and BENCHMARK_RESULTS:
+        report = json.dumps(BENCHMARK_RESULTS, indent=2)
+        Path(BENCHMARK_REPORT).write_text(report + "\n")
+
+
+@pytest.fixture
+def record():
+    """Record benchmark results, written as JSON to KODMAN_BENCHMARK_REPORT."""
+
+    def record(name: str, **values: float):
+        BENCHMARK_RESULTS[name] = {k: round(v, 4) for k, v in values.items()}
+
+    return record
+
+
 DATA_PATH = Path(__file__).parent / "data"
 
 
@@ -49,3 +85,22 @@ def env_vars(mocker):
             "KODMAN_TEST_INT": "99",
         },
     )
+
+
+@pytest.fixture
+def fake_cluster(tmp_path: Path, mocker):
+    clusters: list[FakeCluster] = []
+
+    def start(**kwargs) -> FakeCluster:
+        cluster = FakeCluster(**kwargs).start()
+        clusters.append(cluster)
+        kubeconfig = cluster.write_kubeconfig(tmp_path / "kubeconfig")
+        mocker.patch.object(
+            kube_config, "KUBE_CONFIG_DEFAULT_LOCATION", str(kubeconfig)
+        )
+        return cluster
+
+    yield start
+    for cluster in clusters:
+        cluster.stop()
+    gc.collect()  # Rather than in a later test, where warnings are errors
@@ -1,17 +1,30 @@
-help_screen = """usage: kodman [-h] [-v] {run,version} ...
+help_screen = """usage: kodman [-h] [-v] [--timings]
+              {run,run-many,cp,sync,ps,prune,pool,daemon,version} ...
 
 positional arguments:
-  {run,version}
-    run          Run a command in a new container
-    version      Display the kodman version information
+  {run,run-many,cp,sync,ps,prune,pool,daemon,version}
+    run                 Run a command in a new container
+    run-many            Run the containers listed in a YAML or JSONL manifest
+    cp                  Copy files out of a running container to the local host
+    sync                Copy only the changes of a local directory into a container
+    ps                  List containers started by kodman
+    prune               Remove all finished containers started by kodman
+    pool                Keep pods parked and ready for 'kodman run --pool'
+    daemon              Serve kodman commands from a warm process over a socket
+    version             Display the kodman version information
 
 options:
-  -h, --help     show this help message and exit
-  -v, --version  show program's version number and exit
+  -h, --help            show this help message and exit
+  -v, --version         show program's version number and exit
+  --timings             Report phase timings as JSON on stderr, or in $KODMAN_TIMINGS
 
 environment variables:
   KODMAN_DEBUG  bool
-  KODMAN_SERVICE_ACCOUNT  str"""
+  KODMAN_SERVICE_ACCOUNT  str
+  KODMAN_DAEMON_SOCKET  str
+  KODMAN_TIMINGS  str
+  KODMAN_VOLUME_CACHE  str
+  KODMAN_INIT_IMAGE  str"""
 
 hello_world = """Hello from Docker!
 This message shows that your installation appears to be working correctly.
@@ -0,0 +1,680 @@
+"""A local stand-in for the parts of the Kubernetes API that kodman uses.
+
+Serves pod create/read/patch/delete/list/watch, events, logs and exec over
+HTTP and websockets, and accepts ConfigMaps and Secrets, which are deleted
+with the pod owning them, so Backend runs end to end without a cluster. Pods go
+through a simulated lifecycle whose delays, and the bandwidth of exec
+uploads, can be configured to benchmark kodman against a slow cluster.
+"""
+
+import base64
+import copy
+import hashlib
+import json
+import re
+import struct
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qs, urlparse
+
+import yaml
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+V4_PROTOCOL = "v4.channel.k8s.io"
+V5_PROTOCOL = "v5.channel.k8s.io"
+STDIN, STDOUT, STDERR, ERROR, CLOSE = 0, 1, 2, 3, 255
+OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x2, 0x8, 0x9, 0xA
+LOG_CHUNK = 64 * 1024
+
+Program = Callable[[dict[str, Any]], tuple[bytes, int]]
+
+
+def echo_program(pod: dict[str, Any]) -> tuple[bytes, int]:
+    """Default container behaviour: 'echo ...' prints, anything else is silent."""
+    container = pod["spec"]["containers"][0]
+    argv = (container.get("command") or []) + (container.get("args") or [])
+    if argv[:1] == ["echo"]:
+        return (" ".join(argv[1:]) + "\n").encode(), 0
+    return b"", 0
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def lookup(obj: dict[str, Any], path: str) -> str:
+    for key in path.split("."):
+        obj = obj.get(key) or {}
+    return obj if isinstance(obj, str) else ""
+
+
+def matches(obj: dict[str, Any], labels: str, fields: str) -> bool:
+    """Match equality based label and field selectors."""
+    obj_labels = obj["metadata"].get("labels") or {}
+    for term in filter(None, labels.split(",")):
+        key, op, value = re.match(r"([^!=]+)(!=|==|=)?(.*)", term).groups()  # type: ignore
+        if op is None:
+            if key.startswith("!") == (key.lstrip("!") in obj_labels):
+                return False
+        elif (obj_labels.get(key) == value) == (op == "!="):
+            return False
+    for term in filter(None, fields.split(",")):
+        key, op, value = re.match(r"([^!=]+)(!=|==|=)(.*)", term).groups()  # type: ignore
+        if (lookup(obj, key) == value) == (op == "!="):
+            return False
+    return True
+
+
+class FakeCluster:
+    """Serve a fake Kubernetes API on localhost.
+
+    schedule_delay is the time from creating a pod until its init container
+    runs, pull_delay the time from the trigger until the main container runs.
+    exec_bandwidth limits exec stdin in bytes per second (0 is unlimited).
+    program decides the output and exit code of each pod's container, which
+    is restarted after restart_delay as the pod's restartPolicy says (Always
+    by default, as in Kubernetes). starts counts the runs of each pod.
+    """
+
+    def __init__(
+        self,
+        schedule_delay: float = 0.0,
+        pull_delay: float = 0.0,
+        run_time: float = 0.0,
+        exec_bandwidth: float = 0.0,
+        program: Program = echo_program,
+        remote_tools: tuple[str, ...] = ("gzip", "xz"),
+        restart_delay: float = 0.05,
+    ):
+        self.schedule_delay = schedule_delay
+        self.pull_delay = pull_delay
+        self.run_time = run_time
+        self.exec_bandwidth = exec_bandwidth
+        self.program = program
+        self.remote_tools = remote_tools
+        self.restart_delay = restart_delay
+        self.pods: dict[tuple[str, str], dict[str, Any]] = {}
+        self.events: list[dict[str, Any]] = []
+        self.objects: dict[tuple[str, str, str], dict[str, Any]] = {}
+        self.uploaded: dict[str, int] = {}  # Exec stdin bytes received per pod
+        self.requests: list[str] = []
+        self.starts: dict[str, int] = {}
+        self._outputs: dict[str, tuple[bytes, int]] = {}
+        self._uploads: dict[str, int] = {}
+        self._history: list[tuple[int, str, str, dict[str, Any]]] = []
+        self._version = 0
+        self._changed = threading.Condition()
+        self._stopped = False
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeCluster":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        with self._changed:
+            self._stopped = True
+            self._changed.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeCluster":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def write_kubeconfig(self, path: Path, namespace: str = "default") -> Path:
+        kubeconfig = {
+            "apiVersion": "v1",
+            "kind": "Config",
+            "clusters": [{"name": "fake", "cluster": {"server": self.url}}],
+            "users": [{"name": "fake", "user": {"token": "fake"}}],
+            "contexts": [
+                {
+                    "name": "fake",
+                    "context": {
+                        "cluster": "fake",
+                        "user": "fake",
+                        "namespace": namespace,
+                    },
+                }
+            ],
+            "current-context": "fake",
+        }
+        path.write_text(yaml.safe_dump(kubeconfig))
+        return path
+
+    def add_pod(self, name: str, namespace: str = "default") -> dict[str, Any]:
+        """Create a bare pod to exec into, bypassing the API."""
+        container = {"name": "kodman-exec", "image": "busybox"}
+        spec = {"containers": [container], "restartPolicy": "Never"}
+        with self._changed:
+            return self.create_pod(
+                namespace, {"metadata": {"name": name}, "spec": spec}
+            )
+
+    # State changes, all made while holding self._changed
+
+    def _record(self, resource: str, kind: str, obj: dict[str, Any]):
+        self._version += 1
+        obj["metadata"]["resourceVersion"] = str(self._version)
+        self._history.append((self._version, resource, kind, copy.deepcopy(obj)))
+        self._changed.notify_all()
+
+    def _later(self, delay: float, func: Callable, *args):
+        timer = threading.Timer(delay, self._locked, (func, *args))
+        timer.daemon = True
+        timer.start()
+
+    def _locked(self, func: Callable, *args):
+        with self._changed:
+            func(*args)
+
+    def _event(self, pod: dict[str, Any], reason: str, message: str):
+        event = {
+            "apiVersion": "v1",
+            "kind": "Event",
+            "metadata": {
+                "name": f"{pod['metadata']['name']}.{uuid.uuid4().hex[:12]}",
+                "namespace": pod["metadata"]["namespace"],
+                "uid": str(uuid.uuid4()),
+            },
+            "involvedObject": {
+                "kind": "Pod",
+                "name": pod["metadata"]["name"],
+                "namespace": pod["metadata"]["namespace"],
+            },
+            "reason": reason,
+            "message": message,
+            "type": "Normal",
+            "count": 1,
+        }
+        self.events.append(event)
+        self._record("events", "ADDED", event)
+
+    def create_pod(self, namespace: str, body: dict[str, Any]) -> dict[str, Any]:
+        name = body["metadata"]["name"]
+        if (namespace, name) in self.pods:
+            raise ApiError(409, "AlreadyExists", f'pods "{name}" already exists')
+        pod = copy.deepcopy(body)
+        pod["metadata"].update(
+            namespace=namespace, uid=str(uuid.uuid4()), creationTimestamp=now()
+        )
+        pod["status"] = {"phase": "Pending"}
+        self.pods[(namespace, name)] = pod
+        self._record("pods", "ADDED", pod)
+        self._later(self.schedule_delay, self._schedule, namespace, name)
+        return pod
+
+    def _schedule(self, namespace: str, name: str):
+        if not (pod := self.pods.get((namespace, name))):
+            return
+        self._event(pod, "Scheduled", f"Successfully assigned {namespace}/{name}")
+        if not pod["spec"].get("initContainers"):
+            return self._start(namespace, name)
+        init = pod["spec"]["initContainers"][0]
+        pod["status"]["initContainerStatuses"] = [
+            self._status(init, {"running": {"startedAt": now()}})
+        ]
+        pod["status"]["containerStatuses"] = [
+            self._status(
+                pod["spec"]["containers"][0],
+                {"waiting": {"reason": "PodInitializing"}},
+            )
+        ]
+        self._record("pods", "MODIFIED", pod)
+
+    def trigger(self, namespace: str, name: str):
+        if not (pod := self.pods.get((namespace, name))):
+            return
+        init_status = pod["status"]["initContainerStatuses"][0]
+        init_status["state"] = {
+            "terminated": {"exitCode": 0, "reason": "Completed", "finishedAt": now()}
+        }
+        self._record("pods", "MODIFIED", pod)
+        self._later(self.pull_delay, self._start, namespace, name)
+
+    def _start(self, namespace: str, name: str):
+        if not (pod := self.pods.get((namespace, name))):
+            return
+        self._event(pod, "Pulled", "Container image already present on machine")
+        self._outputs[name] = self.program(pod)
+        self.starts[name] = self.starts.get(name, 0) + 1
+        pod["status"]["phase"] = "Running"
+        status = self._status(
+            pod["spec"]["containers"][0],
+            {"running": {"startedAt": now()}},
+            started=True,
+        )
+        status["restartCount"] = self.starts[name] - 1
+        pod["status"]["containerStatuses"] = [status]
+        self._record("pods", "MODIFIED", pod)
+        self._later(self.run_time, self._finish, namespace, name)
+
+    def _finish(self, namespace: str, name: str):
+        if not (pod := self.pods.get((namespace, name))):
+            return
+        exit_code = self._outputs[name][1]
+        pod["status"]["containerStatuses"][0]["state"] = {
+            "terminated": {
+                "exitCode": exit_code,
+                "reason": "Error" if exit_code else "Completed",
+                "finishedAt": now(),
+            }
+        }
+        policy = pod["spec"].get("restartPolicy", "Always")
+        if policy == "Always" or (policy == "OnFailure" and exit_code):
+            self._record("pods", "MODIFIED", pod)  # Still Running
+            self._later(self.restart_delay, self._start, namespace, name)
+            return
+        pod["status"]["phase"] = "Failed" if exit_code else "Succeeded"
+        self._record("pods", "MODIFIED", pod)
+
+    def _status(self, container, state, started=False) -> dict[str, Any]:
+        return {
+            "name": container["name"],
+            "image": container["image"],
+            "imageID": "",
+            "ready": started,
+            "restartCount": 0,
+            "started": started,
+            "state": state,
+        }
+
+    def patch_pod(self, namespace: str, name: str, patch: dict[str, Any]):
+        pod = self.read_pod(namespace, name)
+        expected = patch.get("metadata", {}).pop("resourceVersion", None)
+        if expected and expected != pod["metadata"]["resourceVersion"]:
+            raise ApiError(409, "Conflict", "the object has been modified")
+
+        def merge(target: dict, source: dict):
+            for key, value in source.items():
+                if isinstance(value, dict) and isinstance(target.get(key), dict):
+                    merge(target[key], value)
+                elif value is None:
+                    target.pop(key, None)
+                else:
+                    target[key] = value
+
+        merge(pod, patch)
+        self._record("pods", "MODIFIED", pod)
+        return pod
+
+    def create_object(
+        self, resource: str, namespace: str, body: dict[str, Any]
+    ) -> dict[str, Any]:
+        key = (resource, namespace, body["metadata"]["name"])
+        if key in self.objects:
+            raise ApiError(409, "AlreadyExists", f"{resource} already exists")
+        obj = copy.deepcopy(body)
+        obj["metadata"].update(namespace=namespace, uid=str(uuid.uuid4()))
+        self.objects[key] = obj
+        return obj
+
+    def delete_pod(self, namespace: str, name: str) -> dict[str, Any]:
+        pod = self.read_pod(namespace, name)
+        del self.pods[(namespace, name)]
+        uid = pod["metadata"]["uid"]
+        for key, obj in list(self.objects.items()):  # Garbage collection
+            owners = obj["metadata"].get("ownerReferences") or []
+            if any(owner["uid"] == uid for owner in owners):
+                del self.objects[key]
+        self._record("pods", "DELETED", pod)
+        return pod
+
+    def read_pod(self, namespace: str, name: str) -> dict[str, Any]:
+        if not (pod := self.pods.get((namespace, name))):
+            raise ApiError(404, "NotFound", f'pods "{name}" not found')
+        return pod
+
+    def _objects(self, resource: str, namespace: str) -> list[dict[str, Any]]:
+        if resource == "pods":
+            return [p for (ns, _), p in self.pods.items() if ns == namespace]
+        return [e for e in self.events if e["metadata"]["namespace"] == namespace]
+
+    def _handler(self):
+        cluster = self
+
+        class Handler(RequestHandler):
+            pass
+
+        Handler.cluster = cluster
+        return Handler
+
+
+class ApiError(Exception):
+    def __init__(self, code: int, reason: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.reason = reason
+        self.message = message
+
+
+ROUTES = [
+    (re.compile(r"/api/v1/namespaces/([^/]+)/(pods|events)"), "collection"),
+    (re.compile(r"/api/v1/namespaces/([^/]+)/pods/([^/]+)"), "pod"),
+    (re.compile(r"/api/v1/namespaces/([^/]+)/pods/([^/]+)/log"), "log"),
+    (re.compile(r"/api/v1/namespaces/([^/]+)/pods/([^/]+)/exec"), "exec"),
+    (re.compile(r"/api/v1/namespaces/([^/]+)/(configmaps|secrets)"), "objects"),
+]
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    cluster: FakeCluster
+
+    def log_message(self, format, *args):
+        pass  # Keep test output clean
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.cluster.requests.append(f"{method} {url.path}")
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = json.loads(self.rfile.read(length)) if length else None
+        try:
+            for pattern, route in ROUTES:
+                if match := pattern.fullmatch(url.path):
+                    return getattr(self, f"_{route}")(method, *match.groups())
+            raise ApiError(404, "NotFound", f"{url.path} not found")
+        except ApiError as e:
+            self._json(
+                e.code,
+                {
+                    "kind": "Status",
+                    "apiVersion": "v1",
+                    "metadata": {},
+                    "status": "Failure",
+                    "message": e.message,
+                    "reason": e.reason,
+                    "code": e.code,
+                },
+            )
+
+    def _json(self, code: int, obj: dict[str, Any]):
+        data = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _collection(self, method: str, namespace: str, resource: str):
+        cluster = self.cluster
+        labels = self.query.get("labelSelector", "")
+        fields = self.query.get("fieldSelector", "")
+        if method == "POST" and resource == "pods":
+            with cluster._changed:
+                return self._json(201, cluster.create_pod(namespace, self.body or {}))
+        if self.query.get("watch") in ("true", "1"):
+            return self._watch(namespace, resource, labels, fields)
+        with cluster._changed:
+            items = [
+                copy.deepcopy(obj)
+                for obj in cluster._objects(resource, namespace)
+                if matches(obj, labels, fields)
+            ]
+            if method == "DELETE" and resource == "pods":
+                for pod in items:
+                    cluster.delete_pod(namespace, pod["metadata"]["name"])
+                return self._json(200, {"kind": "Status", "status": "Success"})
+            version = str(cluster._version)
+        start = int(self.query.get("continue") or 0)
+        limit = int(self.query.get("limit") or 0) or len(items)
+        metadata = {"resourceVersion": version}
+        if start + limit < len(items):
+            metadata["continue"] = str(start + limit)
+        self._json(
+            200,
+            {
+                "kind": "PodList" if resource == "pods" else "EventList",
+                "apiVersion": "v1",
+                "metadata": metadata,
+                "items": items[start : start + limit],
+            },
+        )
+
+    def _objects(self, method: str, namespace: str, resource: str):
+        if method != "POST":
+            raise ApiError(405, "MethodNotAllowed", f"{method} {resource}")
+        with self.cluster._changed:
+            obj = self.cluster.create_object(resource, namespace, self.body or {})
+        self._json(201, obj)
+
+    def _watch(self, namespace: str, resource: str, labels: str, fields: str):
+        cluster = self.cluster
+        timeout = float(self.query.get("timeoutSeconds") or 0)
+        deadline = time.monotonic() + timeout if timeout else None
+        self._start_chunked("application/json")
+        with cluster._changed:
+            if version := self.query.get("resourceVersion"):
+                position = next(
+                    (
+                        i
+                        for i, entry in enumerate(cluster._history)
+                        if entry[0] > int(version)
+                    ),
+                    len(cluster._history),
+                )
+                pending = []
+            else:
+                position = len(cluster._history)
+                pending = [
+                    ("ADDED", copy.deepcopy(obj))
+                    for obj in cluster._objects(resource, namespace)
+                ]
+        try:
+            while True:
+                for kind, obj in pending:
+                    if obj["metadata"].get("namespace") == namespace and matches(
+                        obj, labels, fields
+                    ):
+                        line = json.dumps({"type": kind, "object": obj}) + "\n"
+                        self._chunk(line.encode())
+                with cluster._changed:
+                    while len(cluster._history) == position and not cluster._stopped:
+                        remaining = deadline - time.monotonic() if deadline else None
+                        if remaining is not None and remaining <= 0:
+                            break
+                        cluster._changed.wait(remaining)
+                    if cluster._stopped or len(cluster._history) == position:
+                        break
+                    pending = [
+                        (kind, obj)
+                        for _, res, kind, obj in cluster._history[position:]
+                        if res == resource
+                    ]
+                    position = len(cluster._history)
+            self._chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _pod(self, method: str, namespace: str, name: str):
+        with self.cluster._changed:
+            if method == "DELETE":
+                pod = self.cluster.delete_pod(namespace, name)
+            elif method == "PATCH":
+                pod = self.cluster.patch_pod(namespace, name, self.body or {})
+            else:
+                pod = self.cluster.read_pod(namespace, name)
+            self._json(200, pod)
+
+    def _log(self, method: str, namespace: str, name: str):
+        cluster = self.cluster
+        follow = self.query.get("follow") in ("true", "1")
+        with cluster._changed:
+            pod = cluster.read_pod(namespace, name)
+            containers = [c["name"] for c in pod["spec"]["containers"]]
+            if len(containers) > 1 and self.query.get("container") not in containers:
+                raise ApiError(
+                    400,
+                    "BadRequest",
+                    f"a container name must be specified for pod {name}, "
+                    f"choose one of: {containers}",
+                )
+            while name not in cluster._outputs and not cluster._stopped:
+                cluster._changed.wait()
+            output = cluster._outputs.get(name, (b"", 0))[0]
+        self._start_chunked("text/plain")
+        for offset in range(0, len(output), LOG_CHUNK):
+            self._chunk(output[offset : offset + LOG_CHUNK])
+        with cluster._changed:
+            while follow and not cluster._stopped:
+                pod = cluster.pods.get((namespace, name))
+                if (
+                    not pod
+                    or "terminated" in pod["status"]["containerStatuses"][0]["state"]
+                ):
+                    break  # The container exited, it may be restarted later
+                cluster._changed.wait()
+        self._chunk(b"")
+
+    # Exec sessions, served over a websocket speaking the channel protocol
+
+    def _exec(self, method: str, namespace: str, name: str):
+        cluster = self.cluster
+        command = parse_qs(urlparse(self.path).query).get("command", [])
+        with cluster._changed:
+            cluster.read_pod(namespace, name)
+        offered = [
+            p.strip() for p in self.headers.get("Sec-WebSocket-Protocol", "").split(",")
+        ]
+        self.protocol = V5_PROTOCOL if V5_PROTOCOL in offered else V4_PROTOCOL
+        key = self.headers["Sec-WebSocket-Key"] + WS_GUID
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        accept = base64.b64encode(hashlib.sha1(key.encode()).digest()).decode()
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.send_header("Sec-WebSocket-Protocol", self.protocol)
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        script = " ".join(command)
+        stdin = self.query.get("stdin") in ("true", "1")
+        try:
+            if "command -v" in script:
+                tools = [t for t in cluster.remote_tools if t in script]
+                self._send(STDOUT, "".join(f"{t}\n" for t in tools).encode())
+            elif stdin:
+                size = re.search(r"head -c (\d+)", script)
+                received = self._read_stdin(name, int(size.group(1)) if size else -1)
+                if received is None:  # v4 clients end stdin by hanging up
+                    return self._run_then(namespace, name, script)
+                if size:
+                    self._send(STDOUT, b"done\n")
+            self._run_then(namespace, name, script)
+            self._send(
+                ERROR, json.dumps({"metadata": {}, "status": "Success"}).encode()
+            )
+            self._send_frame(OP_CLOSE, struct.pack("!H", 1000))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _run_then(self, namespace: str, name: str, script: str):
+        """Emulate the trigger, including after_uploads counting sessions."""
+        if "/tmp/trigger" not in script:
+            return
+        cluster = self.cluster
+        with cluster._changed:
+            if count := re.search(r"-ge (\d+)", script):
+                cluster._uploads[name] = cluster._uploads.get(name, 0) + 1
+                if cluster._uploads[name] != int(count.group(1)):
+                    return
+            cluster.trigger(namespace, name)
+
+    def _read_stdin(self, name: str, size: int) -> int | None:
+        """Read stdin until EOF, or size bytes, at most at the exec bandwidth."""
+        cluster = self.cluster
+        start = time.monotonic()
+        received = 0
+        while size < 0 or received < size:
+            frame = self._read_frame()
+            if frame is None or frame[0] == OP_CLOSE:
+                self._finish_stdin(name, received)
+                return None
+            opcode, data = frame
+            if opcode == OP_PING:
+                self._send_frame(OP_PONG, data)
+                continue
+            if data[:2] == bytes([CLOSE, STDIN]):
+                break
+            if data[:1] == bytes([STDIN]):
+                received += len(data) - 1
+                if cluster.exec_bandwidth:
+                    delay = start + received / cluster.exec_bandwidth - time.monotonic()
+                    time.sleep(max(delay, 0))
+        self._finish_stdin(name, received)
+        return received
+
+    def _finish_stdin(self, name: str, received: int):
+        with self.cluster._changed:
+            uploaded = self.cluster.uploaded
+            uploaded[name] = uploaded.get(name, 0) + received
+
+    def _read_frame(self) -> tuple[int, bytes] | None:
+        head = self.rfile.read(2)
+        if len(head) < 2:
+            return None
+        opcode = head[0] & 0x0F
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if head[1] & 0x80 else b""
+        data = self.rfile.read(length)
+        if mask:
+            key = int.from_bytes((mask * (length // 4 + 1))[:length], "big")
+            data = (int.from_bytes(data, "big") ^ key).to_bytes(length, "big")
+        return opcode, data
+
+    def _send(self, channel: int, data: bytes):
+        self._send_frame(OP_BINARY, bytes([channel]) + data)
+
+    def _send_frame(self, opcode: int, payload: bytes):
+        length = len(payload)
+        if length < 126:
+            head = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            head = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            head = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        self.wfile.write(head + payload)
+        self.wfile.flush()
@@ -0,0 +1,919 @@
+import asyncio
+import io
+import logging
+import os
+import subprocess
+import threading
+import time
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from pathlib import Path, PurePosixPath
+from unittest.mock import MagicMock
+
+import pytest
+from kubernetes import client, watch
+from kubernetes.client.exceptions import ApiException
+from urllib3.exceptions import ProtocolError
+
+from kodman.backend import (
+    PROJECTION_LIMIT,
+    UPLOADED_STAMP,
+    AsyncBackend,
+    Backend,
+    DeleteOptions,
+    PodFailure,
+    PodInformer,
+    PodState,
+    PodWatcher,
+    PoolOptions,
+    PruneOptions,
+    PsOptions,
+    RunOptions,
+    RunResult,
+    Volume,
+    after_uploads,
+    classify_event,
+    get_exit_code,
+    get_pod_state,
+    label_value,
+    mark_uploaded,
+    pool_entrypoint,
+    send_trigger,
+    stream_logs,
+    wait_for_trigger,
+)
+from kodman.cache import CacheLookup
+from kodman.transfer import TransferStats, archive_command, extract_tar
+
+LOG = logging.getLogger("test")
+
+
+def make_pod(
+    phase="Pending",
+    init_state=None,
+    container_state=None,
+    resource_version="1",
+    name="pod",
+    created: datetime | None = None,
+) -> client.V1Pod:
+    init_statuses = None
+    if init_state:
+        init_statuses = [
+            client.V1ContainerStatus(
+                name="wait-for-signal",
+                image="busybox",
+                image_id="",
+                ready=False,
+                restart_count=0,
+                state=client.V1ContainerState(**init_state),
+            )
+        ]
+    container_statuses = None
+    if container_state:
+        container_statuses = [
+            client.V1ContainerStatus(
+                name="kodman-exec",
+                image="ubuntu",
+                image_id="",
+                ready=False,
+                restart_count=0,
+                state=client.V1ContainerState(**container_state),
+            )
+        ]
+    return client.V1Pod(
+        metadata=client.V1ObjectMeta(
+            name=name, resource_version=resource_version, creation_timestamp=created
+        ),
+        status=client.V1PodStatus(
+            phase=phase,
+            init_container_statuses=init_statuses,
+            container_statuses=container_statuses,
+        ),
+    )
+
+
+RUNNING = {"running": client.V1ContainerStateRunning()}
+TERMINATED = {"terminated": client.V1ContainerStateTerminated(exit_code=3)}
+
+
+@pytest.mark.parametrize(
+    "pod, state",
+    [
+        (make_pod(), PodState.PENDING),
+        (make_pod(init_state=RUNNING), PodState.INIT_RUNNING),
+        (make_pod(init_state=TERMINATED), PodState.TRIGGERED),
+        (make_pod("Running", TERMINATED, RUNNING), PodState.RUNNING),
+        (make_pod("Running", TERMINATED, TERMINATED), PodState.TERMINATED),
+        (make_pod("Failed"), PodState.TERMINATED),
+    ],
+)
+def test_get_pod_state(pod, state):
+    assert get_pod_state(pod) == state
+
+
+def test_get_exit_code():
+    assert get_exit_code(make_pod("Failed", TERMINATED, TERMINATED)) == 3
+    assert get_exit_code(make_pod("Succeeded")) == 0
+
+    pod = make_pod("Running", TERMINATED, TERMINATED)
+    sidecar = client.V1ContainerStatus(
+        name="kodman-copy-back",
+        image="busybox",
+        image_id="",
+        ready=True,
+        restart_count=0,
+        state=client.V1ContainerState(
+            terminated=client.V1ContainerStateTerminated(exit_code=0)
+        ),
+    )
+    pod.status.container_statuses.insert(0, sidecar)  # type: ignore
+    assert get_exit_code(pod) == 3
+
+
+def make_event(reason, message, uid="1", type="Warning") -> client.CoreV1Event:
+    return client.CoreV1Event(
+        metadata=client.V1ObjectMeta(uid=uid, resource_version=uid),
+        involved_object=client.V1ObjectReference(name="pod"),
+        reason=reason,
+        message=message,
+        type=type,
+    )
+
+
+def fake_watch(mocker, pods=(), events=(), error=None):
+    """Patch watch streams to replay pods and events, then block."""
+
+    def stream(func, **kwargs):
+        is_pod = func is kube_conn.list_namespaced_pod
+        calls["pod" if is_pod else "event"].append(kwargs.get("resource_version"))
+        for obj in pods if is_pod else events:
+            yield {"type": "MODIFIED", "object": obj}
+            if error and is_pod and len(calls["pod"]) == 1:
+                raise error
+        threading.Event().wait()
+
+    kube_conn = mocker.MagicMock()
+    kube_conn.read_namespaced_pod.return_value = make_pod(resource_version="0")
+    kube_conn.list_namespaced_event.return_value = client.CoreV1EventList(items=[])
+    calls = {"pod": [], "event": []}
+    mocker.patch("kubernetes.watch.Watch.stream", side_effect=stream)
+    return kube_conn, calls
+
+
+async def collect(updates) -> list:
+    return [update async for update in updates]
+
+
+def test_pod_watcher_transitions(mocker):
+    pods = [
+        make_pod(resource_version="1"),
+        make_pod(init_state=RUNNING, resource_version="2"),
+        make_pod(init_state=TERMINATED, resource_version="3"),
+        make_pod("Running", TERMINATED, RUNNING, resource_version="4"),
+        make_pod("Succeeded", TERMINATED, TERMINATED, resource_version="5"),
+    ]
+    kube_conn, _ = fake_watch(mocker, pods=pods)
+
+    async def follow():
+        informer = PodInformer(kube_conn, "default", LOG)
+        watcher = PodWatcher(informer, kube_conn, "default", "pod", LOG)
+        await watcher.start()
+        assert await collect(watcher.until(PodState.INIT_RUNNING))
+        assert watcher.state == PodState.INIT_RUNNING
+        await collect(watcher.until(PodState.RUNNING))
+        assert watcher.state == PodState.RUNNING
+        assert await collect(watcher.until(PodState.TERMINATED)) == []
+        assert get_exit_code(watcher.pod) == 3  # type: ignore
+        watcher.stop()
+
+    asyncio.run(follow())
+
+
+@pytest.mark.parametrize(
+    "error, resumed_from",
+    [
+        (ProtocolError("Connection broken"), "7"),
+        (ApiException(status=410), None),  # Expired version is not reused
+    ],
+)
+def test_pod_informer_resumes(mocker, error, resumed_from):
+    pods = [
+        make_pod(resource_version="7"),
+        make_pod(init_state=RUNNING, resource_version="8"),
+    ]
+    kube_conn, calls = fake_watch(mocker, pods=pods, error=error)
+
+    async def follow():
+        informer = PodInformer(kube_conn, "default", LOG)
+        watcher = PodWatcher(informer, kube_conn, "default", "pod", LOG)
+        await collect(watcher.until(PodState.INIT_RUNNING))
+        watcher.stop()
+
+    asyncio.run(follow())
+    assert calls["pod"] == [None, resumed_from]
+
+
+@pytest.mark.parametrize(
+    "reason, message, classified, fatal",
+    [
+        ("Failed", 'Failed to pull image "hello-worl": not found', "ErrImagePull", 1),
+        ("Failed", "Failed to pull image: i/o timeout", "ErrImagePull", 0),
+        ("BackOff", 'Back-off pulling image "ubuntu"', "ImagePullBackOff", 0),
+        (
+            "Failed",
+            "Error: CreateContainerConfigError",
+            "CreateContainerConfigError",
+            1,
+        ),
+        ("Failed", 'exec: "bash": executable file not found', "Failed", 1),
+        ("FailedScheduling", "0/3 nodes are available", "FailedScheduling", 0),
+        ("FailedMount", "MountVolume.SetUp failed", "FailedMount", 0),
+    ],
+)
+def test_classify_event(reason, message, classified, fatal):
+    assert classify_event(make_event(reason, message)) == (classified, bool(fatal))
+
+
+def test_pod_watcher_reports_events(mocker, capsys):
+    events = [
+        make_event("FailedScheduling", "0/3 nodes are available", uid="1"),
+        make_event("FailedScheduling", "0/3 nodes are available", uid="1"),
+        make_event("Pulling", "Pulling image", uid="2", type="Normal"),
+        make_event("Failed", 'Failed to pull image "x": not found', uid="3"),
+    ]
+    kube_conn, _ = fake_watch(mocker, pods=[make_pod()], events=events)
+
+    async def follow():
+        informer = PodInformer(kube_conn, "default", LOG)
+        watcher = PodWatcher(informer, kube_conn, "default", "pod", LOG)
+        try:
+            await collect(watcher.until(PodState.RUNNING))
+        finally:
+            watcher.stop()
+
+    with pytest.raises(PodFailure) as failure:
+        asyncio.run(follow())
+    assert failure.value.reason == "ErrImagePull"
+    assert capsys.readouterr().err == "Warning: 0/3 nodes are available\n"
+
+
+def test_async_backend_runs_pods_concurrently(mocker):
+    succeeded = {"terminated": client.V1ContainerStateTerminated(exit_code=0)}
+    finished = {
+        "a": make_pod("Succeeded", TERMINATED, succeeded),
+        "b": make_pod("Failed", TERMINATED, TERMINATED),
+    }
+    kube_conn, calls = fake_watch(mocker)
+    kube_conn.read_namespaced_pod.side_effect = lambda name, **_: finished[name]
+    mocker.patch("kodman.backend.client.ApiClient")
+    mocker.patch("kodman.backend.stream")
+    logs = mocker.patch("kodman.backend.stream_logs", return_value=0)
+    backend = AsyncBackend(LOG)
+    backend._context = {"namespace": "default"}
+    backend._client = kube_conn
+    mocker.patch.object(backend, "_create_pod", side_effect=["a", "b"])
+
+    async def run_both():
+        return await asyncio.gather(
+            backend.run(RunOptions(image="ubuntu")),
+            backend.run(RunOptions(image="ubuntu")),
+        )
+
+    results = asyncio.run(run_both())
+
+    assert results == [RunResult("a", 0), RunResult("b", 3)]
+    assert logs.call_count == 2
+    assert len(calls["pod"]) == 1  # One shared watch for both pods
+    phases = [(s["name"], s.get("pod")) for s in backend.timings.report()["spans"]]
+    for pod in ("a", "b"):
+        # Nothing to upload, so the pods start without the init handshake
+        assert [name for name, p in phases if p == pod] == [
+            "run.start",
+            "run.logs",
+            "run.exit",
+        ]
+
+
+@pytest.mark.filterwarnings("ignore::ResourceWarning")  # Closed by the GC
+def test_backend_watches_only_its_pod(fake_cluster, mocker):
+    fake_cluster()
+    backend = Backend(LOG)
+    backend.connect()
+    streamed = mocker.spy(watch.Watch, "stream")
+
+    pod_name = backend.run(RunOptions(image="ubuntu", args=["true"]), io.BytesIO())
+
+    selectors = [call.kwargs["field_selector"] for call in streamed.call_args_list]
+    assert selectors == [
+        f"metadata.name={pod_name}",
+        f"involvedObject.kind=Pod,involvedObject.name={pod_name}",
+    ]
+
+
+def fake_log(mocker, chunks: list[bytes]):
+    resp = mocker.MagicMock()
+    resp.stream.side_effect = lambda *args, **kwargs: iter(chunks)
+    kube_conn = mocker.MagicMock()
+    kube_conn.read_namespaced_pod_log.return_value = resp
+    return kube_conn
+
+
+def test_stream_logs_is_byte_exact(mocker):
+    chunks = [b"Hello\n\n", b"wor", b"ld \xe2\x9c", b"\x93\n\n  \nno newline"]
+    out = io.BytesIO()
+
+    size = stream_logs(fake_log(mocker, chunks), "default", "pod", out)
+
+    assert out.getvalue() == b"".join(chunks)
+    assert size == len(out.getvalue())
+
+
+@pytest.mark.benchmark
+def test_stream_logs_throughput(mocker, record):
+    line = b"Compiling module with a reasonably long build log line\n"
+    chunk = line * (64 * 1024 // len(line))
+    chunks = [chunk] * 80  # ~5 MB
+    total_mb = len(chunk) * len(chunks) / 1e6
+
+    start = time.perf_counter()
+    stream_logs(fake_log(mocker, chunks), "default", "pod", io.BytesIO())
+    raw = total_mb / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    out = io.StringIO()
+    w = watch.Watch()
+    for e in w.stream(fake_log(mocker, chunks).read_namespaced_pod_log, follow=True):
+        out.write(f"{e}\n")
+    lines = total_mb / (time.perf_counter() - start)
+
+    record("stream_logs", raw_mb_per_s=raw, watch_lines_mb_per_s=lines)
+    assert raw > 2 * lines
+
+
+def test_fill_volumes_uploads_shards_concurrently(mocker, tmp_path: Path):
+    for i in range(4):
+        (tmp_path / f"{i}.bin").write_bytes(bytes(1024 * (i + 1)))
+    mocker.patch("kodman.backend.client.ApiClient")
+    cp = mocker.patch("kodman.backend.cp_k8s", return_value=TransferStats(0, 0, 0))
+    backend = Backend(LOG)
+    options = RunOptions(image="ubuntu", upload_shards=3)
+
+    volumes = [Volume(tmp_path, Path("/data"))]
+    backend._fill_volumes("default", "pod", "init", volumes, options)
+
+    assert cp.call_count == 3
+    uploaded = [arc for call in cp.call_args_list for _, arc in call.kwargs["members"]]
+    assert sorted(a for a in uploaded if a.endswith(".bin")) == [
+        f"/data/{i}.bin" for i in range(4)
+    ]
+
+
+@pytest.mark.parametrize("shards, then", [(1, "go"), (3, after_uploads(3, "go"))])
+def test_fill_volumes_runs_trigger(mocker, tmp_path: Path, shards, then):
+    for i in range(4):
+        (tmp_path / f"{i}.bin").write_bytes(bytes(1024))
+    mocker.patch("kodman.backend.client.ApiClient")
+    cp = mocker.patch("kodman.backend.cp_k8s", return_value=TransferStats(0, 0, 0))
+    backend = Backend(LOG)
+    options = RunOptions(image="ubuntu", upload_shards=shards)
+
+    volumes = [Volume(tmp_path, Path("/data"))]
+    assert backend._fill_volumes("default", "pod", "init", volumes, options, "go")
+    assert {call.kwargs["then"] for call in cp.call_args_list} == {then}
+    assert not backend._fill_volumes("default", "pod", "init", [], options, "go")
+
+
+def test_parse_volume_excludes(tmp_path: Path):
+    (tmp_path / ".kodmanignore").write_text(".git\n")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / "main.py").write_text("print()\n")
+    (tmp_path / "main.pyc").write_bytes(bytes(100))
+    backend = Backend(LOG)
+
+    options = RunOptions(
+        image="ubuntu", volumes=[f"{tmp_path}:/src:exclude=*.pyc,exclude=build"]
+    )
+    (volume,) = backend._parse_volumes(options)
+    assert volume.ignore.patterns == [".git", "*.pyc", "build"]
+    (size,) = backend.volume_sizes(options)
+    assert (size.files, size.bytes) == (2, 5 + 8)
+
+    with pytest.raises(ValueError, match="Unknown volume option 'z'"):
+        backend._parse_volumes(RunOptions(image="ubuntu", volumes=[f"{tmp_path}:/s:z"]))
+
+
+def test_parse_volumes_creates_rw_sources_last(mocker, tmp_path: Path):
+    backend, _ = make_backend(mocker)
+    out = tmp_path / "out"
+
+    options = RunOptions(image="ubuntu", volumes=[f"{out}:/out:rw,ro"])
+    with pytest.raises(ValueError, match="either ro or rw"):
+        backend._parse_volumes(options, create=True)
+    options = RunOptions(image="ubuntu", volumes=[f"{out}:/out:rw"])
+    (size,) = backend.volume_sizes(options)
+    assert (size.files, size.bytes) == (0, 0)
+    assert not out.exists()  # Not for a dry run
+
+    backend._parse_volumes(options, create=True)
+    assert out.is_dir()
+
+
+def test_create_pod_copy_back(mocker, tmp_path: Path):
+    backend, kube = make_backend(mocker)
+    options = RunOptions(
+        image="ubuntu", volumes=[f"{tmp_path}:/in", f"{tmp_path / 'out'}:/out:rw"]
+    )
+    volumes = backend._parse_volumes(options, create=True)
+    assert (tmp_path / "out").is_dir()
+
+    backend._create_pod(options, "wait-for-signal", volumes)
+
+    spec = kube.create_namespaced_pod.call_args.kwargs["body"]["spec"]
+    sidecar = spec["containers"][1]
+    assert sidecar["name"] == "kodman-copy-back"
+    assert [m["name"] for m in sidecar["volumeMounts"]] == [
+        "kodman-state",
+        "shared-data-1",
+    ]
+    init_mounts = spec["initContainers"][0]["volumeMounts"]
+    assert {"name": "kodman-state", "mountPath": str(UPLOADED_STAMP.parent)} in (
+        init_mounts
+    )
+
+
+def test_create_pod_volume_cache(mocker, tmp_path: Path):
+    backend, kube = make_backend(mocker)
+    options = RunOptions(
+        image="ubuntu", volumes=[f"{tmp_path}:/tc:cache"], volume_cache="claim"
+    )
+    volumes = backend._parse_volumes(options)
+
+    backend._create_pod(options, "wait-for-signal", volumes)
+
+    spec = kube.create_namespaced_pod.call_args.kwargs["body"]["spec"]
+    (mount,) = spec["containers"][0]["volumeMounts"]
+    assert (mount["name"], mount["mountPath"], mount["readOnly"]) == (
+        "kodman-cache",
+        "/tc",
+        True,
+    )
+    assert mount["subPath"].startswith("runs/")
+    assert {
+        "name": "kodman-cache",
+        "persistentVolumeClaim": {"claimName": "claim"},
+    } in (spec["volumes"])
+
+    with pytest.raises(ValueError, match="--volume-cache"):
+        backend._parse_volumes(RunOptions(image="u", volumes=[f"{tmp_path}:/t:cache"]))
+    with pytest.raises(ValueError, match="read-only"):
+        backend._parse_volumes(replace(options, volumes=[f"{tmp_path}:/t:cache,rw"]))
+
+
+def test_fill_volumes_cache_hit_uploads_nothing(mocker, tmp_path: Path):
+    backend, _ = make_backend(mocker)
+    mocker.patch.object(backend, "_exec_api")
+    lookup = mocker.patch(
+        "kodman.backend.lookup_blobs", return_value=CacheLookup(True, set())
+    )
+    cp = mocker.patch("kodman.backend.cp_k8s")
+    options = RunOptions(
+        image="ubuntu", volumes=[f"{tmp_path}:/tc:cache"], volume_cache="claim"
+    )
+    volumes = backend._parse_volumes(options)
+
+    triggered = backend._fill_volumes(
+        "default", "pod", "init", volumes, options, send_trigger()
+    )
+
+    assert lookup.call_args.args[5] == "runs/pod/0"  # Linked in place
+    assert not triggered  # Left to a separate trigger
+    cp.assert_not_called()
+
+
+def test_create_pod_shares_claims(mocker, tmp_path: Path):
+    backend, kube = make_backend(mocker)
+    backend._context["in_cluster"] = True
+    (tmp_path / "src").mkdir()
+    mountinfo = tmp_path / "mountinfo"
+    mountinfo.write_text(f"30 22 8:1 /pvc {tmp_path} rw - ext4 /dev/sda1 rw\n")
+    mocker.patch("kodman.backend.MOUNTINFO", mountinfo)
+    work = client.V1VolumeMount(name="work", mount_path=str(tmp_path))
+    claim = client.V1PersistentVolumeClaimVolumeSource(claim_name="work-claim")
+    kube.read_namespaced_pod.return_value = client.V1Pod(
+        spec=client.V1PodSpec(
+            node_name="node-a",
+            containers=[client.V1Container(name="runner", volume_mounts=[work])],
+            volumes=[client.V1Volume(name="work", persistent_volume_claim=claim)],
+        )
+    )
+    kube.read_namespaced_persistent_volume_claim.return_value = (
+        client.V1PersistentVolumeClaim(
+            spec=client.V1PersistentVolumeClaimSpec(access_modes=["ReadWriteOnce"])
+        )
+    )
+    options = RunOptions(image="ubuntu", volumes=[f"{tmp_path / 'src'}:/src:rw"])
+
+    volumes = backend._share_volumes(backend._parse_volumes(options))
+    backend._create_pod(options, "wait-for-signal", volumes)
+
+    assert not volumes[0].copy_back
+    spec = kube.create_namespaced_pod.call_args.kwargs["body"]["spec"]
+    assert spec["containers"][0]["volumeMounts"] == [
+        {
+            "name": "shared-claim-0",
+            "mountPath": "/src",
+            "readOnly": False,
+            "subPath": "src",
+        }
+    ]
+    assert len(spec["containers"]) == 1  # No copy-back sidecar
+    terms = spec["affinity"]["nodeAffinity"][
+        "requiredDuringSchedulingIgnoredDuringExecution"
+    ]["nodeSelectorTerms"]
+    assert terms[0]["matchFields"][0]["values"] == ["node-a"]
+    assert not backend._fill_volumes("default", "pod", "init", volumes, options, "go")
+
+    options = RunOptions(image="ubuntu", volumes=[f"{tmp_path / 'src'}:/src"])
+    (default,) = backend._share_volumes(backend._parse_volumes(options))
+    assert default.shared is None  # Stays a writable copy
+
+
+def test_create_pod_projects_small_volumes(mocker, tmp_path: Path):
+    backend, kube = make_backend(mocker)
+    (tmp_path / "conf").mkdir()
+    (tmp_path / "conf" / "app.ini").write_text("[app]\n")
+    (tmp_path / "token").write_text("secret\n")
+    (tmp_path / "big").write_bytes(bytes(PROJECTION_LIMIT))
+    options = RunOptions(
+        image="ubuntu",
+        volumes=[
+            f"{tmp_path / 'conf'}:/conf:ro",
+            f"{tmp_path / 'token'}:/run/token:secret",
+            f"{tmp_path / 'big'}:/data/big:ro",
+            f"{tmp_path / 'conf'}:/writable",
+        ],
+    )
+    pod = client.V1Pod(metadata=client.V1ObjectMeta(name="pod", uid="1234"))
+    kube.create_namespaced_pod.return_value = pod
+
+    volumes = backend._project_volumes(backend._parse_volumes(options))
+    backend._create_pod(options, "wait-for-signal", volumes)
+
+    assert [bool(v.projection) for v in volumes] == [True, True, False, False]
+    body = kube.create_namespaced_pod.call_args.kwargs["body"]
+    mounts = body["spec"]["containers"][0]["volumeMounts"]
+    assert mounts[:2] == [
+        {"name": "projected-0", "mountPath": "/conf", "readOnly": True},
+        {
+            "name": "projected-1",
+            "mountPath": "/run/token",
+            "readOnly": True,
+            "subPath": "token",
+        },
+    ]
+    config_map = kube.create_namespaced_config_map.call_args.kwargs["body"]
+    assert list(config_map["binaryData"]) == ["0-0"]
+    assert config_map["metadata"]["ownerReferences"][0]["uid"] == "1234"
+    secret = kube.create_namespaced_secret.call_args.kwargs["body"]
+    assert list(secret["data"]) == ["1-0"]
+
+
+def test_copy_back_only_changed_files(tmp_path: Path):
+    remote = tmp_path / "remote" / "0"
+    (remote / "sub").mkdir(parents=True)
+    (remote / "uploaded.txt").write_text("input\n")
+    os.utime(remote / "uploaded.txt", (1e9, 1e9))  # Preserved by upload
+    stamp = tmp_path / "uploaded"
+    subprocess.run(["sh", "-c", mark_uploaded(stamp)], check=True)
+    (remote / "sub" / "result.bin").write_bytes(bytes(range(256)))
+
+    archive = subprocess.run(
+        archive_command(PurePosixPath(remote), str(stamp)),
+        capture_output=True,
+        check=True,
+    ).stdout
+    target = tmp_path / "out"
+    assert extract_tar(io.BytesIO(archive), "0", target) == (1, 256)
+
+    assert (target / "sub" / "result.bin").read_bytes() == bytes(range(256))
+    assert not (target / "uploaded.txt").exists()
+
+
+def trigger_after_uploads(tmp_path: Path) -> float:
+    """Seconds from starting the last of 3 upload sessions to the init exit."""
+    fifo = str(tmp_path / "trigger")
+    uploads = str(tmp_path / "uploads")
+    init = subprocess.Popen(["sh", "-c", wait_for_trigger(fifo)])
+    while not Path(fifo).exists():
+        time.sleep(0.01)
+
+    start = time.monotonic()
+    sessions = [
+        subprocess.Popen(["sh", "-c", after_uploads(3, send_trigger(fifo), uploads)])
+        for _ in range(3)
+    ]
+    assert [s.wait(timeout=5) for s in sessions] == [0, 0, 0]
+    assert init.wait(timeout=5) == 0
+    return time.monotonic() - start
+
+
+def test_trigger_after_uploads(tmp_path: Path):
+    trigger_after_uploads(tmp_path)
+
+
+@pytest.mark.benchmark
+def test_trigger_latency(record, tmp_path: Path):
+    latency = trigger_after_uploads(tmp_path)
+    record("trigger_latency", seconds=latency)
+    assert latency < 0.5  # Polling once a second averaged 500 ms
+
+
+def test_trigger_before_fifo(tmp_path: Path):
+    path = str(tmp_path / "trigger")
+    subprocess.run(["sh", "-c", send_trigger(path)], check=True)
+    init = subprocess.run(["sh", "-c", wait_for_trigger(path)], timeout=5)
+    assert init.returncode == 0
+
+
+def test_pool_entrypoint():
+    script = pool_entrypoint(["bash", "-c", "echo 'hi there'"])
+    assert "cp -a /kodman/volumes/. /" in script
+    assert script.endswith("exec bash -c 'echo '\"'\"'hi there'\"'\"''\n")
+
+
+def make_backend(mocker) -> tuple[Backend, MagicMock]:
+    """A backend and the mock standing in for its kubernetes client."""
+    backend = Backend(LOG)
+    backend._context = {"namespace": "default"}
+    kube = mocker.MagicMock()
+    backend._client = kube
+    return backend, kube
+
+
+def test_claim_pool_pod_skips_conflicts(mocker):
+    backend, kube = make_backend(mocker)
+    pods = [
+        make_pod(init_state=RUNNING, resource_version="1", name="taken"),
+        make_pod(init_state=RUNNING, resource_version="2", name="free"),
+    ]
+    kube.list_namespaced_pod.return_value = client.V1PodList(items=pods)
+    kube.patch_namespaced_pod.side_effect = [ApiException(status=409), None]
+
+    options = RunOptions(image="ubuntu", command=["true"], pool=True)
+    assert backend._claim_pool_pod(options) == "free"
+    patch = kube.patch_namespaced_pod.call_args.kwargs
+    assert patch["body"]["metadata"]["resourceVersion"] == "2"
+    kube.create_namespaced_pod.assert_not_called()  # Refilled by kodman pool
+
+
+@pytest.mark.parametrize("args", [[], ["true"]])
+def test_claim_pool_pod_needs_entrypoint(mocker, args):
+    backend, kube = make_backend(mocker)
+    options = RunOptions(image="ubuntu", args=args, pool=True)
+    assert backend._claim_pool_pod(options) == ""
+    kube.list_namespaced_pod.assert_not_called()
+
+
+def test_reconcile_pool(mocker):
+    backend, kube = make_backend(mocker)
+    now = datetime.now(timezone.utc)
+    expired = make_pod(
+        init_state=RUNNING, name="expired", created=now - timedelta(seconds=120)
+    )
+    fresh = make_pod(init_state=RUNNING, created=now)
+    kube.list_namespaced_pod.return_value = client.V1PodList(items=[expired, fresh])
+
+    backend._reconcile_pool(PoolOptions(images=["ubuntu"], size=3, ttl=60))
+
+    kube.delete_namespaced_pod.assert_called_once()
+    assert kube.delete_namespaced_pod.call_args.kwargs["name"] == "expired"
+    assert kube.create_namespaced_pod.call_count == 2
+
+
+def test_delete_without_wait(mocker):
+    backend, kube = make_backend(mocker)
+
+    backend.delete(DeleteOptions("pod", wait=False))
+
+    kube.delete_namespaced_pod.assert_called_once()
+    kube.read_namespaced_pod.assert_not_called()
+
+
+def test_delete_waits_for_removal(mocker):
+    backend, kube = make_backend(mocker)
+    backend._polling_freq = 100
+    kube.read_namespaced_pod.side_effect = [
+        make_pod(),
+        ApiException(status=404),
+    ]
+
+    backend.delete(DeleteOptions("pod"))
+
+    assert kube.read_namespaced_pod.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "everything, label_selector, field_selector",
+    [
+        (
+            False,
+            "app.kubernetes.io/managed-by=kodman,kodman/pool-state!=idle",
+            "status.phase!=Pending,status.phase!=Running",
+        ),
+        (True, "app.kubernetes.io/managed-by=kodman", None),
+    ],
+)
+def test_prune(mocker, everything, label_selector, field_selector):
+    backend, kube = make_backend(mocker)
+    kube.list_namespaced_pod.return_value = client.V1PodList(items=[make_pod()])
+
+    assert backend.prune(PruneOptions(all=everything)) == ["pod"]
+
+    delete = kube.delete_collection_namespaced_pod.call_args.kwargs
+    assert delete["label_selector"] == label_selector
+    assert delete.get("field_selector") == field_selector
+
+
+@pytest.mark.filterwarnings("ignore::ResourceWarning")  # Closed by the GC
+def test_prune_finished_run(fake_cluster):
+    cluster = fake_cluster()
+    backend = Backend(LOG)
+    backend.connect()
+
+    pod_name = backend.run(RunOptions(image="ubuntu", args=["true"]), io.BytesIO())
+    time.sleep(3 * cluster.restart_delay)  # Would have restarted by now
+
+    assert cluster.starts[pod_name] == 1
+    assert backend.prune(PruneOptions()) == [pod_name]
+
+
+def test_prune_nothing(mocker):
+    backend, kube = make_backend(mocker)
+    kube.list_namespaced_pod.return_value = client.V1PodList(items=[])
+
+    assert backend.prune(PruneOptions()) == []
+    kube.delete_collection_namespaced_pod.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "text, value",
+    [
+        ("ubuntu", "ubuntu"),
+        ("docker.io/library/ubuntu:22.04", "docker.io_library_ubuntu_22.04"),
+        ("ghcr.io/org/img@sha256:" + "a" * 64, "ghcr.io_org_img_sha256_" + "a" * 40),
+        ("_user_", "user"),
+    ],
+)
+def test_label_value(text, value):
+    assert label_value(text) == value
+
+
+def test_pod_manifest_labels(mocker):
+    mocker.patch("kodman.backend.current_owner", return_value="alice")
+    manifest = Backend(LOG)._pod_manifest(
+        {"name": "pod"}, "ubuntu:22.04", "wait-for-signal", ""
+    )
+
+    labels = manifest["metadata"]["labels"]
+    assert labels["app.kubernetes.io/managed-by"] == "kodman"
+    assert labels["kodman/image"] == "ubuntu_22.04"
+    assert labels["kodman/owner"] == "alice"
+    assert labels["kodman/created"].isdigit()
+    assert manifest["metadata"]["annotations"]["kodman/image"] == "ubuntu:22.04"
+    assert manifest["spec"]["initContainers"][0]["image"] == "busybox"
+
+
+def test_create_pod_init_image(mocker):
+    backend, _ = make_backend(mocker)
+    create = mocker.patch.object(backend._client, "create_namespaced_pod")
+    options = RunOptions(image="ubuntu", init_image="debian:stable-slim")
+
+    backend._create_pod(options, "wait-for-signal", [])
+
+    body = create.call_args.kwargs["body"]
+    assert body["spec"]["initContainers"][0]["image"] == "debian:stable-slim"
+
+
+def test_ps_follows_pages(mocker):
+    backend, kube = make_backend(mocker)
+    pages = [
+        client.V1PodList(
+            items=[make_pod(), make_pod()],
+            metadata=client.V1ListMeta(_continue="next"),
+        ),
+        client.V1PodList(items=[make_pod()], metadata=client.V1ListMeta()),
+    ]
+    kube.list_namespaced_pod.side_effect = pages
+
+    pods = list(backend.ps(PsOptions(image="ubuntu", owner="alice", page_size=2)))
+
+    assert len(pods) == 3
+    calls = kube.list_namespaced_pod.call_args_list
+    assert [call.kwargs["_continue"] for call in calls] == [None, "next"]
+    assert calls[0].kwargs["limit"] == 2
+    assert calls[0].kwargs["label_selector"] == (
+        "app.kubernetes.io/managed-by=kodman,kodman/image=ubuntu,kodman/owner=alice"
+    )
+    assert calls[0].kwargs["field_selector"] == (
+        "status.phase!=Succeeded,status.phase!=Failed"
+    )
+
+
+@pytest.mark.filterwarnings("ignore::ResourceWarning")  # Closed by the GC
+def test_ps_hides_finished_runs(fake_cluster):
+    cluster = fake_cluster()
+    backend = Backend(LOG)
+    backend.connect()
+
+    pod_name = backend.run(RunOptions(image="ubuntu", args=["true"]), io.BytesIO())
+    time.sleep(3 * cluster.restart_delay)  # Would have restarted by now
+
+    assert list(backend.ps(PsOptions())) == []
+    (pod,) = backend.ps(PsOptions(all=True))
+    assert pod.metadata and pod.metadata.name == pod_name
+
+
+@pytest.mark.filterwarnings("ignore::ResourceWarning")  # Closed by the GC
+def test_run_with_copy_back_streams_command_logs(fake_cluster, tmp_path: Path):
+    fake_cluster(program=lambda pod: (b"built\n", 0))
+    backend = Backend(LOG)
+    backend.connect()
+
+    out = io.BytesIO()
+    options = RunOptions(
+        image="ubuntu", args=["make"], volumes=[f"{tmp_path / 'out'}:/out:rw"]
+    )
+    backend.run(options, out)
+
+    assert out.getvalue() == b"built\n"
+    assert backend.return_code == 0
+
+
+@pytest.mark.filterwarnings("ignore::ResourceWarning")  # Closed by the GC
+def test_copy_back_does_not_rerun_command(fake_cluster, tmp_path: Path, mocker):
+    cluster = fake_cluster(program=lambda pod: (b"built\n", 0))
+    backend = Backend(LOG)
+    backend.connect()
+    # A slow download, during which a restarted container would run again
+    download = mocker.patch(
+        "kodman.backend.cp_from_k8s",
+        side_effect=lambda *args, **kwargs: time.sleep(3 * cluster.restart_delay),
+    )
+
+    options = RunOptions(
+        image="ubuntu", args=["make"], volumes=[f"{tmp_path / 'out'}:/out:rw"]
+    )
+    pod_name = backend.run(options, io.BytesIO())
+
+    download.assert_called_once()
+    assert cluster.starts[pod_name] == 1
+    assert backend.return_code == 0
+
+
+@pytest.mark.filterwarnings("ignore::ResourceWarning")  # Closed by the GC
+@pytest.mark.parametrize("error", [PodFailure("Failed", "boom"), RuntimeError()])
+def test_failed_run_releases_copy_back(fake_cluster, tmp_path: Path, mocker, error):
+    fake_cluster()
+    backend = Backend(LOG)
+    backend.connect()
+    mocker.patch.object(Backend, "_run_pod", side_effect=error)
+    release = mocker.patch.object(Backend, "_release_copy_back")
+
+    options = RunOptions(
+        image="ubuntu", args=["make"], volumes=[f"{tmp_path / 'out'}:/out:rw"]
+    )
+    if isinstance(error, PodFailure):
+        backend.run(options, io.BytesIO())
+        assert backend.return_code == 1
+    else:
+        with pytest.raises(RuntimeError):
+            backend.run(options, io.BytesIO())
+
+    release.assert_called_once()
+
+
+@pytest.mark.filterwarnings("ignore::ResourceWarning")  # Closed by the GC
+def test_pool_run_uploads_small_volumes(fake_cluster, tmp_path: Path, mocker):
+    fake_cluster()
+    backend = Backend(LOG)
+    backend.connect()
+    claim = mocker.patch.object(Backend, "_claim_pool_pod", return_value="")
+    (tmp_path / "app.ini").write_text("[app]\n")
+
+    options = RunOptions(
+        image="ubuntu",
+        command=["true"],
+        volumes=[f"{tmp_path / 'app.ini'}:/etc/app.ini:ro"],
+        pool=True,
+    )
+    backend.run(options, io.BytesIO())
+
+    claim.assert_called_once()  # Not kept from the pool by a projection
+    assert backend.return_code == 0
+
+
+def test_copy_back_sidecar_times_out(tmp_path: Path):
+    fifo = str(tmp_path / "copy-back")
+    start = time.monotonic()
+    subprocess.run(["sh", "-c", wait_for_trigger(fifo, 1)], check=True, timeout=10)
+    assert 1 <= time.monotonic() - start < 5
@@ -0,0 +1,145 @@
+import asyncio
+import io
+import logging
+import threading
+from pathlib import Path
+
+import pytest
+
+from kodman.backend import AsyncBackend, RunOptions, RunResult
+from kodman.batch import (
+    Job,
+    JobResult,
+    PrefixWriter,
+    format_summary,
+    load_manifest,
+    run_many,
+)
+
+LOG = logging.getLogger("test")
+
+
+def test_load_manifest_yaml(tmp_path: Path):
+    manifest = tmp_path / "jobs.yaml"
+    manifest.write_text(
+        "- name: build\n"
+        "  image: ubuntu\n"
+        "  args: bash -c 'make all'\n"
+        "  rm: true\n"
+        "- image: alpine\n"
+        "  volumes: [./src:/src]\n"
+    )
+
+    jobs = load_manifest(manifest, service_account="ci")
+
+    assert jobs[0] == Job(
+        "build",
+        RunOptions(
+            image="ubuntu", args=["bash", "-c", "make all"], service_account="ci"
+        ),
+        rm=True,
+    )
+    assert jobs[1].name == "job-1"
+    assert jobs[1].options.volumes == ["./src:/src"]
+
+
+def test_load_manifest_jsonl(tmp_path: Path):
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text(
+        '{"image": "ubuntu", "command": ["echo"], "args": ["hi"]}\n'
+        "\n"
+        '{"image": "alpine", "upload_shards": 2}\n'
+    )
+
+    jobs = load_manifest(manifest)
+
+    assert [job.options.image for job in jobs] == ["ubuntu", "alpine"]
+    assert jobs[0].options.command == ["echo"]
+    assert jobs[1].options.upload_shards == 2
+
+
+@pytest.mark.parametrize(
+    "content, message",
+    [
+        ("- image: ubuntu\n  entrypoint: sh\n", "unknown field"),
+        ("- name: a\n", "missing image"),
+        ("- {name: a, image: x}\n- {name: a, image: y}\n", "Duplicate job names: a"),
+        ("image: ubuntu\n", "must contain a list"),
+        ("- {name: ../x, image: ubuntu}\n", "invalid name '../x'"),
+        ("- {name: .., image: ubuntu}\n", "invalid name"),
+    ],
+)
+def test_load_manifest_errors(tmp_path: Path, content, message):
+    manifest = tmp_path / "jobs.yaml"
+    manifest.write_text(content)
+    with pytest.raises(ValueError, match=message):
+        load_manifest(manifest)
+
+
+def test_prefix_writer_keeps_lines_whole():
+    out = io.BytesIO()
+    lock = threading.Lock()
+    a = PrefixWriter(out, "a | ", lock)
+    b = PrefixWriter(out, "b | ", lock)
+
+    a.write(b"one\ntw")
+    b.write(b"three\n\n")
+    a.write(b"o\nend")
+    a.close()
+
+    assert out.getvalue() == b"a | one\nb | three\nb | \na | two\na | end\n"
+
+
+def test_run_many(mocker, tmp_path: Path):
+    running = 0
+    peak = 0
+
+    async def run(self, options, out):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        out.write(f"{options.image} output\n".encode())
+        running -= 1
+        return RunResult(f"pod-{options.image}", int(options.image == "fails"))
+
+    mocker.patch.object(AsyncBackend, "run", autospec=True, side_effect=run)
+    delete = mocker.patch.object(AsyncBackend, "delete", autospec=True)
+    images = ["a", "fails", "c", "d", "e"]
+    jobs = [Job(image, RunOptions(image=image), rm=True) for image in images]
+    out = io.BytesIO()
+
+    results = run_many(AsyncBackend(LOG), jobs, 2, out, LOG)
+
+    assert peak == 2
+    assert [r.exit_code for r in results] == [0, 1, 0, 0, 0]
+    assert [r.pod_name for r in results] == [f"pod-{i}" for i in images]
+    assert b"fails | fails output\n" in out.getvalue()
+    assert delete.call_count == len(images)
+
+
+def test_run_many_log_dir(mocker, tmp_path: Path, capsys):
+    async def run(self, options, out):
+        if options.image == "missing":
+            raise FileNotFoundError("/src does not exist")
+        out.write(b"partial")
+        return RunResult("pod", 0)
+
+    mocker.patch.object(AsyncBackend, "run", autospec=True, side_effect=run)
+    jobs = [Job("ok", RunOptions(image="ok")), Job("bad", RunOptions(image="missing"))]
+
+    results = run_many(AsyncBackend(LOG), jobs, 4, io.BytesIO(), LOG, tmp_path / "logs")
+
+    assert (tmp_path / "logs" / "ok.log").read_bytes() == b"partial"
+    assert results[1] == JobResult("bad", "", 1, results[1].seconds)
+    assert capsys.readouterr().err == "bad: /src does not exist\n"
+
+
+def test_format_summary():
+    results = [JobResult("build", "pod-1", 0, 1.25), JobResult("t", "pod-2", 2, 10)]
+    assert format_summary(results).splitlines() == [
+        "JOB    EXIT  TIME   POD",
+        "build  0     1.2s   pod-1",
+        "t      2     10.0s  pod-2",
+        "1 succeeded, 1 failed",
+    ]
@@ -0,0 +1,183 @@
+"""Benchmarks of kodman against the local fake API server.
+
+Only run with KODMAN_BENCHMARKING=true. Sizes are multiplied by
+KODMAN_BENCHMARK_SCALE. Results are written as JSON to KODMAN_BENCHMARK_REPORT
+if set. Assertions only catch gross regressions, the numbers are for
+comparing runs.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import statistics
+import tarfile
+import time
+from pathlib import Path
+
+import pytest
+from kubernetes import client
+
+from kodman.backend import AsyncBackend, Backend, DeleteOptions, RunOptions
+from kodman.ignore import IgnoreRules, walk
+from kodman.tarpack import write_tar
+from kodman.transfer import cp_k8s
+
+LOG = logging.getLogger("benchmark")
+SCALE = int(os.getenv("KODMAN_BENCHMARK_SCALE", "1"))
+
+pytestmark = [
+    pytest.mark.benchmark,
+    # The kubernetes client leaves closing exec websockets and pooled
+    # connections to the garbage collector
+    pytest.mark.filterwarnings("ignore::ResourceWarning"),
+]
+
+
+def make_tree(root: Path, files: int, size: int) -> Path:
+    for i in range(files):
+        path = root / f"dir{i % 10}" / f"file{i}.bin"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(size))
+    return root
+
+
+@pytest.mark.parametrize(
+    "files, size",
+    [
+        pytest.param(10, 1024, id="projected"),
+        pytest.param(4, 512 * 1024, id="uploaded"),
+    ],
+)
+def test_run_latency(fake_cluster, record, tmp_path: Path, files, size):
+    delays = 0.05 + 0.05
+    cluster = fake_cluster(schedule_delay=0.05, pull_delay=0.05)
+    source = make_tree(tmp_path / "src", files, size)
+    backend = Backend(LOG)
+    backend.connect()
+
+    latencies = []
+    for i in range(5 * SCALE):
+        out = io.BytesIO()
+        options = RunOptions(
+            image="ubuntu", args=["echo", str(i)], volumes=[f"{source}:/src:ro"]
+        )
+        start = time.monotonic()
+        pod_name = backend.run(options, out)
+        latencies.append(time.monotonic() - start)
+        backend.delete(DeleteOptions(pod_name, wait=False))
+        assert out.getvalue() == f"{i}\n".encode()
+        assert backend.return_code == 0
+
+    assert not cluster.objects  # Projections go with their pods
+    overhead = statistics.median(latencies) - delays
+    record(
+        f"run_latency_{files}x{size}",
+        median_s=statistics.median(latencies),
+        max_s=max(latencies),
+        overhead_s=overhead,
+    )
+    assert overhead < 0.5
+
+
+@pytest.mark.parametrize(
+    "files, size, bandwidth",
+    [
+        pytest.param(2000 * SCALE, 1024, 0, id="small-files"),
+        pytest.param(4, 8 * 1024 * 1024 * SCALE, 0, id="large-files"),
+        pytest.param(4, 2 * 1024 * 1024 * SCALE, 20e6, id="large-files-20MBps"),
+    ],
+)
+def test_upload_throughput(
+    fake_cluster, record, tmp_path: Path, files, size, bandwidth
+):
+    cluster = fake_cluster(exec_bandwidth=bandwidth)
+    source = make_tree(tmp_path / "src", files, size)
+    cluster.add_pod("upload")
+    backend = Backend(LOG)
+    backend.connect()
+
+    start = time.monotonic()
+    stats = cp_k8s(
+        client.CoreV1Api(), "default", "upload", "init", source, Path("/data"), LOG
+    )
+    seconds = time.monotonic() - start
+
+    assert cluster.uploaded["upload"] == stats.wire_bytes >= files * size
+    record(
+        f"upload_{files}x{size}_{int(bandwidth)}",
+        seconds=seconds,
+        mb_per_s=stats.wire_bytes / seconds / 1e6,
+        files_per_s=files / seconds,
+    )
+    if bandwidth:  # The pipeline keeps a throttled link busy
+        assert stats.wire_bytes / seconds > 0.7 * bandwidth
+
+
+def test_pack_small_files(record, tmp_path: Path):
+    files = 5000 * SCALE
+    source = make_tree(tmp_path / "src", files, 512)
+    members = [
+        (path, f"data/{path.relative_to(source)}")
+        for path, _ in walk(source, IgnoreRules())
+    ]
+
+    def tarfile_pack():
+        with tarfile.open(fileobj=io.BytesIO(), mode="w|") as tar:
+            for path, arcname in members:
+                tar.add(path, arcname=arcname, recursive=False)
+
+    seconds = {}
+    for name, pack in (
+        ("tarfile", tarfile_pack),
+        ("batched", lambda: write_tar(io.BytesIO(), members)),
+    ):
+        start = time.monotonic()
+        pack()
+        seconds[name] = time.monotonic() - start
+    record(
+        f"pack_{files}x512",
+        **{f"{name}_files_per_s": files / s for name, s in seconds.items()},
+    )
+    assert seconds["batched"] < seconds["tarfile"]
+
+
+def test_log_throughput(fake_cluster, record):
+    line = b"Compiling module with a reasonably long build log line\n"
+    output = line * (16 * 1024 * 1024 * SCALE // len(line))
+    fake_cluster(program=lambda pod: (output, 0))
+    backend = Backend(LOG)
+    backend.connect()
+
+    out = io.BytesIO()
+    backend.run(RunOptions(image="ubuntu", args=["make"]), out)
+
+    assert out.getvalue() == output
+    seconds = backend.timings.report()["phases"]["run.logs"]
+    record("log_throughput", seconds=seconds, mb_per_s=len(output) / seconds / 1e6)
+
+
+def test_concurrent_runs(fake_cluster, record):
+    fake_cluster(schedule_delay=0.2, pull_delay=0.1)
+    backend = AsyncBackend(LOG)
+    backend.connect()
+
+    async def run_many(count: int) -> float:
+        start = time.monotonic()
+        results = await asyncio.gather(
+            *(
+                backend.run(RunOptions(image="ubuntu", args=["echo", str(i)]), out)
+                for i, out in enumerate(io.BytesIO() for _ in range(count))
+            )
+        )
+        assert [r.exit_code for r in results] == [0] * count
+        return time.monotonic() - start
+
+    walls = {count: asyncio.run(run_many(count)) for count in (1, 8, 32 * SCALE)}
+
+    record(
+        "concurrent_runs",
+        **{f"wall_{count}_s": wall for count, wall in walls.items()},
+        **{f"runs_per_s_{count}": count / wall for count, wall in walls.items()},
+    )
+    assert walls[32 * SCALE] < 8 * walls[1]
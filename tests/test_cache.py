@@ -0,0 +1,139 @@
+import io
+import logging
+import os
+import subprocess
+import tarfile
+import threading
+from pathlib import Path, PurePosixPath
+
+import pytest
+
+from kodman import cache
+from kodman.cache import (
+    CacheLookup,
+    add_cached_tree,
+    blob_path,
+    cache_run_dir,
+    hash_tree,
+    lookup_blobs,
+    lookup_script,
+    publish_script,
+)
+from kodman.ignore import IgnoreRules
+
+LOG = logging.getLogger("test")
+
+
+@pytest.fixture
+def tree(tmp_path: Path) -> Path:
+    root = tmp_path / "src"
+    (root / "bin").mkdir(parents=True)
+    (root / "bin" / "tool").write_bytes(b"#!/bin/sh\necho tool\n")
+    (root / "bin" / "tool").chmod(0o755)
+    (root / "a.txt").write_text("same\n")
+    (root / "b.txt").write_text("same\n")
+    (root / "link").symlink_to("bin/tool")
+    return root
+
+
+@pytest.fixture
+def cache_dir(mocker, tmp_path: Path) -> Path:
+    path = tmp_path / "cache"
+    mocker.patch.object(cache, "CACHE_DIR", PurePosixPath(path))
+    return path
+
+
+def sh(script: str, stdin: str = "") -> str:
+    return subprocess.run(
+        ["sh", "-c", script], input=stdin, capture_output=True, check=True, text=True
+    ).stdout
+
+
+def test_hash_tree(tree: Path):
+    manifest = hash_tree(tree)
+
+    assert manifest.entries[0].path == "."
+    assert len(manifest.keys) == 2  # a.txt and b.txt share a blob
+    assert hash_tree(tree).root == manifest.root
+
+    os.utime(tree / "a.txt", (1e9, 1e9))
+    assert hash_tree(tree).root == manifest.root  # Only content and mode count
+    (tree / "bin" / "tool").chmod(0o700)
+    assert hash_tree(tree).root != manifest.root
+    assert hash_tree(tree, IgnoreRules(["bin"])).root != hash_tree(tree).root
+
+
+def test_cached_tree_round_trip(tree: Path, cache_dir: Path):
+    manifest = hash_tree(tree)
+    keys = sorted(manifest.keys)
+    incoming = "incoming/pod-0"
+    run_dir = cache_run_dir("pod", 0)
+    lookup = sh(lookup_script(manifest.root, run_dir), "\n".join([*keys, "END", ""]))
+    assert lookup.split() == ["miss", *keys, "END"]
+
+    def upload(run_dir: str, missing: set[str]):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            add_cached_tree(tar, manifest, missing, run_dir, incoming)
+        archive.seek(0)
+        with tarfile.open(fileobj=archive) as tar:
+            tar.extractall("/")
+        sh(publish_script(manifest.root, incoming, run_dir))
+
+    upload(run_dir, manifest.keys)
+    result = cache_dir / run_dir
+    assert (result / "bin" / "tool").read_bytes() == b"#!/bin/sh\necho tool\n"
+    assert (result / "bin" / "tool").stat().st_mode & 0o777 == 0o755
+    assert os.readlink(result / "link") == "bin/tool"
+    assert all((cache_dir / blob_path(key)).exists() for key in keys)
+    assert (result / "a.txt").stat().st_ino == (result / "b.txt").stat().st_ino
+    assert not (cache_dir / incoming).exists()
+
+    # A second run sends nothing, the stored tree is linked in place
+    second = cache_run_dir("pod2", 0)
+    assert sh(lookup_script(manifest.root, second)).split() == ["hit", "END"]
+    linked = cache_dir / second
+    assert (linked / "a.txt").read_text() == "same\n"
+    assert (linked / "a.txt").stat().st_ino == (result / "a.txt").stat().st_ino
+    assert (linked / "bin" / "tool").stat().st_mode & 0o777 == 0o755
+    assert os.readlink(linked / "link") == "bin/tool"
+    assert not list((cache_dir / "trees").glob("*.lock"))
+
+
+def test_lookup_answers_after_reading_keys(cache_dir: Path):
+    keys = [f"{i:064x}-644" for i in range(20000)]  # More than a pipe buffer
+    script = lookup_script("root", cache_run_dir("pod", 0))
+    with subprocess.Popen(
+        ["sh", "-c", script], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    ) as process:
+        assert process.stdin and process.stdout
+        assert process.stdout.readline() == b"miss\n"
+        stdin = process.stdin
+        data = "".join(f"{key}\n" for key in [*keys, "END"]).encode()
+        # Written without reading, which blocks if keys are answered while sent
+        writer = threading.Thread(target=lambda: (stdin.write(data), stdin.close()))
+        writer.start()
+        writer.join(timeout=10)
+        if blocked := writer.is_alive():
+            process.kill()
+        assert not blocked
+        answer = process.stdout.read().split()
+    assert answer == [key.encode() for key in keys] + [b"END"]
+    assert process.returncode == 0
+
+
+def test_lookup_blobs(mocker, tree: Path):
+    manifest = hash_tree(tree)
+    missing = sorted(manifest.keys)[0]
+    resp = mocker.MagicMock()
+    resp.is_open.return_value = True
+    resp.read_channel.side_effect = [b"", b"", b"status: Success"]
+    resp.read_all.side_effect = [b"miss\n", f"{missing}\nEND\n".encode(), b""]
+    mocker.patch("kodman.cache.stream", return_value=resp)
+
+    lookup = lookup_blobs(mocker.MagicMock(), "ns", "pod", "init", manifest, "r", LOG)
+    assert lookup == CacheLookup(False, {missing})
+
+    sent = b"".join(call.args[0] for call in resp.write_stdin.call_args_list)
+    assert sent.decode().split() == [*sorted(manifest.keys), "END"]
+    resp.close.assert_called_once()
@@ -1,9 +1,12 @@
 import subprocess
+import sys
 
 from data import responses
 from kodman import __version__
 
 ENTRY_POINT = "kodman"
+COLD_START_BUDGET_US = 200_000  # Importing kubernetes alone takes ~1s
+HEAVY_MODULES = ("kubernetes", "rich")
 
 
 def test_cli_version():
@@ -14,3 +17,42 @@ def test_cli_version():
 def test_cli_help():
     cmd = [ENTRY_POINT, "--help"]
     assert subprocess.check_output(cmd).decode().strip() == responses.help_screen
+
+
+def test_cli_version_cold_start():
+    cmd = [sys.executable, "-X", "importtime", "-m", ENTRY_POINT, "version"]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+    imported = []
+    total_us = 0
+    started = False
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        imported.append(name.strip())
+        if name.strip() == "runpy":
+            started = True  # Everything before is interpreter startup
+        elif started and not name.startswith("  "):  # Top level imports only
+            total_us += int(cumulative)
+
+    assert not [m for m in imported if m.split(".")[0] in HEAVY_MODULES]
+    assert total_us < COLD_START_BUDGET_US
+
+
+def test_cli_run_dry_run(tmp_path):
+    (tmp_path / "keep.txt").write_text("keep\n")
+    (tmp_path / "drop.log").write_text("drop\n")
+    cmd = [ENTRY_POINT, "run", "--dry-run", "-v", f"{tmp_path}:/src:exclude=*.log"]
+    output = subprocess.check_output([*cmd, "ubuntu"]).decode().splitlines()
+    assert output == [
+        f"{tmp_path} -> /src: 1 files, 5 bytes",
+        "Total: 1 files, 5 bytes",
+    ]
+
+
+def test_cli_run_pool_needs_entrypoint():
+    cmd = [ENTRY_POINT, "run", "--pool", "ubuntu", "bash", "-c", "echo fast"]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    assert result.returncode == 1
+    assert result.stderr.strip() == "--pool needs --entrypoint"
@@ -0,0 +1,37 @@
+import logging
+import os
+from pathlib import Path
+
+from kodman.compression import CODECS, SAMPLE_FILE_SIZE, sample_tree, select_codec
+
+LOG = logging.getLogger("test")
+
+
+def test_select_codec():
+    candidates = [CODECS["gzip"], CODECS["xz"]]
+    compressible = b"kodman " * 100_000
+    slow_link = 100 * 1024
+    assert select_codec(compressible, candidates, slow_link, LOG).name != "none"
+    incompressible = os.urandom(256 * 1024)
+    fast_link = 10 * 1024**3
+    assert select_codec(incompressible, candidates, fast_link, LOG).name == "none"
+    assert select_codec(b"", candidates, slow_link, LOG).name == "none"
+
+
+def test_sample_tree(tmp_path: Path):
+    for i in range(4):
+        (tmp_path / f"{i}.bin").write_bytes(bytes(100 * 1024))
+    assert len(sample_tree(tmp_path, size=150 * 1024)) == 150 * 1024
+    assert len(sample_tree(tmp_path / "0.bin")) == SAMPLE_FILE_SIZE
+
+
+def test_remote_command():
+    assert CODECS["none"].remote_command() == ["tar", "xf", "-", "-C", "/"]
+    assert CODECS["none"].remote_command("echo go") == [
+        "sh",
+        "-c",
+        "tar xf - -C / && echo go",
+    ]
+    assert CODECS["gzip"].remote_command("echo go")[2] == (
+        "gzip -dc | tar xf - -C / && echo go"
+    )
@@ -0,0 +1,66 @@
+import logging
+import os
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+from kodman import daemon as daemon_module
+from kodman.daemon import DaemonServer, forward, socket_path, trusted
+
+LOG = logging.getLogger("test")
+
+
+def execute(argv):
+    print(f"{os.getcwd()} {' '.join(argv)}")
+    sys.exit(int(os.environ["KODMAN_TEST_INT"]))
+
+
+@pytest.fixture
+def daemon(tmp_path: Path):
+    path = tmp_path / "kodman.sock"
+    server = DaemonServer(path, execute, lambda: None, LOG)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+def test_socket_path(mocker):
+    mocker.patch.dict(os.environ, {"XDG_RUNTIME_DIR": "/run/user/1"})
+    assert socket_path() == Path(f"/run/user/1/kodman-{os.getuid()}.sock")
+    assert socket_path("/tmp/k.sock") == Path("/tmp/k.sock")
+    mocker.patch.dict(os.environ, {"XDG_RUNTIME_DIR": ""})
+    assert socket_path().parent.name == f"kodman-{os.getuid()}"  # Not shared /tmp
+
+
+def test_forward_without_daemon(tmp_path: Path):
+    assert forward(["run", "ubuntu"], tmp_path / "missing.sock") is None
+
+
+def test_forward_keeps_local_commands(daemon: Path):
+    assert forward(["version"], daemon) is None
+    assert forward(["--help"], daemon) is None
+
+
+def test_forward(daemon: Path, env_vars, capfd, tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert forward(["run", "ubuntu", "true"], daemon) == 99
+    assert capfd.readouterr().out == f"{tmp_path} run ubuntu true\n"
+
+
+def test_forward_to_other_user(daemon: Path, mocker, capfd):
+    mocker.patch.object(daemon_module, "peer_uid", return_value=os.getuid() + 1)
+    assert forward(["run", "ubuntu", "true"], daemon) is None
+    assert "not a kodman daemon of this user" in capfd.readouterr().err
+
+
+def test_trusted_without_peer_credentials(daemon: Path, mocker):
+    mocker.patch.object(daemon_module, "peer_uid", return_value=None)
+    sock = mocker.MagicMock()
+    daemon.parent.chmod(0o700)
+    assert trusted(sock, daemon)
+    daemon.parent.chmod(0o777)
+    assert not trusted(sock, daemon)
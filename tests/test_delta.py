@@ -0,0 +1,128 @@
+import io
+import logging
+import os
+import subprocess
+import tarfile
+from pathlib import Path, PurePosixPath
+
+from kodman.compression import CODECS
+from kodman.delta import (
+    RemoteEntry,
+    manifest_command,
+    parse_manifest,
+    plan_delta,
+    sync_k8s,
+)
+from kodman.ignore import IgnoreRules
+from kodman.transfer import DELETE_SCRIPT
+
+LOG = logging.getLogger("test")
+
+
+def remote_manifest(dest: Path) -> dict[str, RemoteEntry]:
+    output = subprocess.run(
+        manifest_command(PurePosixPath(dest)), capture_output=True, check=True
+    ).stdout
+    return parse_manifest(output)
+
+
+def apply(plan, dest: Path):
+    """Send a plan the way cp_k8s does, extracting with a local shell."""
+    stream = io.BytesIO()
+    stream.write("".join(f"{path}\n" for path in [*plan.deletions, ""]).encode())
+    with tarfile.open(fileobj=stream, mode="w") as tar:
+        for path, arcname in plan.members:
+            tar.add(path, arcname=arcname, recursive=False)
+    command = CODECS["none"].remote_command(before=DELETE_SCRIPT)
+    subprocess.run(command, input=stream.getvalue(), check=True)
+
+
+def test_parse_manifest():
+    digest = "a" * 64
+    data = (
+        b"d 0 100 755 .\n"
+        b"f 3 200 644 ./dir/a file\n"
+        b"l 0 300 777 ./link\n" + f"{digest}  ./dir/a file\n".encode()
+    )
+
+    assert parse_manifest(data) == {
+        ".": RemoteEntry("d", 0, 100, 0o755),
+        "dir/a file": RemoteEntry("f", 3, 200, 0o644, digest),
+        "link": RemoteEntry("l", 0, 300, 0o777),
+    }
+
+
+def test_delta_round_trip(tmp_path: Path):
+    source, dest = tmp_path / "src", tmp_path / "dest"
+    (source / "sub").mkdir(parents=True)
+    (source / "keep.txt").write_text("keep\n")
+    (source / "edit.txt").write_text("old\n")
+    (source / "sub" / "gone.txt").write_text("gone\n")
+    (source / "become-dir").write_text("file\n")
+    (source / "link").symlink_to("keep.txt")
+    assert remote_manifest(dest) == {}
+
+    apply(plan_delta(source, PurePosixPath(dest), {}), dest)
+    assert (dest / "sub" / "gone.txt").read_text() == "gone\n"
+
+    (source / "edit.txt").write_text("new\n")
+    os.utime(source / "edit.txt", (2e9, 2e9))  # Times have a resolution of 1s
+    (source / "sub" / "gone.txt").unlink()
+    (source / "become-dir").unlink()
+    (source / "become-dir").mkdir()
+    (source / "become-dir" / "inner").write_text("inner\n")
+    (source / "added.txt").write_text("added\n")
+    (dest / "excluded.log").write_text("remote only\n")
+    os.utime(source / "keep.txt", (1e9, 1e9))  # Same content, other time
+
+    plan = plan_delta(
+        source, PurePosixPath(dest), remote_manifest(dest), IgnoreRules(["*.log"])
+    )
+    sent = {Path(arcname).relative_to(dest).as_posix() for _, arcname in plan.members}
+    assert sent == {"edit.txt", "become-dir", "become-dir/inner", "added.txt", "link"}
+    assert plan.deletions == [str(dest / "become-dir"), str(dest / "sub/gone.txt")]
+    apply(plan, dest)
+
+    assert (dest / "edit.txt").read_text() == "new\n"
+    assert (dest / "become-dir" / "inner").read_text() == "inner\n"
+    assert not (dest / "sub" / "gone.txt").exists()
+    assert (dest / "excluded.log").exists()
+    assert os.readlink(dest / "link") == "keep.txt"
+
+
+def test_sync_k8s_skips_upload_without_changes(mocker, tmp_path: Path):
+    (tmp_path / "a.txt").write_text("a\n")
+    mocker.patch(
+        "kodman.delta.fetch_manifest",
+        return_value=remote_manifest(tmp_path),
+    )
+    cp = mocker.patch("kodman.delta.cp_k8s")
+
+    stats = sync_k8s(
+        mocker.MagicMock(), "ns", "pod", "c", tmp_path, PurePosixPath("/dst"), LOG
+    )
+
+    assert stats.wire_bytes == 0
+    cp.assert_not_called()
+
+
+def test_sync_k8s_passes_sparse(mocker, tmp_path: Path):
+    (tmp_path / "a.txt").write_text("a\n")
+    mocker.patch("kodman.delta.fetch_manifest", return_value={})
+    cp = mocker.patch("kodman.delta.cp_k8s")
+
+    def gnu_tar() -> bool:
+        return True
+
+    sync_k8s(
+        mocker.MagicMock(),
+        "ns",
+        "pod",
+        "c",
+        tmp_path,
+        PurePosixPath("/dst"),
+        LOG,
+        sparse=gnu_tar,
+    )
+
+    assert cp.call_args.kwargs["sparse"] is gnu_tar
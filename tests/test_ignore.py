@@ -0,0 +1,100 @@
+import io
+import os
+import tarfile
+from pathlib import Path
+
+import pytest
+
+from kodman.ignore import IgnoreRules, walk
+from kodman.transfer import ChunkPipe, produce_tar, tree_size
+
+
+@pytest.mark.parametrize(
+    "patterns, path, excluded",
+    [
+        (["*.o"], "main.o", True),
+        (["*.o"], "src/main.o", False),
+        (["**/*.o"], "src/lib/main.o", True),
+        (["**/*.o"], "main.o", True),
+        (["/build"], "build/out/a.bin", True),
+        (["src/*/tmp"], "src/a/tmp/x", True),
+        (["src/*/tmp"], "src/a/b/tmp", False),
+        (["file?.txt"], "file1.txt", True),
+        (["file[!0-4].txt"], "file7.txt", True),
+        (["file[!0-4].txt"], "file3.txt", False),
+        (["# comment", ""], "# comment", False),
+        (["*.md", "!README.md"], "README.md", False),
+        (["!README.md", "*.md"], "README.md", True),
+        (["docs", "!docs/keep"], "docs/keep/a.txt", False),
+        (["docs", "!docs/keep"], "docs/other.txt", True),
+    ],
+)
+def test_excluded(patterns, path, excluded):
+    assert IgnoreRules(patterns).excluded(path) is excluded
+
+
+@pytest.mark.parametrize(
+    "patterns, pruned",
+    [
+        ([".git"], True),
+        ([".git", "!*.md"], True),
+        ([".git", "!.git/HEAD"], False),
+        ([".git", "!**/HEAD"], False),
+        (["!.git"], False),
+    ],
+)
+def test_prune(patterns, pruned):
+    assert IgnoreRules(patterns).prune(".git") is pruned
+
+
+def make_repo(root: Path) -> Path:
+    for name in ("src/main.py", "src/main.pyc", ".git/HEAD", "node_modules/a/b.js"):
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_text("x" * 10)
+    (root / ".kodmanignore").write_text("# Not needed by the job\n.git\n*/*.pyc\n")
+    return root
+
+
+def test_walk_prunes_excluded_directories(tmp_path: Path, mocker):
+    root = make_repo(tmp_path)
+    rules = IgnoreRules.load(root, ["node_modules"])
+    scandir = mocker.spy(os, "scandir")
+
+    paths = {path.relative_to(root).as_posix() for path, _ in walk(root, rules)}
+
+    assert paths == {".", ".kodmanignore", "src", "src/main.py"}
+    assert {Path(call.args[0]) for call in scandir.call_args_list} == {
+        root,
+        root / "src",
+    }
+
+
+def test_produce_tar_excludes(tmp_path: Path):
+    root = make_repo(tmp_path)
+    pipe = ChunkPipe()
+
+    produce_tar(root, Path("/src"), pipe, pipe, ignore=IgnoreRules.load(root))
+
+    with tarfile.open(fileobj=io.BytesIO(b"".join(pipe))) as tar:
+        names = tar.getnames()
+    assert sorted(names) == [
+        "src",
+        "src/.kodmanignore",
+        "src/node_modules",
+        "src/node_modules/a",
+        "src/node_modules/a/b.js",
+        "src/src",
+        "src/src/main.py",
+    ]
+
+
+def test_tree_size(tmp_path: Path):
+    root = make_repo(tmp_path)
+    ignore_bytes = (root / ".kodmanignore").stat().st_size
+
+    assert tree_size(root) == (5, 40 + ignore_bytes)
+    assert tree_size(root, IgnoreRules.load(root, ["node_modules"])) == (
+        2,
+        10 + ignore_bytes,
+    )
+    assert tree_size(root / "src" / "main.py") == (1, 10)
@@ -0,0 +1,57 @@
+import base64
+import os
+from pathlib import Path
+
+from kodman.ignore import IgnoreRules
+from kodman.projection import (
+    PROJECTION_LIMIT,
+    projected_files,
+    projection_object,
+    projection_volume,
+)
+
+
+def test_projected_files(tmp_path: Path):
+    (tmp_path / "conf" / "nested").mkdir(parents=True)
+    (tmp_path / "conf" / "app.ini").write_text("[app]\n")
+    (tmp_path / "conf" / "nested" / "run.sh").write_text("#!/bin/sh\n")
+    (tmp_path / "conf" / "nested" / "run.sh").chmod(0o755)
+    (tmp_path / "conf" / "big.bin").write_bytes(bytes(3000))
+
+    files = projected_files(0, tmp_path / "conf", "conf", PROJECTION_LIMIT)
+    assert files
+    assert {(f.path, f.mode) for f in files} == {
+        ("app.ini", 0o644),
+        ("big.bin", 0o644),
+        ("nested/run.sh", 0o755),
+    }
+    assert len({f.key for f in files}) == 3
+    assert projected_files(0, tmp_path / "conf", "conf", 3000) is None  # Too large
+    ignore = IgnoreRules(["*.bin"])
+    assert projected_files(0, tmp_path / "conf", "conf", 3000, ignore)
+
+    (single,) = projected_files(1, tmp_path / "conf" / "app.ini", "x.ini", 100) or []
+    assert (single.key, single.path) == ("1-0", "x.ini")
+
+    (tmp_path / "conf" / "empty").mkdir()
+    assert projected_files(0, tmp_path / "conf", "conf", PROJECTION_LIMIT) is None
+    os.rmdir(tmp_path / "conf" / "empty")
+    (tmp_path / "conf" / "link").symlink_to("app.ini")
+    assert projected_files(0, tmp_path / "conf", "conf", PROJECTION_LIMIT) is None
+
+
+def test_projection_object(tmp_path: Path):
+    (tmp_path / "a").write_bytes(b"\x00\xff")
+    files = projected_files(2, tmp_path, "dst", PROJECTION_LIMIT) or []
+    owner = {"apiVersion": "v1", "kind": "Pod", "name": "pod", "uid": "1234"}
+
+    config_map = projection_object("ConfigMap", "pod", files, owner)
+    assert config_map["metadata"]["ownerReferences"] == [owner]
+    assert base64.b64decode(config_map["binaryData"]["2-0"]) == b"\x00\xff"
+    assert "data" in projection_object("Secret", "pod", files, owner)
+
+    volume = projection_volume("projected-2", "Secret", "pod", files)
+    assert volume["secret"] == {
+        "secretName": "pod",
+        "items": [{"key": "2-0", "path": "a", "mode": 0o644}],
+    }
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from kubernetes import client
+
+from kodman.ps import format_row, header, humanize, pod_status
+
+NOW = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "seconds, text",
+    [
+        (0, "Less than a second"),
+        (1, "1 second"),
+        (59, "59 seconds"),
+        (90, "About a minute"),
+        (300, "5 minutes"),
+        (5400, "About an hour"),
+        (3 * 86400, "3 days"),
+    ],
+)
+def test_humanize(seconds, text):
+    assert humanize(seconds) == text
+
+
+def make_pod(state=None, labels=None) -> client.V1Pod:
+    statuses = None
+    if state:
+        statuses = [
+            client.V1ContainerStatus(
+                name="kodman-exec",
+                image="ubuntu",
+                image_id="",
+                ready=False,
+                restart_count=0,
+                state=client.V1ContainerState(**state),
+            )
+        ]
+    return client.V1Pod(
+        metadata=client.V1ObjectMeta(
+            name="kodman-run-123",
+            labels={"kodman/owner": "alice", **(labels or {})},
+            annotations={"kodman/image": "docker.io/library/ubuntu:22.04"},
+            creation_timestamp=NOW - timedelta(minutes=10),
+        ),
+        spec=client.V1PodSpec(
+            containers=[
+                client.V1Container(
+                    name="kodman-exec", image="ubuntu:22.04", args=["sleep", "60"]
+                )
+            ]
+        ),
+        status=client.V1PodStatus(phase="Running", container_statuses=statuses),
+    )
+
+
+@pytest.mark.parametrize(
+    "pod, status",
+    [
+        (make_pod(labels={"kodman/pool-state": "idle"}), "Pooled"),
+        (
+            make_pod(
+                {
+                    "terminated": client.V1ContainerStateTerminated(
+                        exit_code=2, finished_at=NOW - timedelta(seconds=30)
+                    )
+                }
+            ),
+            "Exited (2) 30 seconds ago",
+        ),
+        (
+            make_pod(
+                {
+                    "running": client.V1ContainerStateRunning(
+                        started_at=NOW - timedelta(hours=3)
+                    )
+                }
+            ),
+            "Up 3 hours",
+        ),
+        (
+            make_pod(
+                {"waiting": client.V1ContainerStateWaiting(reason="ImagePullBackOff")}
+            ),
+            "ImagePullBackOff",
+        ),
+        (make_pod(), "Running"),
+    ],
+)
+def test_pod_status(pod, status):
+    assert pod_status(pod, NOW) == status
+
+
+def test_format_row():
+    row = format_row(make_pod(), NOW)
+    assert row.split("  ")[0].rstrip() == "kodman-run-123"
+    assert "docker.io/library/ubunt…" in row
+    assert '"sleep 60"' in row
+    assert "10 minutes ago" in row
+    assert row.endswith("alice")
+    assert row.index("alice") == header().index("OWNER")
@@ -0,0 +1,94 @@
+from pathlib import Path, PurePosixPath
+
+import pytest
+from kubernetes import client
+
+from kodman.shared import (
+    ClaimMount,
+    SharedClaim,
+    claim_mounts,
+    find_claim,
+    mount_points,
+    share_claim,
+)
+
+MOUNTINFO = """\
+22 1 0:21 / / rw,relatime - overlay overlay rw
+30 22 8:1 /pvc-1 /workspace rw,relatime - ext4 /dev/sda1 rw
+31 22 8:1 /pvc-2/cache /home/runner/build\\040cache rw,relatime - ext4 /dev/sda1 rw
+"""
+
+
+def make_runner_pod() -> client.V1Pod:
+    return client.V1Pod(
+        spec=client.V1PodSpec(
+            node_name="node-a",
+            containers=[
+                client.V1Container(
+                    name="runner",
+                    volume_mounts=[
+                        client.V1VolumeMount(name="work", mount_path="/workspace"),
+                        client.V1VolumeMount(
+                            name="cache",
+                            mount_path="/home/runner/build cache",
+                            sub_path="cache",
+                        ),
+                        client.V1VolumeMount(name="tmp", mount_path="/tmp"),
+                    ],
+                ),
+                client.V1Container(
+                    name="sidecar",
+                    volume_mounts=[
+                        client.V1VolumeMount(name="other", mount_path="/other")
+                    ],
+                ),
+            ],
+            volumes=[
+                client.V1Volume(
+                    name=name,
+                    persistent_volume_claim=client.V1PersistentVolumeClaimVolumeSource(
+                        claim_name=f"{name}-claim"
+                    ),
+                )
+                for name in ("work", "cache", "other")
+            ]
+            + [client.V1Volume(name="tmp", empty_dir=client.V1EmptyDirVolumeSource())],
+        )
+    )
+
+
+def make_claim(*modes: str) -> client.V1PersistentVolumeClaim:
+    return client.V1PersistentVolumeClaim(
+        spec=client.V1PersistentVolumeClaimSpec(access_modes=list(modes))
+    )
+
+
+def test_find_claim():
+    mounts = claim_mounts(make_runner_pod(), mount_points(MOUNTINFO))
+
+    assert [m.claim for m in mounts] == ["cache-claim", "work-claim"]
+    found = find_claim(Path("/home/runner/build cache/ccache"), mounts)
+    assert found == ClaimMount(
+        "cache-claim", PurePosixPath("/home/runner/build cache"), "cache/ccache", False
+    )
+    assert find_claim(Path("/workspace"), mounts).sub_path == ""  # type: ignore
+    assert find_claim(Path("/workspace/src"), mounts).sub_path == "src"  # type: ignore
+    assert find_claim(Path("/tmp/src"), mounts) is None
+    assert find_claim(Path("/other/src"), mounts) is None  # Not this container's
+
+
+@pytest.mark.parametrize(
+    "modes, rw, read_only, expected",
+    [
+        (["ReadWriteMany"], True, False, SharedClaim("c", "src")),
+        (["ReadOnlyMany"], False, False, SharedClaim("c", "src")),
+        (["ReadOnlyMany"], True, False, None),
+        (["ReadWriteMany"], True, True, None),
+        (["ReadWriteOnce"], False, False, SharedClaim("c", "src", "node-a")),
+        (["ReadWriteOncePod"], False, False, None),
+    ],
+)
+def test_share_claim(modes, rw, read_only, expected):
+    mount = ClaimMount("c", PurePosixPath("/w"), "src", read_only)
+
+    assert share_claim(mount, make_claim(*modes), "node-a", rw) == expected
@@ -13,12 +13,6 @@ DOCKER_PROVIDER = os.getenv("DOCKER_PROVIDER", "podman")
 KODMAN_SYSTEM_TESTING = os.getenv("KODMAN_SYSTEM_TESTING") == "true"
 
 
-def remove_empty_lines(text):
-    """Remove after solving https://github.com/epics-containers/Kodman/issues/9"""
-    lines = [line for line in text.split("\n") if line.strip()]
-    return "\n".join(lines)
-
-
 @pytest.mark.skipif(
     not KODMAN_SYSTEM_TESTING, reason="export KODMAN_SYSTEM_TESTING=true"
 )
@@ -32,9 +26,7 @@ def test_docker_run_hello():
 )
 def test_kodman_run_hello():
     cmd = [ENTRY_POINT, "run", "--rm", "hello-world"]
-    assert subprocess.check_output(cmd).decode().strip() == remove_empty_lines(
-        responses.hello_world
-    )
+    assert subprocess.check_output(cmd).decode().strip() == responses.hello_world
 
 
 @pytest.mark.skipif(
@@ -56,7 +48,7 @@ def test_kodman_run_incluster(root: Path):
     ]
 
     result = subprocess.run(cmd, capture_output=True, text=True)
-    assert result.stdout.strip() == remove_empty_lines(responses.hello_world)
+    assert result.stdout.strip() == responses.hello_world
 
 
 @pytest.mark.skipif(
@@ -0,0 +1,172 @@
+import io
+import os
+import shutil
+import subprocess
+import tarfile
+from pathlib import Path
+
+import pytest
+
+from kodman import tarpack
+from kodman.tarpack import RECORD, write_tar
+
+GNU_TAR = (
+    shutil.which("tar")
+    and "GNU tar"
+    in subprocess.run(
+        ["tar", "--version"], capture_output=True, text=True, check=False
+    ).stdout
+)
+
+
+def members(root: Path, dest: str) -> list[tuple[Path, str]]:
+    paths = [root, *sorted(root.rglob("*"))]
+    return [(path, f"{dest}/{path.relative_to(root)}") for path in paths]
+
+
+def test_write_tar(tmp_path: Path, mocker):
+    mocker.patch.object(tarpack, "SMALL_FILE", 1000)  # Stream the large file
+    root = tmp_path / "src"
+    (root / "empty").mkdir(parents=True)
+    (root / "run.sh").write_text("#!/bin/sh\n")
+    (root / "run.sh").chmod(0o755)
+    (root / "large.bin").write_bytes(os.urandom(5000))
+    (root / "link").symlink_to("run.sh")
+    os.link(root / "run.sh", root / "hard")
+    long = root / ("d" * 60) / ("f" * 60)
+    long.mkdir(parents=True)
+    (long / ("x" * 120)).write_text("long")
+    os.mkfifo(root / "fifo")
+
+    out = io.BytesIO()
+    count = write_tar(out, members(root, "/dst"), workers=2)
+
+    assert count == len(members(root, "/dst"))
+    assert len(out.getvalue()) % RECORD == 0
+    out.seek(0)
+    with tarfile.open(fileobj=out) as tar:
+        found = {m.name: m for m in tar}
+        assert found["dst/empty"].isdir()
+        assert found["dst/hard"].mode == 0o755
+        assert found["dst/link"].linkname == "run.sh"
+        assert found["dst/fifo"].isfifo()
+        assert found["dst/run.sh"].linkname == "dst/hard"  # Archived after it
+        large = tar.extractfile("dst/large.bin")
+        assert large and large.read() == (root / "large.bin").read_bytes()
+        name = f"dst/{'d' * 60}/{'f' * 60}/{'x' * 120}"
+        assert tar.extractfile(name).read() == b"long"  # type: ignore
+
+
+def test_write_tar_bounds_read_ahead(tmp_path: Path, mocker):
+    mocker.patch.object(tarpack, "READ_AHEAD_BYTES", 1000)
+    stream = mocker.spy(tarpack, "_stream_file")
+    root = tmp_path / "src"
+    root.mkdir()
+    for i in range(20):
+        (root / f"{i}.txt").write_bytes(os.urandom(300))
+
+    out = io.BytesIO()
+    write_tar(out, members(root, "dst"), workers=2)
+
+    assert stream.call_count == 17  # Only three fit, the batch is read at once
+    out.seek(0)
+    with tarfile.open(fileobj=out) as tar:
+        for i in range(20):
+            f = tar.extractfile(f"dst/{i}.txt")
+            assert f and f.read() == (root / f"{i}.txt").read_bytes()
+
+
+def test_write_tar_matches_tarfile(tmp_path: Path):
+    root = tmp_path / "src"
+    for i in range(300):  # More than a batch
+        path = root / f"dir{i % 3}" / f"file{i}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(i))
+
+    out = io.BytesIO()
+    write_tar(out, members(root, "dst"))
+    expected = io.BytesIO()
+    with tarfile.open(fileobj=expected, mode="w") as tar:
+        for path, arcname in members(root, "dst"):
+            tar.add(path, arcname, recursive=False)
+
+    def contents(archive: io.BytesIO) -> dict:
+        archive.seek(0)
+        with tarfile.open(fileobj=archive) as tar:
+            return {
+                m.name: (m.type, m.mode, m.uid, int(m.mtime), m.size, m.chksum > 0)
+                for m in tar
+            }
+
+    assert contents(out) == contents(expected)
+
+
+def make_sparse(path: Path, size: int, data: list[int]) -> Path:
+    with open(path, "wb") as f:
+        f.truncate(size)
+        for offset in data:
+            f.seek(offset)
+            f.write(offset.to_bytes(8, "big") * 512)
+    return path
+
+
+def test_data_regions(tmp_path: Path):
+    mib = 1024 * 1024
+    path = make_sparse(tmp_path / "image", 8 * mib, [mib, 3 * mib])
+    regions = tarpack.data_regions(path, 8 * mib)
+    if regions is None:
+        pytest.skip("No SEEK_DATA support for this filesystem")
+
+    assert regions == [(mib, 4096), (3 * mib, 4096), (8 * mib, 0)]
+    (tmp_path / "dense").write_bytes(os.urandom(8192))
+    assert tarpack.data_regions(tmp_path / "dense", 8192) is None
+
+
+def test_write_tar_sparse(tmp_path: Path, mocker):
+    mib = 1024 * 1024
+    root = tmp_path / "src"
+    root.mkdir()
+    data = [(2 * i + 1) * mib for i in range(30)]  # Needs extension blocks
+    make_sparse(root / ("i" * 120), 64 * mib, data)
+    make_sparse(root / "holes", 4 * mib, [])
+    if tarpack.data_regions(root / "holes", 4 * mib) is None:
+        pytest.skip("No SEEK_DATA support for this filesystem")
+    sparse = mocker.Mock(return_value=True)
+
+    out = io.BytesIO()
+    write_tar(out, members(root, "dst"), sparse=sparse)
+
+    sparse.assert_called()
+    assert len(out.getvalue()) < 2 * mib
+    out.seek(0)
+    with tarfile.open(fileobj=out) as tar:
+        image = tar.getmember(f"dst/{'i' * 120}")
+        assert image.issparse() and image.size == 64 * mib
+        assert image.sparse == [(offset, 4096) for offset in data]
+        content = tar.extractfile(image).read()  # type: ignore
+        assert content == (root / image.name.split("/")[-1]).read_bytes()
+        assert tar.getmember("dst/holes").size == 4 * mib
+
+    sparse.return_value = False
+    dense = io.BytesIO()
+    write_tar(dense, members(root, "dst"), sparse=sparse)
+    assert len(dense.getvalue()) > 64 * mib
+
+
+@pytest.mark.skipif(not GNU_TAR, reason="Needs GNU tar")
+def test_write_tar_sparse_extracts_with_gnu_tar(tmp_path: Path):
+    mib = 1024 * 1024
+    source = tmp_path / "src"
+    source.mkdir()
+    make_sparse(source / "image", 16 * mib, [0, 5 * mib, 9 * mib])
+    archive = tmp_path / "out.tar"
+    with open(archive, "wb") as f:
+        write_tar(f, members(source, "dst"), sparse=lambda: True)
+
+    target = tmp_path / "target"
+    target.mkdir()
+    subprocess.run(["tar", "xf", str(archive), "-C", str(target)], check=True)
+
+    extracted = target / "dst" / "image"
+    assert extracted.read_bytes() == (source / "image").read_bytes()
+    assert extracted.stat().st_blocks * 512 < mib
@@ -0,0 +1,81 @@
+import json
+import logging
+import threading
+from pathlib import Path
+
+import pytest
+from kubernetes import client
+
+from kodman.timings import Timings
+from kodman.transfer import cp_k8s
+
+LOG = logging.getLogger("test")
+
+
+def test_spans_and_counters():
+    timings = Timings()
+    with timings.span("run.upload", pod="a") as span:
+        span["bytes"] = 10
+    with pytest.raises(ValueError), timings.span("run.upload", pod="b"):
+        raise ValueError("Spans are recorded on errors too")
+    threads = [
+        threading.Thread(target=timings.count, args=("bytes.logs", 5)) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    report = timings.report("run")
+
+    assert [s["pod"] for s in report["spans"]] == ["a", "b"]
+    assert report["spans"][0]["bytes"] == 10
+    assert report["phases"]["run.upload"] == pytest.approx(
+        sum(s["seconds"] for s in report["spans"])
+    )
+    assert report["counters"] == {"bytes.logs": 20}
+    assert report["command"] == "run"
+
+
+def test_count_calls():
+    timings = Timings()
+    api = client.CoreV1Api(api_client=timings.count_calls(client.ApiClient()))
+    for name in ("a", "b"):
+        api.api_client.param_serialize(
+            "GET", "/api/v1/namespaces/{namespace}/pods/{name}", {"name": name}
+        )
+
+    assert timings.api_calls == {"GET /api/v1/namespaces/{namespace}/pods/{name}": 2}
+
+
+def test_cp_k8s_timings(mocker, data: Path):
+    resp = mocker.MagicMock()
+    resp.is_open.return_value = True
+    resp.peek_channel.return_value = ""
+    mocker.patch("kodman.transfer.stream", return_value=resp)
+    timings = Timings()
+
+    stats = cp_k8s(
+        mocker.MagicMock(), "ns", "pod", "init", data, Path("/t"), LOG, timings=timings
+    )
+
+    report = timings.report()
+    assert list(report["phases"]) == ["upload.connect", "upload.send"]
+    assert report["spans"][1]["wire_bytes"] == stats.wire_bytes
+    assert report["counters"] == {
+        "bytes.raw": stats.raw_bytes,
+        "bytes.wire": stats.wire_bytes,
+    }
+
+
+def test_write(tmp_path: Path, capsys):
+    timings = Timings()
+    with timings.span("delete", pod="a", wait=False):
+        pass
+
+    timings.write(str(tmp_path / "timings.json"), "run")
+    timings.write("-")
+
+    report = json.loads((tmp_path / "timings.json").read_text())
+    assert report["spans"][0]["name"] == "delete"
+    assert json.loads(capsys.readouterr().err)["phases"] == report["phases"]
@@ -0,0 +1,275 @@
+import io
+import logging
+import os
+import tarfile
+import threading
+import time
+from pathlib import Path, PurePosixPath
+
+import pytest
+from kubernetes.stream.ws_client import V5_CHANNEL_PROTOCOL
+
+from kodman.compression import CODECS
+from kodman.transfer import (
+    CHUNK_SIZE,
+    FRAME_SECONDS,
+    MAX_CHUNK_SIZE,
+    MIN_CHUNK_SIZE,
+    ChunkPipe,
+    ChunkSizer,
+    cp_from_k8s,
+    cp_k8s,
+    extract_tar,
+    plan_shards,
+    produce_tar,
+)
+
+LOG = logging.getLogger("test")
+
+
+def test_chunk_pipe_regroups_writes():
+    pipe = ChunkPipe(chunk_size=4, depth=8)
+    pipe.write(b"abcdef")
+    pipe.write(b"ghi")
+    pipe.close()
+    assert list(pipe) == [b"abcd", b"efgh", b"i"]
+
+
+def test_chunk_pipe_is_bounded():
+    pipe = ChunkPipe(chunk_size=1, depth=2)
+    writer = threading.Thread(target=pipe.write, args=(b"abcd",), daemon=True)
+    writer.start()
+    writer.join(timeout=0.5)
+    assert writer.is_alive()  # Blocked until the receiver catches up
+    chunks = iter(pipe)
+    assert next(chunks) == b"a"
+    assert next(chunks) == b"b"
+    writer.join(timeout=1)
+    assert not writer.is_alive()
+
+
+def test_chunk_pipe_abort_unblocks_writer():
+    pipe = ChunkPipe(chunk_size=1, depth=1)
+    pipe.write(b"a")
+    pipe.abort()
+    with pytest.raises(BrokenPipeError):
+        pipe.write(b"b")
+
+
+def test_chunk_pipe_forwards_producer_errors():
+    pipe = ChunkPipe()
+    pipe.fail(FileNotFoundError("gone"))
+    with pytest.raises(FileNotFoundError):
+        list(pipe)
+
+
+def test_produce_tar(data: Path):
+    pipe = ChunkPipe(chunk_size=512)
+    writer = CODECS["none"].writer(pipe)
+    thread = threading.Thread(
+        target=produce_tar, args=(data, Path("/test"), writer, pipe)
+    )
+    thread.start()
+    archive = b"".join(pipe)
+    thread.join()
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        member = tar.extractfile("test/to_mount.txt")
+        assert member and member.read().strip() == b"test data"
+
+
+def fake_exec(mocker, **kwargs):
+    """Exec session that stays open until closed, as seen by the monitor."""
+    resp = mocker.MagicMock(**kwargs)
+    resp.is_open.return_value = True
+    resp.peek_channel.return_value = ""
+    return resp
+
+
+def test_cp_k8s_streams_archive(mocker, data: Path):
+    resp = fake_exec(mocker)
+    mocker.patch("kodman.transfer.stream", return_value=resp)
+
+    cp_k8s(mocker.MagicMock(), "default", "pod", "init", data, Path("/test"), LOG)
+
+    archive = b"".join(call.args[0] for call in resp.write_stdin.call_args_list)
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        assert "test/to_mount.txt" in tar.getnames()
+    resp.close.assert_called_once()
+
+
+@pytest.mark.parametrize("status", ["Success", "Failure"])
+def test_cp_k8s_waits_for_then(mocker, data: Path, status: str):
+    resp = fake_exec(mocker, subprotocol=V5_CHANNEL_PROTOCOL)
+    resp.read_stderr.return_value = "tar: short read\n"
+    resp.close_channel.side_effect = lambda channel: resp.peek_channel.configure_mock(
+        return_value=f"status: {status}\n"
+    )
+    mock_stream = mocker.patch("kodman.transfer.stream", return_value=resp)
+
+    def upload():
+        kube_conn = mocker.MagicMock()
+        return cp_k8s(
+            kube_conn, "default", "pod", "init", data, Path("/t"), LOG, then="go"
+        )
+
+    if status == "Failure":
+        with pytest.raises(RuntimeError, match="failed: tar: short read"):
+            upload()
+    else:
+        upload()
+
+    assert mock_stream.call_args.kwargs["command"][-1].endswith(" && go")
+    resp.close_channel.assert_called_once_with(0)
+    resp.close.assert_called_once()
+
+
+def test_cp_k8s_aborts_on_remote_failure(mocker, tmp_path: Path):
+    (tmp_path / "big.bin").write_bytes(os.urandom(8 * 1024 * 1024))
+    resp = fake_exec(mocker)
+    resp.read_stderr.return_value = "tar: /data: Cannot mkdir: Permission denied"
+    failure = "status: Failure\nreason: NonZeroExitCode\n"
+
+    def write_stdin(chunk):
+        if resp.write_stdin.call_count == 2:
+            resp.peek_channel.return_value = failure
+            time.sleep(0.2)  # Let the monitor see it
+
+    resp.write_stdin.side_effect = write_stdin
+    mocker.patch("kodman.transfer.stream", return_value=resp)
+
+    with pytest.raises(RuntimeError, match="Cannot mkdir: Permission denied"):
+        cp_k8s(mocker.MagicMock(), "default", "pod", "init", tmp_path, Path("/d"), LOG)
+    assert resp.write_stdin.call_count == 2
+    resp.close.assert_called_once()
+
+
+def test_chunk_sizer_follows_throughput():
+    sizer = ChunkSizer(size=CHUNK_SIZE)
+    for _ in range(20):
+        sizer.record(sizer.size, sizer.size / 1e6)  # 1 MB/s link
+    assert sizer.size == MIN_CHUNK_SIZE
+    for _ in range(20):
+        sizer.record(sizer.size, sizer.size / 1e9)  # 1 GB/s link
+    assert sizer.size == MAX_CHUNK_SIZE
+    for _ in range(40):
+        sizer.record(sizer.size, sizer.size / 40e6)
+    assert sizer.size == pytest.approx(40e6 * FRAME_SECONDS, rel=0.01)
+    assert sizer.throughput == pytest.approx(40e6, rel=0.01)
+
+
+@pytest.mark.parametrize("name", ["gzip", "xz"])
+def test_cp_k8s_compresses_archive(mocker, data: Path, name: str):
+    resp = fake_exec(mocker)
+    mock_stream = mocker.patch("kodman.transfer.stream", return_value=resp)
+
+    codec = CODECS[name]
+    stats = cp_k8s(
+        mocker.MagicMock(), "default", "pod", "init", data, Path("/test"), LOG, codec
+    )
+
+    archive = b"".join(call.args[0] for call in resp.write_stdin.call_args_list)
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:  # Detects compression
+        assert "test/to_mount.txt" in tar.getnames()
+    assert stats.wire_bytes == len(archive) < stats.raw_bytes
+    assert mock_stream.call_args.kwargs["command"] == codec.remote_command()
+
+
+def test_plan_shards_balances_by_size(tmp_path: Path):
+    sizes = [900, 500, 400, 300, 200, 100]
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "empty").mkdir()
+    for i, size in enumerate(sizes):
+        (tmp_path / "sub" / f"{i}.bin").write_bytes(bytes(size))
+
+    shards = plan_shards(tmp_path, Path("/dst"), 2)
+
+    assert len(shards) == 2
+    arcnames = [arcname for shard in shards for _, arcname in shard]
+    assert "/dst/empty" in [arcname for _, arcname in shards[0]]
+    assert sorted(a for a in arcnames if a.endswith(".bin")) == [
+        f"/dst/sub/{i}.bin" for i in range(len(sizes))
+    ]
+    loads = [
+        sum(path.stat().st_size for path, _ in shard if path.is_file())
+        for shard in shards
+    ]
+    assert abs(loads[0] - loads[1]) <= 100
+
+
+def test_plan_shards_keeps_hardlinks_together(tmp_path: Path):
+    for i in range(4):
+        (tmp_path / f"{i}.bin").write_bytes(bytes(100))
+    for i in range(3):
+        os.link(tmp_path / "0.bin", tmp_path / f"link{i}")
+
+    shards = plan_shards(tmp_path, Path("/dst"), 4)
+
+    (linked,) = [s for s in shards if any(a == "/dst/0.bin" for _, a in s)]
+    names = {"/dst/0.bin", "/dst/link0", "/dst/link1", "/dst/link2"}
+    assert names <= {arcname for _, arcname in linked}
+
+
+def make_archive(files: dict[str, bytes], mtime: int = 1000) -> bytes:
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode="w") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size, info.mtime = len(content), mtime
+            tar.addfile(info, io.BytesIO(content))
+    return out.getvalue()
+
+
+def test_extract_tar_skips_unchanged(tmp_path: Path):
+    target = tmp_path / "out"
+    (target / "sub").mkdir(parents=True)
+    (target / "same.txt").write_text("same\n")
+    os.utime(target / "same.txt", (1000, 1000))
+    (target / "sub" / "old.txt").write_text("old\n")
+    archive = make_archive(
+        {"0/same.txt": b"same\n", "0/sub/old.txt": b"new\n", "0/new.txt": b"!"}
+    )
+
+    assert extract_tar(io.BytesIO(archive), "0", target) == (2, 5)
+    assert (target / "sub" / "old.txt").read_text() == "new\n"
+
+    with pytest.raises(ValueError, match="Unexpected path"):
+        extract_tar(io.BytesIO(make_archive({"1/x": b""})), "0", target)
+
+
+def test_extract_tar_skips_refused_members(tmp_path: Path, capsys):
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode="w") as tar:
+        link = tarfile.TarInfo("0/latest")
+        link.type, link.linkname = tarfile.SYMTYPE, "/out/build-1"
+        tar.addfile(link)
+        info = tarfile.TarInfo("0/result.txt")
+        info.size = 3
+        tar.addfile(info, io.BytesIO(b"ok\n"))
+    target = tmp_path / "out"
+
+    assert extract_tar(io.BytesIO(out.getvalue()), "0", target) == (1, 3)
+    assert (target / "result.txt").read_text() == "ok\n"
+    assert not (target / "latest").is_symlink()
+    assert capsys.readouterr().err.startswith("Warning: Not copying out/latest")
+
+
+@pytest.mark.parametrize("status", ["Success", "Failure"])
+def test_cp_from_k8s_streams(mocker, tmp_path: Path, status):
+    archive = make_archive({"out/a.bin": os.urandom(3 * 1024 * 1024)})
+    frames = [archive[i : i + 100_000] for i in range(0, len(archive), 100_000)]
+    statuses = [b""] * (len(frames) - 1) + [f"status: {status}".encode()]
+    resp = fake_exec(mocker)
+    resp.read_all.side_effect = frames
+    resp.read_channel.side_effect = statuses
+    mocker.patch("kodman.transfer.stream", return_value=resp)
+    args = (mocker.MagicMock(), "ns", "pod", "sidecar", PurePosixPath("/out"))
+
+    if status == "Failure":
+        with pytest.raises(RuntimeError, match="Copy from pod failed"):
+            cp_from_k8s(*args, tmp_path / "dest", LOG)
+        return
+    stats = cp_from_k8s(*args, tmp_path / "dest", LOG)
+
+    assert stats.wire_bytes == len(archive)
+    assert stats.raw_bytes == (tmp_path / "dest" / "a.bin").stat().st_size
+    resp.close.assert_called_once()